@@ -0,0 +1,291 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+'''
+Python interface for embedding webapp-config.
+
+The functions run the same operations as the command line tool, but in
+the calling process. Failures raise exceptions instead of terminating
+the process. All calls share the caches of the process: the answers
+of the package manager, the users and groups and the imported modules.
+
+  from WebappConfig import api
+
+  result = api.install('www-apps/phpmyadmin', '5.2.1',
+                       host = 'www.example.org', directory = 'pma')
+  print(result.installdir)
+
+  for i in api.list_installs('www-apps/phpmyadmin'):
+      print(i['installdir'])
+'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import contextlib, io, json, os, time, traceback
+
+from WebappConfig.debug       import OUT
+
+# ========================================================================
+# Exceptions
+# ------------------------------------------------------------------------
+
+class WebappConfigError(Exception):
+    '''
+    Base class of all errors. Carries the exit status the command line
+    tool would have returned and the output of the failed operation.
+    '''
+
+    def __init__(self, message, status = 1, output = '', messages = ''):
+        Exception.__init__(self, message)
+        self.status   = status
+        self.output   = output
+        self.messages = messages
+
+class UsageError(WebappConfigError):
+    ''' The arguments of the operation are invalid.'''
+
+class ConfigurationError(WebappConfigError):
+    ''' The configuration file or a configuration value is invalid.'''
+
+class OperationError(WebappConfigError):
+    ''' The operation itself failed.'''
+
+# ========================================================================
+# Results
+# ------------------------------------------------------------------------
+
+class Result:
+    '''
+    The outcome of an operation.
+
+    output     - what the operation wrote to stdout
+    messages   - the informational messages, warnings and errors
+    records    - the structured records written by the operation if
+                 it was run with --format json or ndjson
+    installdir - the installation directory the operation worked on
+    time       - the time the operation took in seconds
+
+    >>> Result(['x'], 0, '{ this is php\\n', '', '', 0).records
+    []
+    >>> Result(['x'], 0, '[{"a": 1}\\n,{"b": 2}\\n]\\n', '', '', 0,
+    ...        'json').records
+    [{'a': 1}, {'b': 2}]
+    >>> Result(['x'], 0, '{"a": 1}\\n{ this is php\\n', '', '', 0,
+    ...        'ndjson').records
+    [{'a': 1}]
+    '''
+
+    def __init__(self, args, status, output, messages, installdir, elapsed,
+                 output_format = 'text'):
+
+        self.args       = args
+        self.status     = status
+        self.output     = output
+        self.messages   = messages
+        self.installdir = installdir
+        self.time       = elapsed
+        self.records    = []
+
+        if output_format not in ['json', 'ndjson']:
+            return
+
+        # Every record is written on a line of its own. In a JSON array
+        # it is preceded by the opening bracket or a comma.
+        for i in output.splitlines():
+            if output_format == 'json' and i[:1] in ['[', ',']:
+                i = i[1:]
+            if not i.startswith('{'):
+                continue
+            try:
+                self.records.append(json.loads(i))
+            except ValueError:
+                pass
+
+    def __repr__(self):
+        return ('<Result ' + ' '.join(self.args) + ': status '
+                + str(self.status) + '>')
+
+# ========================================================================
+# Context
+# ------------------------------------------------------------------------
+
+class Context:
+    '''
+    Runs operations in this process. The arguments given here are added
+    to every operation, e.g. Context(['-D', 'vhost_server=nginx']).
+
+    The output settings of OUT and the umask are restored after each
+    operation, so operations do not affect the calling program.
+    '''
+
+    def __init__(self, args = None, pretend = False, verbose = False):
+
+        self.args = list(args or [])
+
+        if pretend:
+            self.args.append('--pretend')
+        if verbose:
+            self.args.append('--verbose')
+
+    def run(self, args, combined = False, expect = (0,)):
+        '''
+        Runs webapp-config with the given command line arguments and
+        returns a Result. Raises a WebappConfigError if an error was
+        reported or the exit status is not listed in expect. With
+        combined set, the messages are written to the output in the
+        order they appear.
+        '''
+        from WebappConfig.config import Config
+
+        args     = list(args) + self.args
+        output   = io.StringIO()
+        messages = output if combined else io.StringIO()
+
+        state = dict(OUT.__dict__)
+        umask = os.umask(0o022)
+        os.umask(umask)
+
+        OUT.color_off()
+        OUT.error_out = messages
+        OUT.debug_out = messages
+        OUT.has_error = False
+
+        config = None
+        phase  = 'parse'
+        status = 1
+        start  = time.time()
+
+        try:
+            with contextlib.redirect_stdout(output):
+                with contextlib.redirect_stderr(messages):
+                    try:
+                        config = Config()
+                        config.parseparams(args)
+                        phase = 'run'
+                        config.run()
+                        status = 0
+                    except SystemExit as e:
+                        if e.code is None or isinstance(e.code, int):
+                            status = e.code or 0
+                        else:
+                            print(e.code)
+                    except Exception:
+                        traceback.print_exc()
+        finally:
+            failed = OUT.has_error
+            output_format = OUT.output_format
+            OUT.__dict__.update(state)
+            os.umask(umask)
+
+        result = Result(args, status, output.getvalue(),
+                        '' if combined else messages.getvalue(),
+                        config.installdir() if config else '',
+                        time.time() - start, output_format)
+
+        if status in expect and not (status and failed):
+            return result
+
+        error = (result.messages or result.output).strip()
+
+        # Invalid arguments make the option parser exit with status 2,
+        # even if they are only noticed while running the operation
+        if status == 2:
+            raise UsageError(error, status, result.output, result.messages)
+        if phase == 'parse':
+            raise ConfigurationError(error, status, result.output,
+                                     result.messages)
+        raise OperationError(error, status, result.output, result.messages)
+
+# ------------------------------------------------------------------------
+# Context shared by the functions below
+# ------------------------------------------------------------------------
+
+CONTEXT = Context()
+
+# ========================================================================
+# Operations
+# ------------------------------------------------------------------------
+
+def location(host, directory, server = None, secure = False):
+    ''' Returns the arguments selecting the installation location.'''
+
+    args = []
+
+    if host:
+        args += ['-h', host]
+    if directory:
+        args += ['-d', directory]
+    if server:
+        args += ['-s', server]
+    if secure:
+        args += ['--secure']
+
+    return args
+
+def install(package, version, host = None, directory = None,
+            server = None, secure = False, soft = False, context = None):
+    ''' Installs a web application. Returns a Result.'''
+
+    args = ['-I', package, version] + location(host, directory, server,
+                                               secure)
+    if soft:
+        args.append('--soft')
+
+    return (context or CONTEXT).run(args)
+
+def clean(package, version, host = None, directory = None,
+          secure = False, context = None):
+    ''' Removes a web application. Returns a Result.'''
+
+    return (context or CONTEXT).run(['-C', package, version]
+                                    + location(host, directory, None, secure))
+
+def upgrade(package, version, host = None, directory = None,
+            server = None, secure = False, context = None):
+    ''' Upgrades a web application. Returns a Result.'''
+
+    return (context or CONTEXT).run(['-U', package, version]
+                                    + location(host, directory, server,
+                                               secure))
+
+def list_installs(package = None, version = None, context = None):
+    '''
+    Returns the virtual installs, optionally only those of the given
+    application, as a list of dictionaries.
+    '''
+    args = ['--list-installs'] + [i for i in (package, version) if i]
+
+    return (context or CONTEXT).run(args + ['--format', 'ndjson']).records
+
+def verify(directory, host = None, secure = False, context = None):
+    '''
+    Checks the files of a virtual install. Returns a dictionary for
+    every file that is missing or modified.
+    '''
+    return (context or CONTEXT).run(['--verify', '--format', 'ndjson']
+                                    + location(host, directory, None,
+                                               secure),
+                                    expect = [0, 1]).records
+
+def query(package, version, context = None):
+    ''' Returns the variables webapp.eclass receives as a dictionary.'''
+
+    records = (context or CONTEXT).run(['--query', package, version,
+                                        '--format', 'ndjson']).records
+
+    return dict([(i['name'], i['value']) for i in records])
@@ -0,0 +1,204 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Runs a file of webapp-config operations in a single process.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import contextlib, io, shlex, sys, time
+
+from WebappConfig.debug       import OUT
+
+# ========================================================================
+# Batch handler
+# ------------------------------------------------------------------------
+
+class Batch:
+    '''
+    Every line of the batch file holds the command line arguments of one
+    operation. Empty lines and lines starting with "#" are skipped.
+
+      -I -h www.example.org -d pma www-apps/phpmyadmin 5.2.1
+      -C -h www.example.org -d wiki www-apps/mediawiki 1.39.5
+
+    The operations run one after the other in this process and share
+    its caches: the answers of the package manager, the users and groups
+    and the rendered post-install instructions. A failing operation does
+    not stop the batch. The output of each operation is collected and
+    shown once the operation is complete. The web server is reloaded
+    only once after all operations.
+
+    >>> batch = Batch('-')
+    >>> batch.parse(['# comment', '', '-I -d "my dir" pn 1.0'])
+    [(3, ['-I', '-d', 'my dir', 'pn', '1.0'])]
+    '''
+
+    def __init__(self, path):
+
+        self.path    = path
+        self.results = []
+
+        from WebappConfig.api import Context
+
+        self.context = Context()
+
+    def parse(self, lines):
+        ''' Returns the (line number, arguments) of all operations.'''
+
+        operations = []
+
+        for (number, line) in enumerate(lines, 1):
+
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                operations.append((number, shlex.split(line)))
+            except ValueError as e:
+                OUT.die('Invalid line ' + str(number) + ' in ' + self.path
+                        + ': ' + str(e))
+
+        return operations
+
+    def read(self):
+        ''' Reads the operations from the batch file or stdin.'''
+
+        if self.path == '-':
+            return self.parse(sys.stdin.readlines())
+
+        try:
+            with open(self.path) as f:
+                return self.parse(f.readlines())
+        except IOError as e:
+            OUT.die('Unable to read the batch file ' + self.path + ': '
+                    + str(e))
+
+    def action(self, args):
+        '''
+        Returns the action the arguments ask for, as understood by the
+        option parser (including abbreviated options). Returns None if
+        the arguments cannot be parsed.
+        '''
+        from WebappConfig.config import Config
+
+        config = Config()
+        config.setup_parser()
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    options = vars(config.parser.parse_args(args))
+        except SystemExit:
+            return None
+
+        return config.select_work(options)
+
+    def execute(self, args):
+        '''
+        Runs a single operation. Returns the exit status and the output of
+        the operation.
+        '''
+        from WebappConfig.api import WebappConfigError
+
+        if self.action(args) in ['batch', 'daemon']:
+            return 1, ('Batch operations cannot start another batch or a'
+                       ' daemon.\n')
+
+        try:
+            result = self.context.run(args, combined = True)
+        except WebappConfigError as e:
+            return e.status, e.output
+
+        return result.status, result.output
+
+    def run(self):
+        '''
+        Runs all operations and shows the summary. Returns the exit
+        status of the batch.
+        '''
+        from WebappConfig.reload import RELOAD
+
+        operations = self.read()
+
+        # Collect the reload commands of all operations
+        reloads = []
+        RELOAD.handoff = reloads.append
+
+        try:
+            for (number, args) in operations:
+
+                OUT.info('Running line ' + str(number) + ': '
+                         + ' '.join(args))
+
+                start = time.time()
+                (status, output) = self.execute(args)
+                elapsed = time.time() - start
+
+                if output and not OUT.structured():
+                    OUT.notice('>>> ' + str(number) + ': ' + ' '.join(args))
+                    OUT.notice(output.rstrip('\n'))
+
+                self.results.append({'line'   : number,
+                                     'args'   : args,
+                                     'status' : status,
+                                     'time'   : elapsed,
+                                     'output' : output})
+        finally:
+            RELOAD.handoff = None
+
+        for i in reloads:
+            RELOAD.request(i)
+        RELOAD.flush()
+
+        self.summary()
+
+        failed = [i for i in self.results if i['status']]
+
+        return 1 if failed else 0
+
+    def summary(self):
+        ''' Shows the outcome of every operation.'''
+
+        if OUT.structured():
+            for i in self.results:
+                OUT.record(i)
+            OUT.end_records()
+            return
+
+        rows = [('Line', 'Status', 'Time', 'Operation')]
+
+        for i in self.results:
+            rows.append((str(i['line']),
+                         'ok' if not i['status'] else
+                         'failed (' + str(i['status']) + ')',
+                         '%.2fs' % i['time'],
+                         ' '.join(i['args'])))
+
+        widths = [max([len(row[j]) for row in rows]) for j in range(3)]
+
+        OUT.notice('')
+        for row in rows:
+            OUT.notice('  '.join([row[j].ljust(widths[j]) for j in range(3)]
+                                 + [row[3]]))
+
+        failed = len([i for i in self.results if i['status']])
+
+        OUT.notice('\n' + str(len(self.results)) + ' operations, '
+                   + str(failed) + ' failed.')
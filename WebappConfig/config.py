@@ -19,7 +19,7 @@
 # Dependencies
 # ------------------------------------------------------------------------
 
-import sys, os, os.path, re, socket, time
+import copy, sys, os, os.path, re, time
 
 if sys.hexversion >= 0x3000000:
     # Python 3
@@ -31,11 +31,10 @@ else:
     import ConfigParser as configparser
     from ConfigParser import SafeConfigParser as configparser_ConfigParser
 
-import WebappConfig.server
 import WebappConfig.permissions as Perm
 import WebappConfig.wrapper as wrapper
 
-from argparse             import ArgumentParser
+from argparse             import ArgumentParser, HelpFormatter
 from WebappConfig.debug   import OUT
 from WebappConfig.eprefix import EPREFIX
 from WebappConfig.version import WCVERSION
@@ -43,27 +42,150 @@ from WebappConfig.version import WCVERSION
 from WebappConfig.permissions import PermissionMap
 
 
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+def get_hostname():
+    ''' Returns the fully qualified name of this host.'''
+    import socket
+
+    try:
+        return socket.gethostbyaddr(socket.gethostname())[0]
+    except Exception:
+        return 'localhost'
+
 # ========================================================================
 # BashParser class
 # ------------------------------------------------------------------------
 
+if sys.hexversion >= 0x3000000:
+
+    class RecordingInterpolation(ExtendedInterpolation):
+        ''' Tells the parser which variables a value refers to.'''
+
+        def _interpolate_some(self, parser, option, accum, rest, section,
+                              map, depth):
+            parser.uses(self._KEYCRE.findall(rest))
+            ExtendedInterpolation._interpolate_some(self, parser, option,
+                                                    accum, rest, section,
+                                                    map, depth)
+
 class BashConfigParser(configparser_ConfigParser):
 
     _interpvar_match = re.compile(r"(%\(([^)]+)\)s|\$\{([^}]+)\})").match
 
-    def __init__(self, defaults=None):
+    def __init__(self, defaults=None, lazy=None):
         self.error_action = 1
+
+        # Defaults that are expensive to determine. They are stored as a
+        # placeholder and only computed once a value containing the
+        # placeholder is read.
+        self.lazy = lazy or {}
+
+        # Interpolated values by (section, option) and, for every option,
+        # the cached values that were built from it. Needs to be set up
+        # before the defaults are added.
+        self.__values  = {}
+        self.__users   = {}
+        self.__reading = []
+
+        defaults = dict(defaults or {})
+        for i in self.lazy:
+            defaults[i] = self.placeholder(i)
+
         if sys.hexversion >= 0x3000000:
-            configparser_ConfigParser.__init__(self, defaults, interpolation=ExtendedInterpolation())
+            configparser_ConfigParser.__init__(self, defaults, interpolation=RecordingInterpolation())
         else:
             configparser_ConfigParser.__init__(self, defaults)
 
+    def placeholder(self, option):
+        return '\0' + option + '\0'
+
+    def resolve_lazy(self, value):
+        ''' Replaces the placeholders of lazy defaults in value.'''
+        for i in list(self.lazy.keys()):
+            if self.placeholder(i) in value:
+                OUT.debug('Determining default for ' + i, 7)
+                self.defaults()[i] = self.lazy.pop(i)()
+        for i in self.defaults():
+            if self.placeholder(i) in value:
+                value = value.replace(self.placeholder(i),
+                                      self.defaults()[i])
+        return value
+
     def on_error(self, action = 0):
         self.error_action = action
 
+    def invalidate(self, option = None):
+        '''
+        Forgets the interpolated values built from option or all values
+        if no option is given.
+        '''
+        if option is None:
+            self.__values  = {}
+            self.__users   = {}
+            return
+
+        for i in self.__users.pop(self.optionxform(option), ()):
+            self.__values.pop(i, None)
+
+    def uses(self, names):
+        ''' Records the variables used by the value being read.'''
+        if self.__reading:
+            for i in names:
+                self.__reading[-1].add(self.optionxform(i.split(':')[-1]))
+
+    def set(self, section, option, value = None):
+        configparser_ConfigParser.set(self, section, option, value)
+        self.invalidate(option)
+
+    def remove_option(self, section, option):
+        self.invalidate(option)
+        return configparser_ConfigParser.remove_option(self, section, option)
+
+    def remove_section(self, section):
+        self.invalidate()
+        return configparser_ConfigParser.remove_section(self, section)
+
+    def _read(self, *args, **kwargs):
+        self.invalidate()
+        return configparser_ConfigParser._read(self, *args, **kwargs)
+
     def get(self, section, option, *args, **kwargs):
+        option = self.optionxform(option)
+
+        # Record the options read while interpolating another value
+        if self.__reading:
+            self.__reading[-1].add(option)
+
+        cached = (not args and not kwargs.get('raw')
+                  and kwargs.get('vars') is None and not 'fallback' in kwargs)
+        key    = (section, option)
+
+        if cached and key in self.__values:
+            if self.__reading:
+                self.__reading[-1].update(self.__values[key][1])
+            return self.__values[key][0]
+
         try:
-            return configparser_ConfigParser.get(self, section, option, *args, **kwargs)
+            self.__reading.append(set([option]))
+            try:
+                value = configparser_ConfigParser.get(self, section, option, *args, **kwargs)
+            finally:
+                used = self.__reading.pop()
+            # Interpolation reads the raw values through this method as
+            # well, so placeholders are only replaced in the final value.
+            if not kwargs.get('raw') and isinstance(value, str) \
+                    and '\0' in value:
+                value = self.resolve_lazy(value)
+            if cached:
+                self.__values[key] = (value, used)
+                for i in used:
+                    self.__users.setdefault(i, set()).add(key)
+            if self.__reading:
+                self.__reading[-1].update(used)
+            return value
         except Exception as e:
             error = '\nThere is a problem with your configuration file or' \
                 ' an environment variable.\n' \
@@ -109,6 +231,7 @@ class BashConfigParser(configparser_ConfigParser):
                     var = m.group(3)
                 var = self.optionxform(var)
                 rest = rest[m.end():]
+                self.uses([var])
                 try:
                     v = map[var]
                 except KeyError:
@@ -203,6 +326,32 @@ class BashConfigParser(configparser_ConfigParser):
         if e:
             raise e
 
+# ========================================================================
+# Help formatter
+# ------------------------------------------------------------------------
+
+class ConfigHelpFormatter(HelpFormatter):
+    '''
+    Allows help texts to refer to config values as %(option)s. The
+    values are only read once the help is actually shown.
+    '''
+
+    def __init__(self, prog, config):
+        HelpFormatter.__init__(self, prog)
+        self.config = config
+
+    def _expand_help(self, action):
+
+        def value(m):
+            if m.group(1) == 'prog' or m.group(1) in vars(action):
+                return m.group(0)
+            return self.config.get('USER', m.group(1)).replace('%', '%%')
+
+        action = copy.copy(action)
+        action.help = re.sub(r'%\((\w+)\)s', value, action.help)
+
+        return HelpFormatter._expand_help(self, action)
+
 # ========================================================================
 # Config class
 # ------------------------------------------------------------------------
@@ -216,12 +365,6 @@ class Config:
 
         ## These are the webapp-config default configuration values.
 
-        hostname = 'localhost'
-        try:
-            hostname = socket.gethostbyaddr(socket.gethostname())[0]
-        except:
-            pass
-
         self.__d = {
             'config_protect'               : '',
             # Necessary to load the config file
@@ -239,7 +382,6 @@ class Config:
             'g_perms_dotconfig'            : '0600',
             # USER section (only 'get' these variables from
             # the USER section)
-            'vhost_hostname'               : hostname,
             'vhost_server'                 : 'apache',
             'vhost_default_uid'            : '0',
             'vhost_default_gid'            : '0',
@@ -280,8 +422,13 @@ class Config:
             'my_errorsdir'      : '${my_hostrootdir}/${my_errorsbase}',
             'g_cgibindir'      : '${vhost_root}/${my_cgibinbase}',
             'my_approot'        : EPREFIX + '/usr/share/webapps',
+            'my_serverdir'      : EPREFIX + '/etc/vhosts/webapp-config.d/servers',
             'package_manager'   : 'portage',
             'allow_absolute'    : 'no',
+            'reload_debounce'   : '0',
+            'vhost_hook_timeout': '0',
+            'nss_cache_ttl'     : '0',
+            'daemon_socket'     : EPREFIX + '/run/webapp-config.sock',
             'my_hostrootbase'   : 'hostroot',
             'my_cgibinbase'     : 'cgi-bin',
             'my_iconsbase'      : 'icons',
@@ -298,16 +445,28 @@ class Config:
             }
 
         # Setup basic defaults
-        self.config = BashConfigParser(self.__d)
+        # The hostname is only looked up if it is actually needed as
+        # reverse DNS may be slow
+        self.config = BashConfigParser(self.__d,
+                                       {'vhost_hostname' : get_hostname})
         self.config.add_section('USER')
 
-        # Setup the command line parser
-        self.setup_parser()
+        # The command line parser is set up by parseparams()
+        self.parser = None
 
         self.work = ''
 
         self.flag_dir = False
 
+        # Set when continuing an interrupted install or clean
+        self.resuming = False
+
+        # The package replaced by the upgrade that is resumed
+        self.upgraded_from = ''
+
+        # The (package, version) pairs given to --query
+        self.queries = []
+
     def set_configprotect(self):
         self.config.set('USER', 'config_protect',
            wrapper.config_protect(self.maybe_get('cat'),
@@ -380,7 +539,9 @@ class Config:
 
         self.parser  = ArgumentParser(
             usage    = '%(prog)s [-ICU] [-dghus] <APPLICATION VERSION>',
-            add_help = False)
+            add_help = False,
+            formatter_class = lambda prog: ConfigHelpFormatter(prog,
+                                                               self.config))
 
         self.parser.add_argument('-v',
                                  '--version',
@@ -422,6 +583,52 @@ class Config:
                                nargs = 2,
                                help   = 'Upgrade a web application')
 
+        main_opts.add_argument('-mc',
+                               '--merge-config',
+                               nargs = 2,
+                               help   = 'Merge the config protected files o'
+                               'f all virtual installs of <application> aft'
+                               'er an upgrade. The version is the one that '
+                               'was upgraded from, its master image is used'
+                               ' as the common base of a three-way merge. F'
+                               'iles without conflicts are merged automatic'
+                               'ally. Only installs upgraded from that vers'
+                               'ion are merged.')
+
+        main_opts.add_argument('--resume',
+                               action = 'store_true',
+                               help   = 'Complete an install, upgrade or rem'
+                               'oval in the installation directory that has'
+                               ' been interrupted. Files already installed '
+                               'are not installed again.')
+
+        main_opts.add_argument('--rollback',
+                               action = 'store_true',
+                               help   = 'Undo an install or upgrade in the i'
+                               'nstallation directory that has been interru'
+                               'pted by removing the files it installed.')
+
+        main_opts.add_argument('--batch',
+                               nargs = 1,
+                               metavar = 'FILE',
+                               help   = 'Run the operations listed in FILE '
+                               '("-" reads them from stdin) one after the o'
+                               'ther in a single process. Every line holds '
+                               'the arguments of one operation, e.g. "-I -h'
+                               ' host -d dir pn pvr". A summary is shown at'
+                               ' the end. The exit status is non-zero if an'
+                               'y operation failed.')
+
+        main_opts.add_argument('--daemon',
+                               nargs = '?',
+                               const = '',
+                               metavar = 'SOCKET',
+                               help   = 'Keep running and handle install, cl'
+                               'ean, upgrade and query requests sent to the '
+                               'Unix socket SOCKET. Default is %(daemon_sock'
+                               'et)s. To change the default, change the valu'
+                               'e of "daemon_socket" in %(my_etcconfig)s')
+
         #-----------------------------------------------------------------
         # Path Options
 
@@ -442,8 +649,7 @@ class Config:
                                'on to serve.  Also affects where some files go.'
                                ' If you get this setting wrong, you may need to'
                                ' re-install the application to correct the pro'
-                               'blem! Default is HOST = '
-                               + self.config.get('USER', 'vhost_hostname') +
+                               'blem! Default is HOST = %(vhost_hostname)s'
                                '. To change the default, change the value of "v'
                                'host_hostname" in '
                                + self.config.get('USER', 'my_etcconfig') +
@@ -590,6 +796,15 @@ class Config:
                                '* in single quotes to stop your shell from expa'
                                'nding it first!!')
 
+        info_opts.add_argument('-fi',
+                               '--find-installs',
+                               nargs = 1,
+                               metavar = 'PATH',
+                               help = 'List all virtual installs located in PA'
+                               'TH or any directory below it. Each install is '
+                               'reported as the package and its installation d'
+                               'irectory.')
+
         info_opts.add_argument('-ls',
                                '--list-servers',
                                action='store_true',
@@ -611,12 +826,30 @@ class Config:
                                help = 'This will list all outdated entries in '
                                'the webapp-config "database".')
 
+        info_opts.add_argument('-rd',
+                               '--rebuild-database',
+                               nargs = 1,
+                               metavar = 'ROOT',
+                               help = 'Scan ROOT for virtual installs and rege'
+                               'nerate their entries in the webapp-config "dat'
+                               'abase" from the .webapp files found in the ins'
+                               'tallation directories. Entries for installatio'
+                               'ns outside of ROOT are kept.')
+
         info_opts.add_argument('-si',
                                '--show-installed',
                                action='store_true',
                                help = 'Show what application is installed in DI'
                                'R')
 
+        info_opts.add_argument('--verify',
+                               action='store_true',
+                               help = 'Check the files of the application insta'
+                               'lled in DIR against the checksums and link tar'
+                               'gets recorded when they were installed. Exits '
+                               'with status 1 if files are missing or modified'
+                               '.')
+
         info_opts.add_argument('-spi',
                                '--show-postinst',
                                nargs = 2,
@@ -633,7 +866,25 @@ class Config:
                                'instructions when they were shown to you ;-)')
 
         info_opts.add_argument('--query',
-                               nargs=2)
+                               nargs = '+',
+                               metavar = 'APPLICATION VERSION',
+                               help = 'Print the variables of <application>'
+                               ' <version> for webapp.eclass. Several pairs '
+                               'of application and version may be given to '
+                               'query them in one call. The results are cach'
+                               'ed in /var/cache/webapp-config.')
+
+        info_opts.add_argument('--format',
+                               choices = ['text',
+                                          'json',
+                                          'ndjson'],
+                               help = 'Select the output format of --list-inst'
+                               'alls, --find-installs, --list-unused-installs, '
+                               '--list-servers, --show-installed, --verify and '
+                               '--query. "json" writes a JSON array, "ndjson" '
+                               'writes one JSON object per line. Records are w'
+                               'ritten as soon as they are available. All othe'
+                               'r messages go to stderr. Default is "text".')
 
         #-----------------------------------------------------------------
         # Other Options
@@ -720,6 +971,19 @@ class Config:
                     ' variable "' + permission + "'")
         return result
 
+    def resolve_ids(self):
+
+        # All configured users and groups are looked up in one go. The
+        # answers are kept for the rest of the run.
+        Perm.NSS.ttl = float(self.config.get('USER', 'nss_cache_ttl'))
+
+        Perm.NSS.resolve(users  = [self.maybe_get(i + '_uid')
+                                   for i in ['vhost_default', 'vhost_config',
+                                             'vhost_server']],
+                         groups = [self.maybe_get(i + '_gid')
+                                   for i in ['vhost_default', 'vhost_config',
+                                             'vhost_server']])
+
     def get_user(self, user):
         result = None
         try:
@@ -806,10 +1070,16 @@ class Config:
     # Outputs
     #  None
 
-    def parseparams (self):
+    def parseparams (self, args = None):
 
         OUT.debug('Parsing all configuration parameters', 6)
 
+        # The command line arguments unless called for a batch operation
+        if args is None:
+            args = sys.argv[1:]
+
+        self.setup_parser()
+
         # we import /etc/vhosts/webapp-config so that we can snag the
         # defaults to embed in this output
 
@@ -844,13 +1114,17 @@ class Config:
         OUT.debug('Successfully parsed configuration file options', 7)
 
         # Parse the command line
-        options = vars(self.parser.parse_args())
+        options = vars(self.parser.parse_args(args))
 
         OUT.debug('Successfully parsed command line options', 7)
 
         # handle debugging
         OUT.cli_handle(options)
 
+        # handle the output format of query results
+        if options.get('format'):
+            OUT.set_format(options['format'])
+
         # Second config level are environment variables
 
         # Handle -E
@@ -951,28 +1225,55 @@ class Config:
                 self.config.set('USER', 'my_htdocsbase',
                                 '${vhost_htdocs_insecure}')
 
-        # set the action to be performed
-        work = ['install', 'clean', 'upgrade', 'list_installs',
-                'list_servers', 'list_unused_installs',
-                'prune_database', 'show_installed', 'show_postinst',
-                'show_postupgrade', 'check_config', 'query']
-
-        if len(sys.argv) ==  1:
+        # Nothing to do is a usage error as well
+        if not args:
             self.parser.print_help()
-            sys.exit()
+            sys.exit(2)
 
-        for i in work:
-            if options.get(i) != None and options.get(i) != False:
-                self.work = i
-                break
+        # set the action to be performed
+        work = self.select_work(options)
+        if work:
+            self.work = work
 
         if options.get('prune_database'):
             self.prune_action = options.get('prune_database')
 
+        if options.get('rebuild_database'):
+            self.rebuild_root = options.get('rebuild_database')[0]
+
+        if options.get('find_installs'):
+            self.find_path = options.get('find_installs')[0]
+
+        if options.get('daemon') is not None:
+            self.daemon_socket = options.get('daemon')
+
+        if options.get('batch'):
+            self.batch_file = options.get('batch')[0]
+
+        if options.get('query'):
+            args = options['query']
+            if len(args) % 2:
+                self.parser.error('argument --query: expected pairs of '
+                                  'application and version')
+            # Applications given without a category use the category
+            # of the configuration
+            if self.config.has_option('USER', 'cat'):
+                category = self.config.get('USER', 'cat', raw = True)
+            else:
+                category = None
+            for i in range(0, len(args), 2):
+                if '/' in args[i]:
+                    (cat, pn) = args[i].split('/', 1)
+                else:
+                    (cat, pn) = (category, args[i])
+                self.check_version(args[i + 1])
+                self.queries.append((cat, pn, args[i + 1]))
+
         OUT.debug('Checking command line arguments', 1)
 
         if self.work in ['install', 'clean', 'query', 'list_installs',
-                         'show_postinst', 'show_postupgrade', 'upgrade']:
+                         'show_postinst', 'show_postupgrade', 'upgrade',
+                         'merge_config']:
             # get cat / pn
             args = options[self.work]
 
@@ -980,12 +1281,8 @@ class Config:
                 m    = args[0].split('/')
 
                 if self.work == 'list_installs' and len(args) > 2:
-                    msg = os.path.basename(sys.argv[0]) + ': error: argument '\
-                          '-li/--list-installs: expected up to 2 arguments'
-
-                    self.parser.print_usage()
-                    print(msg)
-                    sys.exit()
+                    self.parser.error('argument -li/--list-installs: '
+                                      'expected up to 2 arguments')
 
                 if len(m) == 1:
                     if '*' not in m:
@@ -995,27 +1292,17 @@ class Config:
                     if '*' not in m:
                         self.config.set('USER', 'pn',  m[1])
                 else:
-                    OUT.die('Invalid package name')
+                    self.parser.error('Invalid package name: "' + args[0]
+                                      + '"')
 
                 if len(args) > 1:
                     pvr = args[1]
-                    has_int = False # A package version should have at least one
-                                    # numerical value, but we want to allow for
-                                    # the flexibility of having any alphanumeric
-                                    # value while checking to make sure it's sane.
-
-                    for char in pvr:
-                        if char.isdigit():
-                            has_int = True
-
-                    if not has_int:
-                        OUT.die('Invalid package version: "%(pvr)s"'
-                                % {'pvr': args[1]})
-
+                    self.check_version(pvr)
                     self.config.set('USER', 'pvr', pvr)
 
                 if (not options['dir'] and
-                    self.work not in ('list_installs', 'query')):
+                    self.work not in ('list_installs', 'query',
+                                      'merge_config')):
                     pn  = self.config.get('USER', 'pn')
                     msg = 'Install dir flag not supplied, defaulting to '\
                           '"%(pn)s".' % {'pn': pn}
@@ -1032,22 +1319,98 @@ class Config:
     # --------------------------------------------------------------------
     # Helper functions
 
+    def select_work(self, options):
+        ''' Returns the action requested by the command line options.'''
+
+        work = ['install', 'clean', 'upgrade', 'merge_config', 'resume',
+                'rollback', 'list_installs', 'find_installs', 'list_servers',
+                'list_unused_installs', 'prune_database', 'rebuild_database',
+                'show_installed', 'verify', 'show_postinst',
+                'show_postupgrade', 'check_config', 'query', 'daemon',
+                'batch']
+
+        for i in work:
+            if options.get(i) != None and options.get(i) != False:
+                return i
+
+        return ''
+
     def check_package_set(self):
         if not self.config.has_option('USER', 'pn'):
-            self.parser.print_help()
-            OUT.die('You need to specify at least the application you'
-                    ' would like to handle!')
+            self.parser.error('You need to specify at least the application'
+                              ' you would like to handle!')
         else:
             return self.config.get('USER', 'pn')
 
     def check_version_set(self):
         if not self.config.has_option('USER', 'pvr'):
-            OUT.die('You did not specify which version to handle.\n Use "'
-                    + self.config.get('USER','g_myname') +
-                    ' --help" for usage')
+            self.parser.error('You did not specify which version to handle.')
         else:
             return self.config.get('USER', 'pvr')
 
+    def check_version(self, pvr):
+        has_int = False # A package version should have at least one
+                        # numerical value, but we want to allow for
+                        # the flexibility of having any alphanumeric
+                        # value while checking to make sure it's sane.
+
+        for char in pvr:
+            if char.isdigit():
+                has_int = True
+
+        if not has_int:
+            self.parser.error('Invalid package version: "%(pvr)s"'
+                              % {'pvr': pvr})
+
+    def query_state(self):
+        '''
+        Describes everything the variables reported by --query depend on.
+        The values set by query() itself are left out.
+        '''
+        import socket
+        from WebappConfig.pkgmgr import backend, mtime
+
+        pm = self.config.get('USER', 'package_manager')
+
+        values = [[name, value] for (name, value)
+                  in self.config.items('USER', raw = True)
+                  if not name in ['my_appsuffix', 'persist_suffix',
+                                  'config_protect']]
+
+        return {'config'  : [self.__d['my_etcconfig'],
+                             mtime(self.__d['my_etcconfig'])],
+                'pm'      : [pm, backend(pm).stamp()],
+                'host'    : socket.gethostname(),
+                'values'  : sorted(values)}
+
+    def query(self, cat, pn, pvr):
+        '''
+        Returns the variables of the given package as (name, value)
+        pairs. The value is None if the variable could not be evaluated.
+        '''
+
+        # set my_appsuffix right away
+        self.config.set('USER', 'my_appsuffix',   '/'.join([cat,pn,pvr]))
+        self.config.set('USER', 'persist_suffix', '/'.join([cat,pn,pvr]))
+
+        self.set_vars()
+
+        # List all variables in bash format for the eclass
+        self.config.on_error(2)
+
+        records = []
+
+        for i in self.config.options('USER'):
+            if not i in ['pn', 'pvr']:
+                try:
+                    value = self.config.get('USER', i)
+                except configparser.InterpolationSyntaxError:
+                    value = None
+
+                records.append([i.upper(), value])
+
+        return records
+
     def split_hostname(self):
 
         hostname = self.config.get('USER', 'vhost_hostname')
@@ -1159,10 +1522,63 @@ class Config:
             self.parser.print_help()
             sys.exit(0)
 
+        if self.work in ['install', 'clean', 'upgrade', 'resume', 'rollback']:
+            self.resolve_ids()
+
+        if self.work in ['resume', 'rollback']:
+
+            # Find the journal of the interrupted operation
+            self.__r = wrapper.get_root(self)
+            installdir = self.config.get('USER', 'g_installdir')
+            self.setinstalldir()
+
+            journal = self.create_journal()
+
+            if not journal.exists():
+                OUT.die('Nothing to ' + self.work + '!\nNo interrupted inst'
+                        'all or removal found in ' + self.installdir())
+
+            (header, records) = journal.read()
+
+            self.config.set('USER', 'cat', header.get('category', ''))
+            self.config.set('USER', 'pn',  header.get('package', ''))
+            self.config.set('USER', 'pvr', header.get('version', ''))
+
+            if self.work == 'rollback':
+                self.rollback(journal, header, records)
+            elif (header.get('action') == 'clean'
+                  and not self.create_dotconfig().has_dotconfig()):
+                # Only the install record was left to remove
+                self.create_webapp_db(self.maybe_get('cat'),
+                                      self.maybe_get('pn'),
+                                      self.maybe_get('pvr')).remove(
+                                          self.installdir())
+                if not self.pretend():
+                    journal.discard()
+            else:
+                # Continue with the interrupted action which sets up
+                # the installation directory again
+                self.config.set('USER', 'g_installdir', installdir)
+                self.resuming = True
+                self.upgraded_from = header.get('upgrade', '')
+                self.work = header.get('action')
+
         if self.work == 'list_servers':
-            from WebappConfig.server import listservers
             # List the supported servers
-            listservers()
+            self.create_registry().listservers()
+
+        if self.work == 'batch':
+            # Run the operations listed in the batch file
+            from WebappConfig.batch import Batch
+
+            sys.exit(Batch(self.batch_file).run())
+
+        if self.work == 'daemon':
+            # Handle the requests sent to the socket until terminated
+            from WebappConfig.daemon import Daemon
+
+            Daemon(self, self.daemon_socket).serve()
+            sys.exit(0)
 
         if self.work == 'query':
 
@@ -1171,23 +1587,50 @@ class Config:
             self.check_package_set()
             self.check_version_set()
 
-            # set my_appsuffix right away
-            cat = self.maybe_get('cat')
-            pn  = self.config.get('USER', 'pn')
-            pvr = self.config.get('USER', 'pvr')
-            self.config.set('USER', 'my_appsuffix',   '/'.join([cat,pn,pvr]))
-            self.config.set('USER', 'persist_suffix', '/'.join([cat,pn,pvr]))
+            cache = self.create_query_cache()
 
-            self.set_vars()
+            # Several packages are told apart by a comment line or the
+            # package field of the records
+            batch = len(self.queries) > 1
 
-            # List all variables in bash format for the eclass
-            self.config.on_error(2)
-            for i in self.config.options('USER'):
-                if not i in ['pn', 'pvr']:
-                    try:
-                        print(i.upper() + '="' + self.config.get('USER', i) + '"')
-                    except configparser.InterpolationSyntaxError:
-                        print('# Failed to evaluate: ' + i.upper())
+            for (cat, pn, pvr) in self.queries:
+
+                if cat is None:
+                    self.config.remove_option('USER', 'cat')
+                else:
+                    self.config.set('USER', 'cat', cat)
+
+                self.config.set('USER', 'pn',  pn)
+                self.config.set('USER', 'pvr', pvr)
+
+                cat = self.maybe_get('cat')
+
+                key     = cache.key(self.query_state())
+                records = cache.get(key)
+
+                if records is None:
+                    records = self.query(cat, pn, pvr)
+                    cache.put(key, records)
+
+                if batch and not OUT.structured():
+                    print('# ' + '/'.join([i for i in (cat, pn) if i])
+                          + ' ' + pvr)
+
+                for (name, value) in records:
+                    if OUT.structured():
+                        record = {'name' : name, 'value' : value}
+                        if batch:
+                            record['package'] = '/'.join(
+                                [i for i in (cat, pn) if i])
+                            record['version'] = pvr
+                        OUT.record(record)
+                    elif value is None:
+                        print('# Failed to evaluate: ' + name)
+                    else:
+                        print(name + '="' + value + '"')
+
+            if OUT.structured():
+                OUT.end_records()
 
             sys.exit(0)
 
@@ -1208,6 +1651,13 @@ class Config:
             self.create_webapp_db(  self.maybe_get('cat'),
                                     self.maybe_get('pn'),
                                     self.maybe_get('pvr')).listinstalls()
+        if self.work == 'find_installs':
+            # Look up all virtual installs below the given path in the
+            # installdir index of the virtual install db
+            self.__r = wrapper.get_root(self)
+            self.create_webapp_db('', '', '').findinstalls(
+                re.compile('/+').sub('/', self.__r + self.find_path))
+
         if self.work == 'prune_database':
             # Get the handler for the virtual install db. If the action is equal
             # to clean, then it'll simply prune the "db" of outdated entries.
@@ -1218,6 +1668,67 @@ class Config:
                                     self.maybe_get('pn'),
                                     self.maybe_get('pvr')).prune_database(self.prune_action)
 
+        if self.work == 'rebuild_database':
+            # Recreate the install records from the .webapp files found
+            # in the virtual install locations below the given root.
+            self.__r = wrapper.get_root(self)
+            self.create_webapp_db('', '', '').rebuild(
+                re.compile('/+').sub('/', self.__r + self.rebuild_root),
+                self.maybe_get('my_dotconfig'))
+
+        if self.work == 'merge_config':
+
+            # The user needs to specify the package and the version
+            # that has been upgraded from
+            self.__r = wrapper.get_root(self)
+            wrapper.want_category(self)
+            self.check_package_set()
+            self.check_version_set()
+
+            # The master image of the old version is the common base
+            ws = self.create_webapp_source()
+            if not ws.source_exists('htdocs'):
+                OUT.die('Cannot merge!\nThe master image of '
+                        + ws.package_name() + ' is missing.')
+
+            # Collect the virtual installs of all versions that have
+            # been upgraded from the given version. Any other install
+            # does not share the common base.
+            db = self.create_webapp_db(self.maybe_get('cat'),
+                                       self.config.get('USER', 'pn'), '')
+
+            old = '-'.join([self.config.get('USER', 'pn'),
+                            self.config.get('USER', 'pvr')])
+            if self.maybe_get('cat'):
+                old = self.maybe_get('cat') + '/' + old
+
+            from WebappConfig.dotconfig import DotConfig
+
+            installdirs = []
+
+            for i in sorted(set(entry[3].strip()
+                                for (package, entry) in db.iter_db())):
+                dotconfig = DotConfig(i, self.maybe_get('my_dotconfig'))
+                if dotconfig.has_dotconfig():
+                    dotconfig.read()
+                    previous = dotconfig['WEB_UPGRADEDFROM'] or ''
+                    # The category is optional on both sides
+                    if (previous == old or
+                            (previous.split('/')[-1] == old.split('/')[-1]
+                             and ('/' not in previous or '/' not in old))):
+                        installdirs.append(i)
+                        continue
+                OUT.info('Skipping ' + i + ' (not upgraded from ' + old
+                         + ')', 1)
+
+            from WebappConfig.merge import ConfigMerge
+
+            ConfigMerge(ws.appdir() + '/htdocs',
+                        installdirs,
+                        dotconfig = self.maybe_get('my_dotconfig'),
+                        verbose = self.verbose(),
+                        pretend = self.pretend()).run()
+
         if self.work == 'show_installed':
 
             # This reads a .webapp file in the specified installdir.
@@ -1225,6 +1736,45 @@ class Config:
             self.setinstalldir()
             self.create_dotconfig().show_installed()
 
+        if self.work == 'verify':
+
+            # Compare the files of the virtual install with the contents
+            # recorded when they were installed
+            self.__r = wrapper.get_root(self)
+            self.setinstalldir()
+
+            old = self.create_dotconfig()
+
+            if not old.has_dotconfig():
+                OUT.die('Cannot verify!\n'
+                        'No package installed in ' + self.installdir())
+            old.read()
+
+            content = self.create_content(old['WEB_CATEGORY'],
+                                          old['WEB_PN'],
+                                          old['WEB_PVR'])
+            content.read()
+
+            problems = content.verify()
+
+            for (entry, problem) in problems:
+                if OUT.structured():
+                    OUT.record({'path'    : entry,
+                                'problem' : problem,
+                                'owner'   : content.eowner(entry)})
+                else:
+                    OUT.notice(problem.ljust(9) + entry)
+
+            if OUT.structured():
+                OUT.end_records()
+            else:
+                OUT.info(str(len(problems)) + ' of '
+                         + str(len(content.get_sorted_files()))
+                         + ' entries are missing or modified')
+
+            if problems:
+                sys.exit(1)
+
         if self.work == 'show_postinst':
 
             # The user needs to specify package and version
@@ -1294,6 +1844,7 @@ class Config:
 
             # Set the installation directory
             self.setinstalldir()
+            self.check_journal()
 
             # Check if there is a conflicting package
             OUT.info('Is there already a package installed in '
@@ -1301,7 +1852,7 @@ class Config:
 
             old = self.create_dotconfig()
 
-            if old.has_dotconfig():
+            if old.has_dotconfig() and not self.resuming:
                 old.read()
                 OUT.die('Package ' + old.packagename() + ' is already in'
                         'stalled here.\nUse webapp-config -C to uninstall'
@@ -1324,7 +1875,8 @@ class Config:
                                ws,
                                self.maybe_get('cat'),
                                self.config.get('USER', 'pn'),
-                               self.config.get('USER', 'pvr')).install()
+                               self.config.get('USER', 'pvr')).install(
+                                   bool(self.upgraded_from))
 
         if self.work == 'clean':
 
@@ -1356,6 +1908,7 @@ class Config:
 
             if not self.upgrading():
                 self.setinstalldir()
+            self.check_journal()
 
             old = self.create_dotconfig()
 
@@ -1446,6 +1999,7 @@ class Config:
 
             # Set the installation directory
             self.setinstalldir()
+            self.check_journal()
 
             old = self.create_dotconfig()
 
@@ -1510,6 +2064,69 @@ class Config:
                                                        self.config.get('USER', 'pn'),
                                                        self.config.get('USER', 'pvr'))
 
+        if self.work in ['install', 'clean', 'upgrade', 'rollback']:
+
+            # Reload the web server once for all changes made above
+            from WebappConfig.reload import RELOAD
+
+            RELOAD.flush()
+
+
+    def check_journal(self):
+
+        # An interrupted operation must be resumed or rolled back first
+        if not self.resuming and self.create_journal().exists():
+            OUT.die('An interrupted install or removal was found in '
+                    + self.installdir() + '.\nUse --resume to complete it'
+                    ' or --rollback to undo it.')
+
+    def rollback(self, journal, header, records):
+
+        if header.get('action') != 'install':
+            OUT.die('Cannot roll back!\nFiles removed by the interrupted '
+                    + str(header.get('action')) + ' cannot be restored. Use'
+                    ' --resume to complete it.')
+
+        OUT.info('Rolling back the interrupted install of '
+                 + self.packagename())
+
+        # The journal knows about everything installed so far
+        content = self.create_content(self.maybe_get('cat'),
+                                      self.maybe_get('pn'),
+                                      self.maybe_get('pvr'))
+        for (kind, value) in records:
+            if kind == 'add':
+                content.restore(value)
+            else:
+                content.forget(value)
+
+        from WebappConfig.worker import WebappRemove
+
+        remove = WebappRemove(content, self.verbose(), self.pretend())
+
+        left  = not remove.remove_files()
+        left |= not remove.remove_dirs()
+
+        if os.path.isfile(content.appdb()):
+            content.kill()
+
+        dotconfig = self.create_dotconfig()
+        if dotconfig.has_dotconfig():
+            dotconfig.read()
+            if dotconfig['WEB_PVR'] == self.maybe_get('pvr'):
+                dotconfig.kill()
+
+        db = self.create_webapp_db(self.maybe_get('cat'),
+                                   self.maybe_get('pn'),
+                                   self.maybe_get('pvr'))
+        if os.path.isfile(db.appdb()):
+            db.remove(self.installdir())
+
+        if not self.pretend():
+            journal.discard()
+
+        if left:
+            OUT.warn('Remove whatever is listed above by hand')
 
     def create_webapp_db(self, category, package, version):
 
@@ -1553,6 +2170,14 @@ class Config:
                          self.get_perm('g_perms_dotconfig'),
                          self.pretend())
 
+    def create_journal(self):
+
+        from WebappConfig.journal import Journal
+
+        return Journal(self.installdir(),
+                       self.maybe_get('my_dotconfig'),
+                       self.pretend())
+
     def create_ebuild(self):
 
         from WebappConfig.ebuild import  Ebuild
@@ -1578,18 +2203,11 @@ class Config:
 
         # handle server type
 
-        allowed_servers = {'apache'   : WebappConfig.server.Apache,
-                           'lighttpd' : WebappConfig.server.Lighttpd,
-                           'cherokee' : WebappConfig.server.Cherokee,
-                           'nginx'    : WebappConfig.server.Nginx,
-                           'gatling'  : WebappConfig.server.Gatling,
-                           'tracd'    : WebappConfig.server.Tracd,
-                           'uwsgi'    : WebappConfig.server.uWSGI,}
-
-
         server = self.config.get('USER', 'vhost_server')
 
-        if not server in allowed_servers:
+        server_class = self.create_registry().load(server)
+
+        if not server_class:
             OUT.die('I don\'t support the "' + server + '" web server.')
 
         from WebappConfig.protect import Protection
@@ -1605,20 +2223,47 @@ class Config:
                     'db'        : self.create_webapp_db(category, package, version),
                     'protect'   : Protection(category,package,version,
                                     self.config.get('USER','package_manager')),
+                    'journal'   : self.create_journal(),
                     'content'   : content}
 
         flags = {'linktype' : self.maybe_get('g_link_type'),
                  'host'     : self.maybe_get('vhost_hostname'),
                  'orig'     : self.maybe_get('g_orig_installdir'),
                  'upgrade'  : self.upgrading(),
+                 'upgraded_from' : self.upgraded_from,
                  'verbose'  : self.verbose(),
-                 'pretend'  : self.pretend()}
+                 'pretend'  : self.pretend(),
+                 'reload'   : self.reload_command(server_class)}
+
+        return server_class(directories,
+                            self.create_permissions(),
+                            handlers,
+                            flags,
+                            pm = self.config.get('USER', 'package_manager'))
+
+    def reload_command(self, server_class):
+
+        # Reloading the web server needs to be enabled explicitly
+        if not self.maybe_getboolean('vhost_reload'):
+            return ''
+
+        from WebappConfig.reload import RELOAD
+
+        RELOAD.debounce = float(self.config.get('USER', 'reload_debounce'))
+
+        return self.maybe_get('vhost_reload_command') or server_class.reload
+
+    def create_query_cache(self):
+
+        from WebappConfig.query import QueryCache
+
+        return QueryCache()
+
+    def create_registry(self):
+
+        from WebappConfig.registry import ServerRegistry
 
-        return allowed_servers[server](directories,
-                                       self.create_permissions(),
-                                       handlers,
-                                       flags,
-                                       pm = self.config.get('USER', 'package_manager'))
+        return ServerRegistry(self.maybe_get('my_serverdir'))
 
     def create_permissions(self):
 
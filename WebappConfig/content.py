@@ -63,6 +63,11 @@ class Contents:
 
         self.__content = {}
 
+        # Journal recording the changes (see journal.py) and the entries
+        # restored from the journal of an interrupted run
+        self.__journal = None
+        self.__resumed = set()
+
         # Ignore specific files while removing contents
 
         # Added "webapp-test" to the list of ignored files. This
@@ -90,6 +95,14 @@ class Contents:
         ''' Set the package version.'''
         self.__pvr = version
 
+    def get_package(self):
+        ''' Return category, package name and version.'''
+        return (self.__cat, self.__pn, self.__pvr)
+
+    def set_journal(self, journal):
+        ''' Set the journal that records added and deleted entries.'''
+        self.__journal = journal
+
     def appdb(self):
         ''' Return the full path to the contents file.'''
         return self.__installdir + '/' + self.__dbfile + '-' \
@@ -143,77 +156,88 @@ class Contents:
 
         for i in content:
 
-            i = i.strip()
+            line_split = self.parse_line(i, dbpath)
 
-            rfn = re.compile('"(.*)"')
-            rfs = rfn.search(i)
-            if not rfs:
-                ok = False
-            else:
-                fn  = rfs.group(1)
-                i   = rfn.sub('', i)
-                line_split = i.split(' ')
-                line_split[3] = fn
-
-                OUT.debug('Adding content line', 10)
-
-                ok = True
-
-                if len(line_split) < 6:
-                    ok = False
-                    OUT.warn('Content file ' + dbpath + ' has an invalid line'
-                             ':\n' + i + '\nNot enough entries.')
-
-                if ok and not line_split[0] in ['file', 'sym', 'dir']:
-                    ok = False
-                    OUT.warn('Content file ' + dbpath + ' has an invalid line'
-                             ':\n' + i + '\nInvalid file type: '
-                             + line_split[0])
-
-                if ok and not line_split[1] in ['0', '1']:
-                    ok = False
-                    OUT.warn('Content file ' + dbpath + ' has an invalid line'
-                             ':\n' + i + '\nInvalid relative flag: '
-                             + line_split[1])
-
-                if ok and not line_split[2] in ['virtual',
-                                                'server-owned',
-                                                'config-owned',
-                                                'default-owned',
-                                                'config-server-owned',
-                                                # Still need that in case an 
-                                                # application was installed
-                                                # with w-c-1.11
-                                                'root-owned']:
-                    ok = False
-                    OUT.warn('Content file ' + dbpath + ' has an invalid line'
-                             ':\n' + i + '\nInvalid owner: '
-                             + line_split[2])
-
-                if ok and line_split[0] == 'sym' and len(line_split) == 6:
-                    OUT.warn('Content file ' + dbpath + ' has an invalid line'
-                             ':\n' + i + '\nMissing link target! ')
-
-                if len(line_split) == 6:
-                    line_split.append('')
-
-                # I think this could happen if the link target contains
-                # spaces
-                # -- wrobel
-                if len(line_split) > 7:
-                    line_split = line_split[0:6]                         \
-                                 + [' '.join(line_split[6:])]
-
-            if ok:
+            if line_split:
                 if line_split[1] == '0':
                     self.__content[line_split[3]] = line_split
                 else:
                     self.__content[self.__installdir + '/'
                                    + line_split[3]] = line_split
 
-            else:
-                OUT.warn('Invalid line in content file (' + i + '). Ignor'
-                         'ing!')
+    def parse_line(self, i, dbpath):
+        '''
+        Splits a line of a contents file into its fields. The path is
+        returned without the enclosing quotes. Returns None for invalid
+        lines.
+        '''
+
+        i = i.strip()
+
+        rfn = re.compile('"(.*)"')
+        rfs = rfn.search(i)
+        if not rfs:
+            ok = False
+        else:
+            fn  = rfs.group(1)
+            i   = rfn.sub('', i)
+            line_split = i.split(' ')
+            line_split[3] = fn
+
+            OUT.debug('Adding content line', 10)
+
+            ok = True
+
+            if len(line_split) < 6:
+                ok = False
+                OUT.warn('Content file ' + dbpath + ' has an invalid line'
+                         ':\n' + i + '\nNot enough entries.')
+
+            if ok and not line_split[0] in ['file', 'sym', 'dir']:
+                ok = False
+                OUT.warn('Content file ' + dbpath + ' has an invalid line'
+                         ':\n' + i + '\nInvalid file type: '
+                         + line_split[0])
+
+            if ok and not line_split[1] in ['0', '1']:
+                ok = False
+                OUT.warn('Content file ' + dbpath + ' has an invalid line'
+                         ':\n' + i + '\nInvalid relative flag: '
+                         + line_split[1])
+
+            if ok and not line_split[2] in ['virtual',
+                                            'server-owned',
+                                            'config-owned',
+                                            'default-owned',
+                                            'config-server-owned',
+                                            # Still need that in case an
+                                            # application was installed
+                                            # with w-c-1.11
+                                            'root-owned']:
+                ok = False
+                OUT.warn('Content file ' + dbpath + ' has an invalid line'
+                         ':\n' + i + '\nInvalid owner: '
+                         + line_split[2])
+
+            if ok and line_split[0] == 'sym' and len(line_split) == 6:
+                OUT.warn('Content file ' + dbpath + ' has an invalid line'
+                         ':\n' + i + '\nMissing link target! ')
+
+            if len(line_split) == 6:
+                line_split.append('')
+
+            # I think this could happen if the link target contains
+            # spaces
+            # -- wrobel
+            if len(line_split) > 7:
+                line_split = line_split[0:6]                         \
+                             + [' '.join(line_split[6:])]
+
+        if ok:
+            return line_split
+
+        OUT.warn('Invalid line in content file (' + i + '). Ignor'
+                 'ing!')
 
     def write(self):
         '''
@@ -249,6 +273,47 @@ class Contents:
         '''
         del self.__content[entry]
 
+        if self.__journal:
+            self.__journal.removed(entry)
+
+    def restore(self, line):
+        '''
+        Add an entry recorded in the journal of an interrupted run.
+        '''
+        line_split = self.parse_line(line, 'journal')
+
+        if not line_split:
+            return
+
+        if line_split[1] == '0':
+            entry = line_split[3]
+        else:
+            entry = self.__installdir + '/' + line_split[3]
+
+        # Keep the path quoted just like add() does
+        line_split[3] = '"' + line_split[3] + '"'
+
+        self.__content[entry] = line_split
+        self.__resumed.add(entry)
+
+    def forget(self, entry):
+        '''
+        Drop an entry deleted by an interrupted run.
+        '''
+        if entry in self.__content:
+            del self.__content[entry]
+
+    def resumed(self, entry):
+        '''
+        Returns True if the entry has been installed by an interrupted
+        run and has not been touched since.
+        '''
+        return (entry in self.__resumed
+                and entry in self.__content
+                and self.__content[entry][0] in ['file', 'sym']
+                and os.path.lexists(entry)
+                and self.file_time(entry) == self.__content[entry][4])
+
     def add(self,
             dsttype,
             ctype,
@@ -377,6 +442,9 @@ class Contents:
                                       a[1](real_path),
                                       a[2](entry)]
 
+            if self.__journal:
+                self.__journal.added(' '.join(self.__content[entry]))
+
             if self.__v:
                 msg = path
                 if msg[0] == "/":
@@ -512,6 +580,55 @@ class Contents:
 
         # All checks passed? Remove!
 
+    def copy(self):
+        '''
+        Returns a copy of the current entries that is not affected by
+        later changes, e.g. for comparing files after a removal.
+        '''
+        result = Contents(self.__installdir, self.__cat, self.__pn,
+                          self.__pvr, self.__perm, self.__dbfile, self.__v,
+                          self.__p, self.__root)
+        result.__content = dict(self.__content)
+        return result
+
+    def unmodified(self, entry):
+        '''
+        Returns True if the entry is a recorded file that still has the
+        recorded md5 hash.
+        '''
+        if (entry in self.__content
+                and self.__content[entry][0] == 'file'
+                and os.path.isfile(entry)):
+            return self.__content[entry][5] == self.file_md5(entry)
+        return False
+
+    def verify(self):
+        '''
+        Compares the installed entries with the recorded ones. Returns
+        (entry, problem) pairs for all entries that are missing or have
+        been modified.
+        '''
+        problems = []
+
+        for i in sorted(self.__content.keys()):
+
+            kind = self.__content[i][0]
+
+            if kind == 'dir':
+                if not os.path.isdir(i):
+                    problems.append((i, 'missing'))
+            elif kind == 'sym':
+                if not os.path.islink(i):
+                    problems.append((i, 'missing'))
+                elif self.file_link(i) != self.etarget(i):
+                    problems.append((i, 'modified'))
+            elif not os.path.isfile(i):
+                problems.append((i, 'missing'))
+            elif not self.unmodified(i):
+                problems.append((i, 'modified'))
+
+        return problems
+
     def entry(self, entry):
         ''' Return a complete entry.'''
         if entry in list(self.__content.keys()):
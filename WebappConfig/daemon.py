@@ -0,0 +1,475 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+'''
+Long-running webapp-config handling requests sent to a Unix socket.
+
+A request is a single line holding a JSON object:
+
+  {"args" : ["-I", "-h", "www.example.org", "-d", "pma", "phpmyadmin",
+             "5.2.1"]}
+
+The arguments are the usual command line arguments of webapp-config.
+Only install, clean, upgrade and query requests are accepted. The
+daemon answers with JSON lines, one for every line of output and a final
+one with the exit status of the request:
+
+  {"output" : "* Installing phpmyadmin-5.2.1.\\n"}
+  ...
+  {"status" : 0}
+
+Requires Python 3.
+'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import asyncio, contextlib, importlib, io, json, os, os.path, re, signal
+import shlex, socket, sys, traceback
+
+from WebappConfig.debug       import OUT
+
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+# Modules imported once by the daemon instead of by every request
+MODULES = ['WebappConfig.content', 'WebappConfig.db',
+           'WebappConfig.dotconfig', 'WebappConfig.ebuild',
+           'WebappConfig.filetype', 'WebappConfig.journal',
+           'WebappConfig.pkgmgr', 'WebappConfig.protect',
+           'WebappConfig.query', 'WebappConfig.registry',
+           'WebappConfig.sandbox', 'WebappConfig.server',
+           'WebappConfig.worker']
+
+# Actions a request may ask for
+ACTIONS = ['install', 'clean', 'upgrade', 'query']
+
+def call(args, path, out = None):
+    '''
+    Sends a request to the daemon listening on path and writes the
+    output to out. Returns the exit status of the request.
+    '''
+    out = out or sys.stdout
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+
+    try:
+        client.sendall((json.dumps({'args' : list(args)}) + '\n')
+                       .encode('utf-8'))
+
+        for line in client.makefile('r', encoding = 'utf-8'):
+            answer = json.loads(line)
+            if 'status' in answer:
+                return answer['status']
+            out.write(answer['output'])
+    finally:
+        client.close()
+
+    return 1
+
+# ========================================================================
+# Daemon
+# ------------------------------------------------------------------------
+
+class Daemon:
+    '''
+    Runs the requests sent to a Unix socket.
+
+    The daemon imports all modules, asks the package manager and reads
+    the file types and directory listings of the web application sources
+    once. Every request then runs in a forked child which starts with
+    these caches filled and leaves the daemon untouched, whatever the
+    request does to the process. The configured users and groups are
+    looked up again for every request.
+
+    Requests changing the same installation directory are run one after
+    the other, all other requests run concurrently. The web server is
+    reloaded by the daemon once no request asked for a reload for
+    reload_debounce seconds.
+    '''
+
+    def __init__(self, config, path = None):
+
+        self.config = config
+        self.path   = path or config.config.get('USER', 'daemon_socket')
+
+        self.debounce = float(config.config.get('USER', 'reload_debounce'))
+
+        self.__locks   = {}
+        self.__users   = {}
+        self.__tasks   = set()
+        self.__reload  = None
+        self.__sources = set()
+
+    def warm(self):
+        ''' Fills the caches shared with the requests.'''
+
+        OUT.debug('Warming up the daemon', 6)
+
+        for i in MODULES:
+            importlib.import_module(i)
+
+        from WebappConfig.pkgmgr import backend
+
+        backend(self.config.config.get('USER', 'package_manager')).root()
+
+        self.config.resolve_ids()
+
+        self.warm_sources()
+
+    def warm_sources(self):
+        '''
+        Reads the file types and directory listings of all web
+        application sources not read so far. Changes to sources read
+        before are noticed by the requests themselves.
+        '''
+
+        import WebappConfig.wrapper as wrapper
+        from WebappConfig.db import WebappSource
+
+        root     = wrapper.get_root(self.config)
+        approot  = self.config.maybe_get('my_approot')
+        virtual  = self.config.config.get('USER',
+                                          'vhost_config_virtual_files')
+        defaults = self.config.config.get('USER',
+                                          'vhost_config_default_dirs')
+
+        sources = re.sub('/+', '/', root + approot).rstrip('/')
+
+        if not os.path.isdir(sources):
+            return
+
+        for location in WebappSource(root, approot).list_locations():
+
+            # The location is <category>/<package>/<version>/<file> or
+            # <package>/<version>/<file> below the sources
+            parts = location[len(sources) + 1:].split('/')[:-1]
+
+            source = WebappSource(root, approot, *([''] + parts)[-3:])
+
+            if source.appdir() in self.__sources:
+                continue
+
+            OUT.debug('Reading ' + source.package_name(), 7)
+
+            source.read(virtual_files = virtual, default_dirs = defaults)
+
+            directories = ['']
+            while directories:
+                directory = directories.pop()
+                for i in source.get_source_directories(directory):
+                    directories.append(directory + '/' + i)
+                source.get_source_files(directory)
+
+            self.__sources.add(source.appdir())
+
+    def lock_key(self, args):
+        '''
+        Parses the request arguments. Returns the action and the key of
+        the installation directory that is changed (or None). Returns
+        None as the action if the arguments cannot be parsed and the
+        error message in place of the key.
+        '''
+        from WebappConfig.config import Config
+
+        config = Config()
+        config.setup_parser()
+
+        output = io.StringIO()
+
+        try:
+            with contextlib.redirect_stdout(output):
+                with contextlib.redirect_stderr(output):
+                    options = vars(config.parser.parse_args(args))
+        except SystemExit:
+            return None, output.getvalue()
+
+        work = config.select_work(options)
+
+        if work not in ACTIONS:
+            return None, ('Only ' + ', '.join(ACTIONS) + ' requests are'
+                          ' accepted.\n')
+
+        if work == 'query':
+            return work, None
+
+        if options.get('host'):
+            host = options['host'][0]
+        else:
+            host = self.config.config.get('USER', 'vhost_hostname')
+
+        if options.get('dir'):
+            directory = options['dir'][0]
+        else:
+            directory = options[work][0].split('/')[-1]
+
+        return work, host + ':' + re.sub('/+', '/', directory).strip('/')
+
+    def child(self, args, output, control):
+        ''' Runs a request in the forked child. Never returns.'''
+
+        status = 1
+
+        try:
+            signal.set_wakeup_fd(-1)
+            for i in [signal.SIGTERM, signal.SIGINT]:
+                signal.signal(i, signal.SIG_DFL)
+
+            null = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null, 0)
+            os.dup2(output, 1)
+            os.dup2(output, 2)
+            os.dup2(control, 3, inheritable = False)
+            os.closerange(4, os.sysconf('SC_OPEN_MAX'))
+
+            from WebappConfig.config import Config
+            from WebappConfig.reload import RELOAD
+
+            def handoff(command):
+                os.write(3, (command + '\n').encode('utf-8'))
+                OUT.info('The web server will be reloaded ("' + command
+                         + '")')
+
+            RELOAD.handoff = handoff
+
+            sys.argv = ['webapp-config'] + args
+
+            try:
+                config = Config()
+                config.parseparams()
+                config.run()
+                status = 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    status = e.code or 0
+                else:
+                    print(e.code, file = sys.stderr)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+    async def execute(self, args, writer):
+        ''' Runs a request and forwards its output. Returns the status.'''
+
+        loop = asyncio.get_running_loop()
+
+        # Users or groups may have changed since the last request. Failed
+        # lookups would otherwise be remembered forever.
+        from WebappConfig.permissions import NSS
+
+        NSS.clear()
+        self.config.resolve_ids()
+
+        # Packages may have been merged since the last request
+        self.warm_sources()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        (out_r, out_w) = os.pipe()
+        (ctl_r, ctl_w) = os.pipe()
+
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(out_r)
+            os.close(ctl_r)
+            self.child(args, out_w, ctl_w)
+
+        os.close(out_w)
+        os.close(ctl_w)
+
+        reader   = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        (transport, protocol) = await loop.connect_read_pipe(
+            lambda: protocol, os.fdopen(out_r, 'rb', 0))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((json.dumps({'output' : line.decode(
+                    'utf-8', 'replace')}) + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            # The client is gone but the request runs to its end
+            pass
+        finally:
+            transport.close()
+
+        # The child may have closed its output before it is done
+        (pid, status) = await loop.run_in_executor(None, os.waitpid, pid, 0)
+
+        with os.fdopen(ctl_r, 'rb') as f:
+            for command in f.read().decode('utf-8').splitlines():
+                self.reload(command)
+
+        return os.waitstatus_to_exitcode(status)
+
+    def reload(self, command):
+        ''' Queues a web server reload requested by a child.'''
+
+        from WebappConfig.reload import RELOAD
+
+        RELOAD.request(command)
+
+        if self.__reload:
+            self.__reload.cancel()
+
+        self.__reload = asyncio.get_running_loop().call_later(
+            self.debounce, lambda: self.__tasks.add(
+                asyncio.ensure_future(self.flush())))
+
+    async def flush(self):
+        '''
+        Runs the queued reload commands without blocking the requests
+        handled meanwhile.
+        '''
+
+        from WebappConfig.reload import RELOAD
+
+        try:
+            for (command, pretend) in RELOAD.take():
+
+                OUT.info('Reloading the web server ("' + command + '")')
+
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *shlex.split(command))
+                    status = await process.wait()
+                except OSError as e:
+                    status = str(e)
+
+                RELOAD.report(command, status)
+        finally:
+            self.__tasks.discard(asyncio.current_task())
+
+    async def handle(self, reader, writer):
+        ''' Handles a client connection.'''
+
+        self.__tasks.add(asyncio.current_task())
+
+        key    = None
+        status = 2
+
+        try:
+            try:
+                args = json.loads((await reader.readline()).decode('utf-8'))
+                args = [str(i) for i in args['args']]
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError('Invalid request (' + str(e) + ')\n')
+
+            (work, key) = self.lock_key(args)
+
+            if work is None:
+                raise ValueError(key)
+
+            OUT.info('Handling ' + ' '.join(args))
+
+            if key is None:
+                status = await self.execute(args, writer)
+            else:
+                self.__users[key] = self.__users.get(key, 0) + 1
+                lock = self.__locks.setdefault(key, asyncio.Lock())
+
+                try:
+                    async with lock:
+                        status = await self.execute(args, writer)
+                finally:
+                    self.__users[key] -= 1
+                    if not self.__users[key]:
+                        del self.__users[key]
+                        del self.__locks[key]
+
+            OUT.info('Finished ' + ' '.join(args) + ' (status '
+                     + str(status) + ')')
+
+        except ValueError as e:
+            writer.write((json.dumps({'output' : str(e)}) + '\n')
+                         .encode('utf-8'))
+        except Exception as e:
+            OUT.warn('Handling the request failed: ' + str(e))
+            status = 1
+
+        try:
+            writer.write((json.dumps({'status' : status}) + '\n')
+                         .encode('utf-8'))
+            await writer.drain()
+            writer.close()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.__tasks.discard(asyncio.current_task())
+
+    async def main(self):
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+
+        for i in [signal.SIGTERM, signal.SIGINT]:
+            loop.add_signal_handler(i, stop.set)
+
+        old = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(self.handle,
+                                                     path = self.path)
+        finally:
+            os.umask(old)
+
+        OUT.info('Listening on ' + self.path)
+
+        await stop.wait()
+
+        OUT.info('Shutting down')
+
+        server.close()
+        await server.wait_closed()
+
+        # Let the running requests and reloads finish
+        if self.__tasks:
+            await asyncio.wait(list(self.__tasks))
+
+        if self.__reload:
+            self.__reload.cancel()
+        await self.flush()
+
+    def serve(self):
+        ''' Handles requests until SIGTERM or SIGINT is received.'''
+
+        if os.path.exists(self.path):
+            try:
+                call([], self.path, io.StringIO())
+                OUT.die('A daemon is already listening on ' + self.path)
+            except (IOError, OSError):
+                # Left behind by a daemon that did not shut down cleanly
+                os.unlink(self.path)
+
+        self.warm()
+
+        try:
+            asyncio.run(self.main())
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
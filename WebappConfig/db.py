@@ -21,15 +21,182 @@ well as the database of virtual installs.  '''
 # Dependencies
 # ------------------------------------------------------------------------
 
-import time, os, os.path, re
+import bisect, contextlib, fcntl, tempfile, time, os, os.path, re
 
 import WebappConfig.wrapper as wrapper
 
+from concurrent.futures       import ThreadPoolExecutor
 from WebappConfig.debug       import OUT
+from WebappConfig.dotconfig   import DotConfig
 from WebappConfig.eprefix     import EPREFIX
 from WebappConfig.permissions import PermissionMap
 
 
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+# Lock files held by this process and how often. flock() locks belong to
+# the open file, so a nested lock on the same file must not open it again.
+LOCKS = {}
+
+@contextlib.contextmanager
+def locked(path, mode = 0o600):
+    '''
+    Holds an exclusive lock on the file path (created if missing) while
+    the block runs. Concurrent webapp-config processes wait for each
+    other. Nested locks on the same path are allowed. Does nothing if
+    path is None.
+    '''
+    if path is None:
+        yield
+        return
+
+    if path in LOCKS:
+        LOCKS[path][1] += 1
+        try:
+            yield
+        finally:
+            LOCKS[path][1] -= 1
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, mode)
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        LOCKS[path] = [fd, 1]
+        try:
+            yield
+        finally:
+            del LOCKS[path]
+    finally:
+        os.close(fd)
+
+# File types and directory listings of the web application sources. The
+# sources only change when packages are merged, so the answers are kept
+# as long as the files they were read from remain unchanged. The daemon
+# reads them once for all requests.
+SOURCES = {}
+
+def remembered(key, paths, function):
+    '''
+    Returns function(), remembered under key as long as the modification
+    times of paths stay the same.
+
+    >>> remembered('doctest', ['/nonexistent'], lambda: 1)
+    1
+    >>> remembered('doctest', ['/nonexistent'], lambda: 2)
+    1
+    >>> del SOURCES['doctest']
+    '''
+    stamps = []
+    for i in paths:
+        try:
+            stamps.append(os.stat(i).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+
+    answer = SOURCES.get(key)
+
+    if answer is None or answer[0] != stamps:
+        answer = (stamps, function())
+        SOURCES[key] = answer
+
+    return answer[1]
+
+def install_record(package, entry):
+    '''
+    Converts a line of an installs file into a structured record.
+
+    >>> r = install_record('www-apps/horde-3.0.5',
+    ...                    ['1124612110', '0', 'root', '/var/www/h\\n'])
+    >>> sorted(r.items())
+    [('gid', 'root'), ('installdir', '/var/www/h'), ('package', 'www-apps/horde-3.0.5'), ('timestamp', 1124612110), ('uid', 0)]
+    '''
+
+    record = {'package'    : package,
+              'installdir' : entry[3].strip()}
+
+    for key, value in [('timestamp', entry[0]),
+                       ('uid',       entry[1]),
+                       ('gid',       entry[2])]:
+        try:
+            record[key] = int(value)
+        except ValueError:
+            record[key] = value
+
+    return record
+
+def read_install(directory, dotconfig = '.webapp'):
+    '''
+    Recreates the install record for the virtual install location
+    "directory" from the dotconfig and contents files stored there.
+    Returns a (category, pn, pvr, timestamp, user, group, installdir)
+    tuple or None if the location does not hold a complete install.
+    '''
+
+    dot = DotConfig(directory, dotconfig)
+
+    try:
+        dot.read()
+    except Exception as e:
+        OUT.warn('Unable to read ' + directory + '/' + dotconfig + ': '
+                 + str(e))
+        return None
+
+    cat = dot['WEB_CATEGORY'] or ''
+    pn  = dot['WEB_PN']
+    pvr = dot['WEB_PVR']
+    owner = dot['WEB_INSTALLEDFOR']
+
+    if not pn or not pvr or not owner or not ':' in owner:
+        OUT.warn('Incomplete ' + dotconfig + ' file in ' + directory
+                 + '; skipping')
+        return None
+
+    # The contents file uses "_" to separate category and package
+    if cat:
+        contents = directory + '/' + dotconfig + '-' + cat + '_' + pn \
+                   + '-' + pvr
+    else:
+        contents = directory + '/' + dotconfig + '-' + pn + '-' + pvr
+
+    if not os.path.isfile(contents):
+        OUT.warn('No contents file ' + contents + ' found; skipping')
+        return None
+
+    try:
+        timestamp = int(time.mktime(time.strptime(dot['WEB_INSTALLEDDATE'],
+                                                  '%Y-%m-%d %H:%M:%S')))
+    except (TypeError, ValueError):
+        timestamp = int(os.stat(contents).st_mtime)
+
+    user, group = owner.split(':', 1)
+
+    return (cat, pn, pvr, str(timestamp), user, group, directory)
+
+def scan_installs(directory, dotconfig = '.webapp', recursive = True):
+    '''
+    Returns the records of all virtual installs at or below the given
+    directory. Symlinked directories are not followed.
+    '''
+
+    OUT.debug('Scanning for virtual installs', 6)
+
+    found = []
+
+    for path, dirs, files in os.walk(directory):
+
+        if dotconfig in files:
+            record = read_install(path, dotconfig)
+            if record:
+                found.append(record)
+
+        if not recursive:
+            del dirs[:]
+
+    return found
+
 # ========================================================================
 # Reduced base class
 # ------------------------------------------------------------------------
@@ -165,6 +332,14 @@ class WebappDB(AppHierarchy):
     information about virtual installs of web applications.
     '''
 
+    # Sorted index of all recorded installation directories. It lives
+    # in the root of the database and allows to answer "what is
+    # installed below this path" without scanning every installs file.
+    indexfile = '.installdirs'
+
+    # Guards all read-modify-write updates of the database files
+    lockfile  = '.lock'
+
     def __init__(self,
                  fs_root    = '/',
                  root       = EPREFIX + '/var/db/webapps',
@@ -204,59 +379,68 @@ class WebappDB(AppHierarchy):
         if not dbpath:
             OUT.die('No package specified!')
 
-        if not os.access(dbpath, os.R_OK):
-            OUT.warn('Unable to read the install database ' + dbpath)
-            return
+        # Other processes may update the database meanwhile
+        with self.lock():
 
-        # Read db file
-        fdb = open(dbpath)
-        entries = fdb.readlines()
-        fdb.close()
+            if not os.access(dbpath, os.R_OK):
+                OUT.warn('Unable to read the install database ' + dbpath)
+                return
 
-        newentries = []
-        found = False
+            # Read db file
+            fdb = open(dbpath)
+            entries = fdb.readlines()
+            fdb.close()
 
-        for i in entries:
+            newentries = []
+            found = False
 
-            j = i.strip().split(' ')
+            for i in entries:
 
-            if j:
+                j = i.strip().split(' ')
 
-                if len(j) != 4:
+                if j:
 
-                    # Remove invalid entry
-                    OUT.warn('Invalid line "' + i.strip() + '" remo'
-                             'ved from the database file!')
-                elif j[3] != installdir:
+                    if len(j) != 4:
 
-                    OUT.debug('Keeping entry', 7)
+                        # Remove invalid entry
+                        OUT.warn('Invalid line "' + i.strip() + '" remo'
+                                 'ved from the database file!')
+                    elif j[3] != installdir:
 
-                    # Keep valid entry
-                    newentries.append(i.strip())
+                        OUT.debug('Keeping entry', 7)
 
-                elif j[3] == installdir:
+                        # Keep valid entry
+                        newentries.append(i.strip())
 
-                    # Remove entry, indicate found
-                    found = True
+                    elif j[3] == installdir:
 
-        if not found:
-            OUT.warn('Installation at "' +  installdir + '" could not be '
-                     'found in the database file. Check the entries in "'
-                     + dbpath + '"!')
+                        # Remove entry, indicate found
+                        found = True
 
-        if not self.__p:
-            installs = open(dbpath, 'w')
-            installs.write('\n'.join(newentries) + '\n')
-            installs.close()
-            if not self.has_installs():
-                os.unlink(dbpath)
-        else:
-            OUT.info('Pretended to remove installation ' + installdir)
-            OUT.info('Final DB content:\n' + '\n'.join(newentries) + '\n')
+            if not found:
+                OUT.warn('Installation at "' +  installdir + '" could not '
+                         'be found in the database file. Check the entries '
+                         'in "' + dbpath + '"!')
+
+            if not self.__p:
+                installs = open(dbpath, 'w')
+                installs.write('\n'.join(newentries) + '\n')
+                installs.close()
+                if not self.has_installs():
+                    os.unlink(dbpath)
+
+                # An installation directory holds a single package only
+                if found and os.path.isfile(self.index_path()):
+                    self.write_index([i for i in self.read_index()
+                                      if i[0] != installdir])
+            else:
+                OUT.info('Pretended to remove installation ' + installdir)
+                OUT.info('Final DB content:\n' + '\n'.join(newentries) + '\n')
 
     def add(self, installdir, user, group):
         '''
-        Add a record to the list of virtual installs.
+        Add a record to the list of virtual installs. Nothing is added if
+        the installation directory has been recorded already.
 
         installdir - the installation directory
         '''
@@ -280,37 +464,53 @@ class WebappDB(AppHierarchy):
         if not self.__p and not os.path.isdir(os.path.dirname(dbpath)):
             os.makedirs(os.path.dirname(dbpath), self.__dir_perm(0o755))
 
-        fd = None
-
-        if not self.__p:
-            fd = os.open(dbpath,
-                         os.O_WRONLY | os.O_APPEND | os.O_CREAT,
-                         self.__file_perm(0o600))
-
         entry = str(int(time.time())) + ' ' + str(user) + ' ' + str(group)\
             + ' ' + installdir + '\n'
 
         OUT.debug('New record', 7)
 
-        if not self.__p:
-            os.write(fd, (entry).encode('utf-8'))
-            os.close(fd)
-        else:
+        if self.__p:
             OUT.info('Pretended to append installation ' + installdir)
             OUT.info('Entry:\n' + entry)
+            return
 
+        with self.lock():
 
-    def read_db(self):
+            # A resumed install may have added the record already
+            if os.path.isfile(dbpath):
+                with open(dbpath) as f:
+                    for i in f:
+                        j = i.strip().split(' ')
+                        if len(j) == 4 and j[3] == installdir:
+                            OUT.debug('Install already recorded', 7)
+                            return
+
+            fd = os.open(dbpath,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         self.__file_perm(0o600))
+            os.write(fd, (entry).encode('utf-8'))
+            os.close(fd)
+
+            # Only maintain an existing index. A missing one gets built
+            # from the installs files on the next lookup anyway.
+            if os.path.isfile(self.index_path()):
+                index = self.read_index()
+                bisect.insort(index, (installdir,
+                                      self.package_name()) +
+                                     tuple(entry.split(' ')[0:3]))
+                self.write_index(index)
+
+
+    def iter_db(self):
         '''
-        Returns the db content.
+        Yields a (package, entry) pair for every install record. The
+        installs files are read one at a time in package order so that
+        the caller never needs to hold the complete database.
         '''
 
         files = self.list_locations()
 
-        if not files:
-            return {}
-
-        result = {}
+        packages = []
 
         for j in list(files.keys()):
 
@@ -319,16 +519,24 @@ class WebappDB(AppHierarchy):
             else:
                 p = files[j][1] + '-' + files[j][2]
 
-            add = []
+            packages.append((p, j))
 
-            installs = open(j).readlines()
+        for p, j in sorted(packages):
 
-            for i in installs:
-                if len(i.split(' ')) == 4:
-                    add.append(i.split(' '))
+            with open(j) as installs:
+                for i in installs:
+                    if len(i.split(' ')) == 4:
+                        yield p, i.split(' ')
 
-            if add:
-                result[p] = add
+    def read_db(self):
+        '''
+        Returns the db content.
+        '''
+
+        result = {}
+
+        for p, i in self.iter_db():
+            result.setdefault(p, []).append(i)
 
         return result
 
@@ -359,20 +567,29 @@ class WebappDB(AppHierarchy):
                        OUT.warn('Assuming webapp is no longer installed.')
                        OUT.warn('Pruning entry from database.')
                     if action == 'clean':
-                        for installs in list(files.keys()):
-                            contents = open(installs).readlines()
-                            new_entries = ''
-                            for entry in contents:
-                                # Grab all the other entries but the one that
-                                # isn't installed.
-                                if not re.search('.* ' + appdir +'\\n', entry):
-                                    new_entries += entry
-                            f = open(installs, 'w')
-                            f.write(new_entries)
-                            f.close()
+                        with self.lock():
+                            self.__prune(files, appdir)
                     else:
                         OUT.warn(appdir)
 
+    def __prune(self, files, appdir):
+        ''' Drops the entries for appdir from the installs files.'''
+        for installs in list(files.keys()):
+            contents = open(installs).readlines()
+            new_entries = ''
+            for entry in contents:
+                # Grab all the other entries but the one that
+                # isn't installed.
+                if not re.search('.* ' + appdir +'\\n', entry):
+                    new_entries += entry
+            f = open(installs, 'w')
+            f.write(new_entries)
+            f.close()
+
+        # The index no longer matches the installs files
+        if os.path.isfile(self.index_path()):
+            os.unlink(self.index_path())
+
     def has_installs(self):
         ''' Return True in case there are any virtual install locations 
         listed in the db file '''
@@ -385,26 +602,269 @@ class WebappDB(AppHierarchy):
         Outputs a list of what has been installed so far.
         '''
 
-        loc = self.read_db()
+        found   = False
+        package = None
 
-        if not loc and self.__v:
+        for j, i in self.iter_db():
+
+            found = True
+
+            if OUT.structured():
+                OUT.record(install_record(j, i))
+
+            elif self.__v:
+                # The verbose output is meant to be readable for the user
+                if j != package:
+                    OUT.info('Installs for ' + '-'.join(j.split('/')), 4)
+                    package = j
+
+                OUT.info('  ' + i[3].strip(), 1)
+            else:
+                # This is a simplified form for the webapp.eclass
+                print(i[3].strip())
+
+        if OUT.structured():
+            OUT.end_records()
+        elif not found and self.__v:
             OUT.die('No virtual installs found!')
 
-        keys = sorted(loc)
+    def rebuild(self, root, dotconfig = '.webapp', jobs = None):
+        '''
+        Regenerates the install records for all virtual installs found at
+        or below root by reading the dotconfig and contents files every
+        install leaves behind. The vhost roots below root are scanned in
+        parallel. Records of installs outside of root remain untouched.
+        '''
 
-        for j in keys:
-            # The verbose output is meant to be readable for the user
-            if self.__v:
-                OUT.info('Installs for ' + '-'.join(j.split('/')), 4)
+        root = re.compile('/+').sub('/', root)
+        while len(root) > 1 and root[-1] == '/':
+            root = root[:-1]
+
+        if not os.path.isdir(root):
+            OUT.die('"' + root + '" specifies no directory!')
+
+        if root == '/':
+            prefix = '/'
+        else:
+            prefix = root + '/'
+
+        OUT.info('Scanning ' + root + ' for virtual installs')
+
+        # The root itself is checked without recursion, every directory
+        # below it gets scanned by a separate worker
+        subdirs = [os.path.join(root, i) for i in sorted(os.listdir(root))]
+        subdirs = [i for i in subdirs
+                   if os.path.isdir(i) and not os.path.islink(i)]
+
+        found = scan_installs(root, dotconfig, recursive = False)
+
+        with ThreadPoolExecutor(jobs) as pool:
+            for i in pool.map(lambda x: scan_installs(x, dotconfig),
+                              subdirs):
+                found.extend(i)
+
+        # The installs files are rewritten from what they hold now, no other
+        # process may change them meanwhile
+        with self.lock():
+
+            # Start from the current database but drop everything recorded
+            # for locations below root
+            full = WebappDB(root = self.root, verbose = self.__v,
+                            pretend = True, installs = self.dbfile)
+
+            records = {}
+
+            for location in full.list_locations().keys():
+                records[location] = [i for i in open(location).readlines()
+                                     if len(i.split(' ')) == 4 and
+                                     not (i.split(' ')[3].strip() == root or
+                                          i.split(' ')[3].startswith(prefix))]
+
+            for i in found:
+                location = re.compile('/+').sub('/', '/'.join([self.root, i[0],
+                                                               i[1], i[2],
+                                                               self.dbfile]))
+                records.setdefault(location, []).append(' '.join(i[3:]) + '\n')
 
-            for i in loc[j]:
                 if self.__v:
-                    # The verbose output is meant to be readable for
-                    # the user
-                    OUT.info('  ' + i[3].strip(), 1)
-                else:
-                    # This is a simplified form for the webapp.eclass
-                    print(i[3].strip())
+                    if i[0]:
+                        OUT.info('  Found ' + i[0] + '/' + i[1] + '-' + i[2]
+                                 + ' in ' + i[6])
+                    else:
+                        OUT.info('  Found ' + i[1] + '-' + i[2] + ' in '
+                                 + i[6])
+
+            # Write all installs files in one go
+            for location in sorted(records):
+
+                entries = ''.join(sorted(records[location]))
+
+                if self.__p:
+                    OUT.info('Pretended to write ' + location + ':\n'
+                             + entries)
+                    continue
+
+                if not entries:
+                    if os.path.isfile(location):
+                        os.unlink(location)
+                    continue
+
+                if not os.path.isdir(os.path.dirname(location)):
+                    os.makedirs(os.path.dirname(location),
+                                self.__dir_perm(0o755))
+
+                fd = os.open(location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             self.__file_perm(0o600))
+                os.write(fd, entries.encode('utf-8'))
+                os.close(fd)
+
+            # The index is regenerated on the next lookup
+            if not self.__p and os.path.isfile(self.index_path()):
+                os.unlink(self.index_path())
+
+        OUT.info('Recorded ' + str(len(found)) + ' virtual install(s) found'
+                 ' below ' + root, 1)
+
+    def lock(self):
+        '''
+        Returns a context manager holding the lock of the database. Does
+        not lock anything when pretending.
+        '''
+        if self.__p:
+            return locked(None)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, self.__dir_perm(0o755))
+        return locked(re.compile('/+').sub('/', self.root + '/'
+                                           + self.lockfile),
+                      self.__file_perm(0o600))
+
+    def index_path(self):
+        ''' Return the path to the installdir index.'''
+        return re.compile('/+').sub('/', self.root + '/' + self.indexfile)
+
+    def build_index(self):
+        '''
+        Generates the installdir index from the installs files. The index
+        is a list of (installdir, package, timestamp, user, group) tuples
+        sorted by installdir.
+        '''
+
+        OUT.debug('Building installdir index', 6)
+
+        # Always index the complete database, not just the package this
+        # handler might have been initialized with.
+        full = WebappDB(root = self.root, verbose = self.__v,
+                        pretend = True, installs = self.dbfile)
+
+        index = []
+        for package, installs in full.read_db().items():
+            for i in installs:
+                index.append((i[3].strip(), package, i[0], i[1], i[2]))
+
+        index.sort()
+
+        return index
+
+    def read_index(self):
+        '''
+        Returns the installdir index. The index is generated and stored
+        in case it does not exist yet.
+        '''
+
+        path = self.index_path()
+
+        if not os.access(path, os.R_OK):
+            if self.__p or not os.access(self.root, os.W_OK):
+                return self.build_index()
+            # Records added while building would be missing otherwise
+            with self.lock():
+                index = self.build_index()
+                self.write_index(index)
+            return index
+
+        index = []
+
+        for i in open(path).readlines():
+            j = i.rstrip('\n').split('\t')
+            if len(j) == 5:
+                index.append(tuple(j))
+
+        return index
+
+    def write_index(self, index):
+        '''
+        Store the installdir index. The file is replaced atomically so
+        that concurrent lookups never see a partial index. Callers
+        updating the index need to hold the lock of the database.
+        '''
+
+        path = self.index_path()
+
+        (fd, tmp) = tempfile.mkstemp(prefix = self.indexfile + '.',
+                                     dir = os.path.dirname(path))
+        try:
+            try:
+                os.fchmod(fd, self.__file_perm(0o600))
+                os.write(fd, ''.join(['\t'.join(i) + '\n'
+                                      for i in index]).encode('utf-8'))
+            finally:
+                os.close(fd)
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def lookup(self, path):
+        '''
+        Returns a list of all (package, installdir, timestamp, user,
+        group) records with an installdir at or below the given path.
+
+        The index is sorted so all candidates are located in a single
+        contiguous range that can be found with two binary searches.
+        '''
+
+        path = re.compile('/+').sub('/', path)
+        while len(path) > 1 and path[-1] == '/':
+            path = path[:-1]
+
+        index = self.read_index()
+        keys  = [i[0] for i in index]
+
+        if path == '/':
+            prefix = '/'
+            lo, hi = 0, len(keys)
+        else:
+            # '0' is the character following '/'
+            prefix = path + '/'
+            lo = bisect.bisect_left(keys, path)
+            hi = bisect.bisect_left(keys, path + '0', lo)
+
+        return [(i[1], i[0], i[2], i[3], i[4])
+                for i in index[lo:hi]
+                if i[0] == path or i[0].startswith(prefix)]
+
+    def findinstalls(self, path):
+        '''
+        Outputs all virtual installs located at or below the given path.
+        '''
+
+        found = self.lookup(path)
+
+        if OUT.structured():
+            for i in found:
+                OUT.record(install_record(i[0], [i[2], i[3], i[4], i[1]]))
+            OUT.end_records()
+            return
+
+        if not found and self.__v:
+            OUT.die('No virtual installs found below ' + path + '!')
+
+        for i in found:
+            if self.__v:
+                OUT.info(i[0] + ' installed in ' + i[1], 1)
+            else:
+                print(i[0] + ' ' + i[1])
 
 # ========================================================================
 # Handler for /usr/share/webapps
@@ -449,29 +909,38 @@ class WebappSource(AppHierarchy):
         '''
         import WebappConfig.filetype
 
-        server_files = []
-        config_files = []
+        def types():
+
+            server_files = []
+            config_files = []
+
+            if os.access(self.appdir() + '/' + config_owned, os.R_OK):
+                flist = open(self.appdir() + '/' + config_owned)
+                config_files = flist.readlines()
 
-        if os.access(self.appdir() + '/' + config_owned, os.R_OK):
-            flist = open(self.appdir() + '/' + config_owned)
-            config_files = flist.readlines()
+                OUT.debug('Identified config-protected files.', 7)
 
-            OUT.debug('Identified config-protected files.', 7)
+                flist.close()
 
-            flist.close()
+            if os.access(self.appdir() + '/' + server_owned, os.R_OK):
+                flist = open(self.appdir() + '/' + server_owned)
+                server_files = flist.readlines()
 
-        if os.access(self.appdir() + '/' + server_owned, os.R_OK):
-            flist = open(self.appdir() + '/' + server_owned)
-            server_files = flist.readlines()
+                OUT.debug('Identified server-owned files.', 7)
 
-            OUT.debug('Identified server-owned files.', 7)
+                flist.close()
 
-            flist.close()
+            return WebappConfig.filetype.FileType(config_files,
+                                                  server_files,
+                                                  virtual_files,
+                                                  default_dirs)
 
-        self.__types = WebappConfig.filetype.FileType(config_files,
-                                                      server_files,
-                                                      virtual_files,
-                                                      default_dirs)
+        self.__types = remembered(('types', self.appdir(), config_owned,
+                                   server_owned, virtual_files,
+                                   default_dirs),
+                                  [self.appdir() + '/' + config_owned,
+                                   self.appdir() + '/' + server_owned],
+                                  types)
 
     def filetype(self, filename):
         ''' Determine filetype for the given file.'''
@@ -499,6 +968,28 @@ class WebappSource(AppHierarchy):
             return True
         return False
 
+    def listing(self, directory):
+        '''
+        Returns the directories and the files provided by the source
+        directory 'directory'. Symbolic links count as files.
+        '''
+        source_dir = re.compile('/+').sub('/', self.appdir() + '/'
+                                          + directory).rstrip('/')
+
+        def scan():
+            dirs  = []
+            files = []
+            for i in os.listdir(source_dir):
+                if os.path.islink(source_dir + '/' + i):
+                    files.append(i)
+                elif os.path.isdir(source_dir + '/' + i):
+                    dirs.append(i)
+                elif os.path.isfile(source_dir + '/' + i):
+                    files.append(i)
+            return dirs, files
+
+        return remembered(('listing', source_dir), [source_dir], scan)
+
     def get_source_directories(self, directory):
         '''
         Lists the directories provided by the source directory
@@ -507,12 +998,7 @@ class WebappSource(AppHierarchy):
         dirs = []
 
         if self.source_exists(directory):
-            source_dir = self.appdir() + '/' + directory
-            dir_entries = os.listdir(source_dir)
-            for i in dir_entries:
-                if (not os.path.islink(source_dir + '/' + i)
-                    and os.path.isdir(source_dir + '/' + i)):
-                    dirs.append(i)
+            dirs = list(self.listing(directory)[0])
 
         # Support for ignoring entries. Currently only needed
         # to enable doctests in the subversion repository
@@ -533,12 +1019,7 @@ class WebappSource(AppHierarchy):
         files = []
 
         if self.source_exists(directory):
-            source_dir = self.appdir() + '/' + directory
-            dir_entries = os.listdir(source_dir)
-            for i in dir_entries:
-                if (os.path.isfile(source_dir + '/' + i)
-                    or os.path.islink(source_dir + '/' + i)):
-                    files.append(i)
+            files = list(self.listing(directory)[1])
 
         # Support for ignoring files. Currently only needed
         # to enable doctests in the subversion repository
@@ -571,11 +1052,18 @@ class WebappSource(AppHierarchy):
             db.set_version (packages[i][2])
 
             if not db.has_installs():
-                if packages[i][0]:
+                if OUT.structured():
+                    OUT.record({'category' : packages[i][0],
+                                'pn'       : packages[i][1],
+                                'pvr'      : packages[i][2]})
+                elif packages[i][0]:
                     OUT.notice(packages[i][0] + '/' + packages[i][1] + '-' + packages[i][2])
                 else:
                     OUT.notice(packages[i][1] + '-' + packages[i][2])
 
+        if OUT.structured():
+            OUT.end_records()
+
 
     def packageavail(self):
         '''
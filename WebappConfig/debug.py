@@ -13,7 +13,7 @@ from __future__ import print_function
 ##
 #################################################################################
 
-import sys, inspect
+import sys
 
 #################################################################################
 ##
@@ -95,6 +95,16 @@ class Message:
 
         self.has_error = False
 
+        # Output format for query results. "text" is meant to be read by
+        # the user, "json" and "ndjson" by other tools.
+        self.output_format = 'text'
+
+        # Number of structured records written so far
+        self.records = 0
+
+        # Where should informational output go? None means stdout
+        self.info_out = None
+
 
     ############################################################################
     # Add command line options
@@ -246,6 +256,20 @@ class Message:
             return codes[col] + text + codes['reset']
         return text
 
+    def set_format(self, output_format = 'text'):
+        ''' Select the output format for query results. If the results
+        are structured all other messages are moved to the error output
+        so that stdout stays parseable. '''
+        self.output_format = output_format
+        self.records = 0
+        if self.structured():
+            self.info_out = self.error_out
+        else:
+            self.info_out = None
+
+    def structured(self):
+        return self.output_format != 'text'
+
     def set_info_level(self, info_level = 4):
         self.info_lev = info_level
 
@@ -292,7 +316,37 @@ class Message:
     ## Output Functions
 
     def notice (self, note):
-        print(note)
+        print(note, file=self.info_out)
+
+    def record (self, record):
+        '''
+        Writes a single structured record. Records are written as soon
+        as they are produced so the caller never needs to hold the
+        complete result.
+        '''
+        import json
+
+        line = json.dumps(record, sort_keys = True)
+
+        if self.output_format == 'json':
+            if self.records:
+                line = ',' + line
+            else:
+                line = '[' + line
+
+        print(line)
+        sys.stdout.flush()
+
+        self.records += 1
+
+    def end_records (self):
+        ''' Terminates a list of structured records. '''
+        if self.output_format == 'json':
+            if self.records:
+                print(']')
+            else:
+                print('[]')
+        self.records = 0
 
     def info (self, info, level = 4):
 
@@ -302,7 +356,7 @@ class Message:
             return
 
         for i in info.split('\n'):
-            print(self.maybe_color('green', '* ') + i)
+            print(self.maybe_color('green', '* ') + i, file=self.info_out)
 
     def status (self, message, status, info = 'ignored'):
 
@@ -314,7 +368,7 @@ class Message:
             return
 
         for i in lines[0:-1]:
-            print(self.maybe_color('green', '* ') + i)
+            print(self.maybe_color('green', '* ') + i, file=self.info_out)
 
         i = lines[-1]
 
@@ -329,7 +383,7 @@ class Message:
             result = '[' + self.maybe_color('yellow', info) + ']'
 
         print(self.maybe_color('green', '* ') + i + ' ' + '.' * (58 - len(i))  \
-              + ' ' + result)
+              + ' ' + result, file=self.info_out)
 
     def warn (self, warn, level = 4):
 
@@ -339,7 +393,7 @@ class Message:
             return
 
         for i in warn.split('\n'):
-            print(self.maybe_color('yellow', '* ') + i)
+            print(self.maybe_color('yellow', '* ') + i, file=self.info_out)
 
     def error (self, error):
 
@@ -353,6 +407,10 @@ class Message:
 
         error = str(error)
 
+        # Keep stdout parseable if records have been written already
+        if self.output_format == 'json' and self.records:
+            self.end_records()
+
         for i in error.split('\n'):
             self.error(self.maybe_color('red', 'Fatal error: ') + i)
         self.error(self.maybe_color('red', 'Fatal error(s) - aborting'))
@@ -366,6 +424,8 @@ class Message:
         if level > self.debug_lev:
             return
 
+        import inspect
+
         ## Maybe this should be debugged. So get the stack first.
         stack = inspect.stack()
 
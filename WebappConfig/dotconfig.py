@@ -21,11 +21,11 @@ about the type of package installed.  '''
 # Dependencies
 # ------------------------------------------------------------------------
 
-import pwd, shlex, os.path
+import os, os.path
 
 from time                     import strftime
 from WebappConfig.debug       import OUT
-from WebappConfig.permissions import PermissionMap
+from WebappConfig.permissions import NSS, PermissionMap
 
 # ========================================================================
 # Handler for dotConfig files
@@ -55,7 +55,8 @@ class DotConfig:
                           'WEB_INSTALLEDDATE',
                           'WEB_INSTALLEDFOR',
                           'WEB_HOSTNAME',
-                          'WEB_INSTALLDIR']
+                          'WEB_INSTALLDIR',
+                          'WEB_UPGRADEDFROM']
 
     def __getitem__(self, key):
         if key in list(self.__data.keys()):
@@ -108,6 +109,15 @@ class DotConfig:
 
         self.read()
 
+        if OUT.structured():
+            record = {'installdir' : self.__instdir}
+            for i in self.__tokens:
+                if i in self.__data:
+                    record[i[4:].lower()] = self.__data[i]
+            OUT.record(record)
+            OUT.end_records()
+            return
+
         if 'WEB_CATEGORY' in self.__data:
             OUT.notice(self.__data['WEB_CATEGORY'] + ' ' +
                    self.__data['WEB_PN'] + ' ' +
@@ -140,28 +150,31 @@ class DotConfig:
         if not self.has_dotconfig():
             raise Exception('Cannot read file ' + dotconfig)
 
-        tokens = shlex.shlex(open(dotconfig))
+        # The file is written by write() below: one KEY="value" pair per
+        # line. A simple line parser is all that is needed here.
+        with open(dotconfig) as f:
+            for line in f:
 
-        while True:
-            a = tokens.get_token()
-            b = tokens.get_token()
-            c = tokens.get_token()
+                line = line.strip()
 
-            OUT.debug('Reading token', 8)
+                if not line or line[0] == '#' or not '=' in line:
+                    continue
 
-            if (a in self.__tokens and
-                b == '=' and c):
+                a, c = line.split('=', 1)
+                a = a.strip()
+                c = c.strip()
 
-                if c[0] == '"':
-                    c = c[1:]
+                OUT.debug('Reading token', 8)
 
-                if c[-1] == '"':
-                    c = c[:-1]
+                if a in self.__tokens:
 
-                self.__data[a] = c
+                    if c[:1] == '"':
+                        c = c[1:]
 
-            else:
-                break
+                    if c[-1:] == '"':
+                        c = c[:-1]
+
+                    self.__data[a] = c
 
     def write(self,
               category,
@@ -169,20 +182,22 @@ class DotConfig:
               version,
               host,
               original_installdir,
-              user_group):
+              user_group,
+              upgraded_from = ''):
         '''
         Output the .webapp file, that tells us in future what has been installed
-        into this directory.
+        into this directory. upgraded_from names the package that has been
+        replaced by an upgrade.
         '''
         self.__data['WEB_CATEGORY']      = category
         self.__data['WEB_PN']            = package
         self.__data['WEB_PVR']           = version
-        self.__data['WEB_INSTALLEDBY']   = pwd.getpwuid(os.getuid())[0]
+        self.__data['WEB_INSTALLEDBY']   = NSS.user_name(os.getuid())
         self.__data['WEB_INSTALLEDDATE'] = strftime('%Y-%m-%d %H:%M:%S')
         self.__data['WEB_INSTALLEDFOR']  = user_group
         self.__data['WEB_HOSTNAME']      = host
         self.__data['WEB_INSTALLDIR']    = original_installdir
-
+        self.__data['WEB_UPGRADEDFROM']  = upgraded_from
 
         info = ['# ' + self.__file,
                 '#	config file for this copy of '
@@ -192,7 +207,9 @@ class DotConfig:
                 '#	do NOT edit this file by hand',
                 '',]
         for i in self.__tokens:
-            info.append(i + '="' + self.__data[i] + '"')
+            if i in self.__data and (self.__data[i]
+                                     or i != 'WEB_UPGRADEDFROM'):
+                info.append(i + '="' + self.__data[i] + '"')
 
         if not self.__p:
             try:
@@ -20,11 +20,90 @@
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os.path, re, pwd, grp
+import os, os.path, re, time
 
 from WebappConfig.debug     import OUT
+from WebappConfig.permissions import NSS
 import WebappConfig.wrapper as wrapper
-from WebappConfig.sandbox   import Sandbox
+from WebappConfig.sandbox   import Sandbox, describe_status
+
+# ========================================================================
+# Rendering of the post files
+# ------------------------------------------------------------------------
+
+# The post files used to be passed line by line through the shell as
+# printf "<line>". These helpers produce the same result without
+# starting a process per line.
+
+VARIABLE  = re.compile(r'\$(?:\{([A-Za-z_]\w*)\}|([A-Za-z_]\w*)|([0-9#?@*!$-]))')
+
+DIRECTIVE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|(.))'
+                       r'|%([-+ #0]*\d*(?:\.\d*)?)([diouxXfFeEgGcsb%])',
+                       re.S)
+
+ESCAPES   = {'\\' : '\\', 'a' : '\a', 'b' : '\b', 'f' : '\f', 'n' : '\n',
+             'r' : '\r', 't' : '\t', 'v' : '\v', '"' : '"', "'" : "'"}
+
+def expand(line, env):
+    '''
+    Expands the variables in line the way the shell does inside double
+    quotes. Unknown variables expand to nothing. Command substitution
+    is not supported and left alone.
+
+    >>> expand('Go to ${VHOST_ROOT}/$PN, not \\\\$PN', {'VHOST_ROOT' :
+    ...        '/var/www/localhost', 'PN' : 'horde'})
+    'Go to /var/www/localhost/horde, not $PN'
+    '''
+
+    result = []
+    i = 0
+
+    while i < len(line):
+        if line[i] == '\\' and i + 1 < len(line) and line[i + 1] in '$`"\\\n':
+            if line[i + 1] != '\n':
+                result.append(line[i + 1])
+            i += 2
+            continue
+
+        m = VARIABLE.match(line, i) if line[i] == '$' else None
+
+        if m:
+            result.append(env.get(m.group(1) or m.group(2), ''))
+            i = m.end()
+        else:
+            result.append(line[i])
+            i += 1
+
+    return ''.join(result)
+
+def printf(format):
+    '''
+    Interprets the escapes and directives of a printf format string
+    without any arguments.
+
+    >>> printf('100%% done\\tin %s\\x21\\n')
+    '100% done\\tin !\\n'
+    '''
+
+    def directive(m):
+        (octal, hexadecimal, escape, flags, conversion) = m.groups()
+
+        if octal:
+            return chr(int(octal, 8))
+        if hexadecimal:
+            return chr(int(hexadecimal, 16))
+        if escape is not None:
+            return ESCAPES.get(escape, '\\' + escape)
+        if conversion == '%':
+            return '%'
+        if conversion in 'csb':
+            return ('%' + flags + 's') % ''
+        return ('%' + flags + conversion) % 0
+
+    return DIRECTIVE.sub(directive, format)
+
+# Rendered post files, keyed by file and the variables used
+RENDERED = {}
 
 # ========================================================================
 # Handler for ebuild related tasks
@@ -47,6 +126,9 @@ class Ebuild:
         self.__hooksd  = self.__re.sub('/', self.__root
                            + self.get_config('my_hookscriptsdir'))
 
+        # Results of the hook scripts run by run_hooks()
+        self.hook_results = []
+
     def get_config(self, option):
         ''' Return a config option.'''
         return self.config.config.get('USER', option)
@@ -64,15 +146,53 @@ class Ebuild:
         # save list of environment variables to set
         env_map = self.run_vars(server)
 
+        timeout = float(self.config.maybe_get('vhost_hook_timeout') or 0)
+        logfile = self.config.maybe_get('vhost_hook_log') or None
+
+        results = []
+
         if os.path.isdir(self.__hooksd):
-            for x in os.listdir(self.__hooksd):
+            for x in sorted(os.listdir(self.__hooksd)):
 
                 if (os.path.isfile(self.__hooksd + '/' + x) and
                     os.access(self.__hooksd + '/' + x, os.X_OK)):
 
                     OUT.debug('Running hook script', 7)
 
-                    sandbox.spawn(self.__hooksd + '/' + x + ' ' + type, env_map)
+                    start  = time.time()
+                    status = sandbox.spawn(self.__hooksd + '/' + x + ' '
+                                           + type, env_map, timeout,
+                                           logfile)
+
+                    results.append({'hook'     : x,
+                                    'type'     : type,
+                                    'status'   : status,
+                                    'wall'     : time.time() - start,
+                                    'cpu'      : sandbox.cputime,
+                                    'timedout' : sandbox.timedout})
+
+                    OUT.info('  Hook %s: %s, %.2fs (%.2fs CPU)'
+                             % (x, describe_status(status),
+                                results[-1]['wall'], sandbox.cputime), 1)
+
+                    if sandbox.timedout:
+                        OUT.warn('Hook script ' + x + ' did not finish wi'
+                                 'thin ' + str(timeout) + ' seconds and ha'
+                                 's been killed')
+                    elif status:
+                        OUT.warn('Hook script ' + x + ' failed with '
+                                 + describe_status(status))
+
+        if results:
+            OUT.info('Ran %d %s hook script(s) in %.2fs (%.2fs CPU), %d f'
+                     'ailed' % (len(results), type,
+                                sum([i['wall'] for i in results]),
+                                sum([i['cpu'] for i in results]),
+                                len([i for i in results if i['status']])))
+
+        self.hook_results += results
+
+        return results
 
     def show_post(self, filename, ptype, server = None):
         '''
@@ -86,11 +206,7 @@ class Ebuild:
         if not os.path.isfile(post_file):
             return
 
-        self.run_vars(server)
-
-        post_instructions = open(post_file).readlines()
-
-        OUT.debug('Read post instructions', 7)
+        env_map = self.run_vars(server)
 
         post = [
             '',
@@ -99,11 +215,7 @@ class Ebuild:
             '=================================================================',
             '']
 
-        for i in post_instructions:
-            i = i.replace('"', '\\"')
-            post.append(os.popen('printf "' + i + '"\n').read()[:-1])
-
-        post = post + [
+        post = post + self.render(post_file, env_map) + [
             '',
             '=================================================================',
             '']
@@ -111,6 +223,27 @@ class Ebuild:
         for i in post:
             OUT.notice(i)
 
+    def render(self, post_file, env_map):
+        '''
+        Returns the lines of a post file with the variables expanded.
+        The result is reused for the same file and variables.
+        '''
+
+        key = (post_file, os.path.getmtime(post_file),
+               tuple(sorted(env_map.items())))
+
+        if not key in RENDERED:
+
+            OUT.debug('Read post instructions', 7)
+
+            env = dict(os.environ)
+            env.update(env_map)
+
+            RENDERED[key] = [printf(expand(i, env))[:-1]
+                             for i in open(post_file).readlines()]
+
+        return RENDERED[key]
+
     def show_postinst(self, server = None):
         '''
         Display any post-installation instructions, if there are any.
@@ -149,8 +282,8 @@ class Ebuild:
         vsu = None
         vsg = None
         if server:
-            vsu = pwd.getpwuid(server.vhost_server_uid)[0]
-            vsg = grp.getgrgid(server.vhost_server_gid)[0]
+            vsu = NSS.user_name(server.vhost_server_uid)
+            vsg = NSS.group_name(server.vhost_server_gid)
 
         OUT.debug('Exporting variables', 7)
 
@@ -20,10 +20,27 @@
 # Dependencies
 # ------------------------------------------------------------------------
 
-import re
+import fnmatch, re
 
 from WebappConfig.debug     import OUT
 
+# ========================================================================
+# Ownership flags
+# ------------------------------------------------------------------------
+
+CONFIG_OWNED = 1
+SERVER_OWNED = 2
+
+OWNER_TYPES  = {CONFIG_OWNED                : 'config-owned',
+                SERVER_OWNED                : 'server-owned',
+                CONFIG_OWNED | SERVER_OWNED : 'config-server-owned'}
+
+# Suffix marking a rule for a complete directory tree
+SUBTREE      = '/**'
+
+# Character that turns an entry into a shell pattern
+GLOB_CHAR    = '*'
+
 # ========================================================================
 # Handler for File Types
 # ------------------------------------------------------------------------
@@ -36,6 +53,20 @@ class FileType:
 
     - a list of all files and directories owned by the config user
     - a list of all files and directories owned by the server user
+
+    An entry ending in "/**" marks the directory and everything below
+    it. Such subtree rules are stored in a trie of path components so
+    each lookup only costs as much as the depth of the path.
+
+    Any other entry containing a "*" is an fnmatch style pattern (e.g.
+    "*/config.inc.php"). In such entries "?" and "[...]" are wildcards
+    as well, entries without a "*" always name a path literally. A
+    pattern ending in "/**" marks the matching directories and
+    everything below them. All patterns of one list are compiled into a
+    single regular expression when the lists are loaded.
+
+    Subtree rules and patterns are relative to the application
+    directory, a leading slash is ignored for them.
     '''
 
     def __init__(self,
@@ -48,33 +79,103 @@ class FileType:
         ebuild.
         '''
 
+        # Ownership flags of exactly specified paths
         self.__cache = {}
 
+        # Trie for subtree rules. Each node maps path components to
+        # child nodes and stores the ownership flags under None.
+        self.__trees = {}
+
+        # Combined matchers for shell patterns as (flag, regex) pairs
+        self.__patterns = []
+
+        self.__slashes = re.compile('/+')
+
         # Validity of entries are checked by the command line parser
         self.__virtual_files = virtual_files
         self.__default_dirs  = default_dirs
 
         # populate cache
-        for i in config_owned:
+        for owner, entries in [(CONFIG_OWNED, config_owned),
+                               (SERVER_OWNED, server_owned)]:
 
-            OUT.debug('Adding config-owned file', 8)
+            OUT.debug('Adding ' + OWNER_TYPES[owner] + ' files', 8)
 
-            self.__cache[self.__fix(i)] = 'config-owned'
+            patterns = []
 
-        for i in server_owned:
+            for i in entries:
+                patterns.extend([fnmatch.translate(j)
+                                 for j in self.__add(i, owner)])
 
-            if self.__fix(i) in list(self.__cache.keys()):
+            if patterns:
+                self.__patterns.append(
+                    (owner, re.compile('|'.join(['(?:' + i + ')'
+                                                 for i in patterns]))))
 
-                OUT.debug('Adding config-server-owned file', 8)
+    def __add(self, entry, owner):
+        '''
+        Records the ownership flag for a single list entry. Shell
+        patterns are returned to the caller for compilation.
+
+        >>> types = FileType([], [])
+        >>> types._FileType__add('htdocs/*/tmp/**', CONFIG_OWNED)
+        ['htdocs/*/tmp', 'htdocs/*/tmp/*']
+        >>> types._FileType__add('htdocs/[1]?.php', CONFIG_OWNED)
+        []
+        '''
+
+        entry = self.__fix(entry)
+
+        is_subtree = entry == SUBTREE[1:] or entry.endswith(SUBTREE)
+        if is_subtree:
+            directory = self.__fix(entry[:-2]).lstrip('/')
+        else:
+            directory = entry
+
+        if GLOB_CHAR in directory:
+            if is_subtree:
+                # "*" matches "/" as well
+                return [directory, directory + '/*']
+            return [entry.lstrip('/')]
+
+        if is_subtree:
+
+            node = self.__trees
+            if directory:
+                for i in directory.split('/'):
+                    node = node.setdefault(i, {})
+
+            node[None] = node.get(None, 0) | owner
+
+        elif entry:
+            self.__cache[entry] = self.__cache.get(entry, 0) | owner
+
+        return []
+
+    def __owner(self, path):
+        '''
+        Returns the combined ownership flags of the exact entry for
+        path and all subtree rules covering it.
+        '''
 
-                self.__cache[self.__fix(i)] = 'config-server-owned'
+        owner = self.__cache.get(path, 0)
 
-            else:
+        relative = path.lstrip('/')
 
-                OUT.debug('Adding server-owned file', 8)
+        if self.__trees:
+            node  = self.__trees
+            owner = owner | node.get(None, 0)
+            for i in relative.split('/'):
+                node = node.get(i)
+                if node is None:
+                    break
+                owner = owner | node.get(None, 0)
 
-                self.__cache[self.__fix(i)] = 'server-owned'
+        for flag, matcher in self.__patterns:
+            if not owner & flag and matcher.match(relative):
+                owner = owner | flag
 
+        return owner
 
     def filetype(self, filename):
         '''
@@ -103,8 +204,9 @@ class FileType:
         filename = self.__fix(filename)
 
         # look for config-protected files in the cache
-        if filename in list(self.__cache.keys()):
-            return self.__cache[filename]
+        owner = self.__owner(filename)
+        if owner:
+            return OWNER_TYPES[owner]
 
         # unspecified file (and thus virtual)
         return self.__virtual_files
@@ -134,8 +236,9 @@ class FileType:
         directory = self.__fix(directory)
 
         # check the cache
-        if directory in list(self.__cache.keys()):
-            return self.__cache[directory]
+        owner = self.__owner(directory)
+        if owner:
+            return OWNER_TYPES[owner]
 
         # unspecified directories are default-owned
         return self.__default_dirs
@@ -143,10 +246,10 @@ class FileType:
     def __fix(self, filename):
         ''' Removes trailing slash and whitespace from a path '''
         filename = filename.strip()
-        while filename[-1] == '/':
+        while filename and filename[-1] == '/':
             filename = filename[:-1]
 
         # Fix double slashes
-        filename = re.compile('/+').sub('/', filename) 
+        filename = self.__slashes.sub('/', filename)
 
         return filename
@@ -0,0 +1,198 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Journal of the changes made to a virtual install.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import os, os.path
+
+from WebappConfig.debug     import OUT
+
+# ========================================================================
+# Journal handler
+# ------------------------------------------------------------------------
+
+class Journal:
+    '''
+    The journal is an append-only file in the installation directory
+    that records every entry added to or deleted from the contents
+    while an install is running or a clean removes files. The contents
+    file itself is only written once the operation is complete, so the
+    journal is the only record of an interrupted operation. It is
+    removed again once the operation finished successfully.
+
+    JOURNAL file format:
+
+      action <install|clean>
+      category <category>
+      package <package name>
+      version <package version>
+      upgrade <package replaced by an upgrade, optional>
+      add <contents line>
+      del <contents entry>
+      ...
+    '''
+
+    def __init__(self,
+                 installdir,
+                 dbfile  = '.webapp',
+                 pretend = False):
+
+        self.__installdir = installdir
+        self.__dbfile     = dbfile
+        self.__p          = pretend
+
+        self.__file       = None
+        self.__header     = ''
+        self.__content    = None
+
+    def path(self):
+        ''' Return the full path to the journal file.'''
+        return self.__installdir + '/' + self.__dbfile + '.journal'
+
+    def exists(self):
+        ''' Is there a journal of an interrupted operation?'''
+        return os.path.isfile(self.path())
+
+    def read(self):
+        '''
+        Reads the journal. Returns a dictionary with the header fields and
+        the list of (kind, value) change records.
+        '''
+
+        header  = {}
+        records = []
+
+        with open(self.path()) as f:
+            for i in f:
+
+                # Skip a line that has not been written completely
+                if not i.endswith('\n') or not ' ' in i:
+                    continue
+
+                (kind, value) = i[:-1].split(' ', 1)
+
+                if kind in ['add', 'del']:
+                    records.append((kind, value))
+                else:
+                    header[kind] = value
+
+        return header, records
+
+    def begin(self, action, content, upgraded_from = ''):
+        '''
+        Starts recording the changes made to content. If the journal of
+        an interrupted run of the same action exists, its changes are
+        replayed into content first and new changes are appended. An
+        install that is part of an upgrade records the package it
+        replaces in upgraded_from.
+        '''
+
+        if self.__p:
+            return
+
+        if self.exists():
+
+            (header, records) = self.read()
+
+            if header.get('action') != action:
+                OUT.die('Cannot ' + action + '!\nThe interrupted '
+                        + str(header.get('action')) + ' in '
+                        + self.__installdir + ' needs to be resumed or'
+                        ' rolled back first.')
+
+            OUT.info('Resuming the interrupted ' + action + ' ('
+                     + str(len(records)) + ' changes already done)')
+
+            for (kind, value) in records:
+                if kind == 'add':
+                    content.restore(value)
+                else:
+                    content.forget(value)
+
+            self.__header = ''
+
+        else:
+
+            (cat, pn, pvr) = content.get_package()
+
+            self.__header = ('action '   + action + '\n'
+                             'category ' + cat    + '\n'
+                             'package '  + pn     + '\n'
+                             'version '  + pvr    + '\n')
+
+            if upgraded_from:
+                self.__header += 'upgrade ' + upgraded_from + '\n'
+
+        self.__content = content
+        content.set_journal(self)
+
+    def record(self, kind, value):
+        '''
+        Appends a change record. The file is only created with the first
+        record since the installation directory may not exist before.
+        '''
+        if not self.__content:
+            return
+
+        if not self.__file:
+            if self.__header:
+                self.__file = open(self.path(), 'w')
+                self.__file.write(self.__header)
+            else:
+                self.__file = open(self.path(), 'a')
+
+        self.__file.write(kind + ' ' + value + '\n')
+        self.__file.flush()
+
+    def added(self, line):
+        ''' Records a line added to the contents.'''
+        self.record('add', line)
+
+    def removed(self, entry):
+        ''' Records an entry deleted from the contents.'''
+        self.record('del', entry)
+
+    def close(self):
+        ''' Stops recording but keeps the journal.'''
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+        if self.__content:
+            self.__content.set_journal(None)
+            self.__content = None
+
+    def commit(self):
+        ''' The operation is complete. Removes the journal.'''
+        self.discard()
+
+    def discard(self):
+        ''' Removes the journal without replaying it.'''
+        self.close()
+        if not self.__p and self.exists():
+            os.unlink(self.path())
+
+    def abort(self, action):
+        ''' The operation failed. Keeps the journal for later.'''
+        self.close()
+        if not self.__p and self.exists():
+            OUT.warn('The ' + action + ' in ' + self.__installdir
+                     + ' did not complete.\nUse --resume to complete it or'
+                     ' --rollback to undo it.')
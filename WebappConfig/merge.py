@@ -0,0 +1,290 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Three-way merging of config protected files.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import difflib, os, os.path, re, stat
+
+import WebappConfig.wrapper as wrapper
+
+from concurrent.futures     import ThreadPoolExecutor
+from WebappConfig.debug     import OUT
+
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+def changes(base, other):
+    '''
+    Returns the regions of base that have been changed in other as a
+    list of (start, end, replacement lines) tuples.
+
+    >>> changes(['a\\n', 'b\\n', 'c\\n'], ['a\\n', 'B\\n', 'c\\n', 'd\\n'])
+    [(1, 2, ['B\\n']), (3, 3, ['d\\n'])]
+    '''
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk = False)
+
+    return [(i1, i2, other[j1:j2])
+            for (tag, i1, i2, j1, j2) in matcher.get_opcodes()
+            if tag != 'equal']
+
+def terminated(lines):
+    ''' Makes sure the last line ends with a newline.'''
+    if lines and not lines[-1].endswith('\n'):
+        return lines[:-1] + [lines[-1] + '\n']
+    return lines
+
+def merge3(base, mine, theirs, labels = ('mine', 'base', 'new')):
+    '''
+    Merges the changes leading from base to mine and from base to
+    theirs. All three arguments are lists of lines. Returns the merged
+    lines and the number of conflicts. Conflicting regions are written
+    in diff3 style.
+
+    >>> merge3(['a\\n', 'b\\n', 'c\\n'],
+    ...        ['A\\n', 'b\\n', 'c\\n'],
+    ...        ['a\\n', 'b\\n', 'C\\n'])
+    (['A\\n', 'b\\n', 'C\\n'], 0)
+
+    Identical changes on both sides are not a conflict:
+
+    >>> merge3(['a\\n'], ['b\\n'], ['b\\n'])
+    (['b\\n'], 0)
+
+    >>> lines, conflicts = merge3(['a\\n'], ['b\\n'], ['c\\n'])
+    >>> conflicts
+    1
+    >>> lines[1:-1]
+    ['b\\n', '||||||| base\\n', 'a\\n', '=======\\n', 'c\\n']
+    >>> lines[0], lines[-1]
+    ('<<<<<<< mine\\n', '>>>>>>> new\\n')
+    '''
+
+    hunks = sorted([(i1, i2, 0, lines) for (i1, i2, lines)
+                    in changes(base, mine)] +
+                   [(i1, i2, 1, lines) for (i1, i2, lines)
+                    in changes(base, theirs)])
+
+    result    = []
+    conflicts = 0
+    position  = 0
+    k         = 0
+
+    while k < len(hunks):
+
+        # Collect all changes touching the same region of base
+        start, end = hunks[k][0], hunks[k][1]
+        group = [hunks[k]]
+        k += 1
+
+        while k < len(hunks) and hunks[k][0] <= end:
+            end = max(end, hunks[k][1])
+            group.append(hunks[k])
+            k += 1
+
+        result.extend(base[position:start])
+        position = end
+
+        original = base[start:end]
+        versions = []
+
+        for side in (0, 1):
+            lines, i = [], start
+            for (i1, i2, side_of, replacement) in group:
+                if side_of == side:
+                    lines.extend(base[i:i1])
+                    lines.extend(replacement)
+                    i = i2
+            lines.extend(base[i:end])
+            versions.append(lines)
+
+        if versions[0] == original or versions[0] == versions[1]:
+            result.extend(versions[1])
+        elif versions[1] == original:
+            result.extend(versions[0])
+        else:
+            conflicts += 1
+            result.append('<<<<<<< ' + labels[0] + '\n')
+            result.extend(terminated(versions[0]))
+            result.append('||||||| ' + labels[1] + '\n')
+            result.extend(terminated(original))
+            result.append('=======\n')
+            result.extend(terminated(versions[1]))
+            result.append('>>>>>>> ' + labels[2] + '\n')
+
+    result.extend(base[position:])
+
+    return result, conflicts
+
+def readlines(filename):
+    ''' Reads a file into a list of lines keeping the line endings.'''
+    with open(filename, encoding = 'utf-8', errors = 'surrogateescape',
+              newline = '') as f:
+        return f.read().splitlines(True)
+
+# ========================================================================
+# Config merge handler
+# ------------------------------------------------------------------------
+
+class ConfigMerge:
+    '''
+    Merges the config protected files left in virtual installs after
+    an upgrade. For every protected file the pristine file of the old
+    version, the file edited by the user and the new file hidden behind
+    the protect prefix are merged. Clean merges replace the user file
+    and remove the protected file, real conflicts are left alone.
+
+    Only the newest protected version of a file is merged. Older ones
+    stem from earlier upgrades and are removed together with it.
+    '''
+
+    def __init__(self,
+                 pristine,
+                 installdirs,
+                 jobs      = None,
+                 dotconfig = '.webapp',
+                 verbose   = False,
+                 pretend   = False):
+        '''
+        pristine    - the master image (htdocs) of the old version
+        installdirs - the virtual installs to process
+        dotconfig   - the file marking a virtual install
+        '''
+        self.pristine    = pristine
+        self.installdirs = installdirs
+        self.jobs        = jobs
+        self.dotconfig   = dotconfig
+
+        self.__v = verbose
+        self.__p = pretend
+        self.__re = re.compile('^' + re.escape(wrapper.protect_prefix)
+                               + r'(\d{4})_(.+)$')
+
+    def protected_files(self, installdir):
+        '''
+        Yields (protected files, user file, pristine file) for each file
+        below the given installdir that has protected versions. The
+        protected files are sorted from the oldest to the newest. Other
+        virtual installs nested in the installdir are skipped.
+        '''
+
+        for (path, dirs, files) in os.walk(installdir):
+
+            dirs[:] = sorted([i for i in dirs if not os.path.isfile(
+                os.path.join(path, i, self.dotconfig))])
+
+            protected = {}
+
+            for i in files:
+                rem = self.__re.match(i)
+                if rem and rem.group(2) in files:
+                    protected.setdefault(rem.group(2), []).append(i)
+
+            relative = os.path.relpath(path, installdir)
+
+            for (name, versions) in sorted(protected.items()):
+                yield ([os.path.join(path, i) for i in sorted(versions)],
+                       os.path.join(path, name),
+                       os.path.normpath(os.path.join(self.pristine,
+                                                     relative, name)))
+
+    def merge_file(self, protected, target, pristine):
+        '''
+        Merges the newest of the protected files and removes all of
+        them. Returns "merged", "conflict" or "skipped".
+        '''
+
+        if os.path.islink(target) or not os.path.isfile(pristine):
+            return 'skipped'
+
+        try:
+            base   = readlines(pristine)
+            mine   = readlines(target)
+            theirs = readlines(protected[-1])
+        except (IOError, OSError):
+            return 'skipped'
+
+        (lines, conflicts) = merge3(base, mine, theirs)
+
+        if conflicts:
+            return 'conflict'
+
+        if self.__p:
+            return 'merged'
+
+        if lines != mine:
+            tmp = target + '.webapp-merge'
+            with open(tmp, 'w', encoding = 'utf-8',
+                      errors = 'surrogateescape', newline = '') as f:
+                f.write(''.join(lines))
+
+            # Keep the ownership and permissions of the user file
+            info = os.stat(target)
+            os.chmod(tmp, stat.S_IMODE(info.st_mode))
+            try:
+                os.chown(tmp, info.st_uid, info.st_gid)
+            except OSError:
+                pass
+            os.rename(tmp, target)
+
+        for i in protected:
+            os.unlink(i)
+
+        return 'merged'
+
+    def run(self):
+        '''
+        Merges the protected files of all virtual installs in parallel.
+        Returns the list of files that still need to be merged manually.
+        '''
+
+        files = []
+        for i in self.installdirs:
+            if os.path.isdir(i):
+                files.extend(self.protected_files(i))
+
+        if not files:
+            OUT.info('No config protected files found.')
+            return []
+
+        with ThreadPoolExecutor(max_workers = self.jobs) as pool:
+            results = list(pool.map(lambda i: self.merge_file(*i), files))
+
+        left = []
+
+        for ((protected, target, pristine), result) in zip(files, results):
+            if result == 'merged':
+                if self.__p:
+                    OUT.info('    would have merged "' + protected[-1] + '"')
+                elif self.__v:
+                    OUT.notice('>>> merged ' + target)
+            else:
+                OUT.notice('^o^ ' + result + ' ' + protected[-1])
+                left.append(protected[-1])
+
+        OUT.info(str(len(files) - len(left)) + ' of ' + str(len(files))
+                 + ' config protected files merged.')
+
+        if left:
+            OUT.warn('Some config protected files could not be merged.\n'
+                     'Please run ' + wrapper.update_command + ' to merge'
+                     ' them manually.')
+
+        return left
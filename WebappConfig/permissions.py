@@ -23,7 +23,7 @@ file permission settings with values supplied by the user.
 # Dependencies
 # ------------------------------------------------------------------------
 
-import re, grp, pwd
+import re, grp, pwd, time
 
 # ========================================================================
 # Permission Helper
@@ -58,7 +58,7 @@ class PermissionMap:
         Test the simple case:
 
         >>> a = PermissionMap('0777')
-        >>> a(0644)
+        >>> a(0o644)
         511
         >>> a(0000)
         511
@@ -69,64 +69,79 @@ class PermissionMap:
         >>> a(0000)
         511
         >>> a = PermissionMap('u=rwx,g=x,o=w')
-        >>> a(0644)
+        >>> a(0o644)
         458
         >>> a = PermissionMap('u-rw,g=x,o+x')
-        >>> a(0644)
+        >>> a(0o644)
         13
         >>> a = PermissionMap('u-rwx,g-rwx,o-x')
-        >>> a(0751)
+        >>> a(0o751)
         0
         >>> a = PermissionMap('u=rw,g=r,o=')
         >>> a(0000)
         416
         '''
 
-        # Check if the permissions are absolute
+        if not permissions in self.__cache:
+            self.__cache[permissions] = ((permissions & self.__and)
+                                         | self.__or)
+
+        return self.__cache[permissions]
+
+    def compile(self):
+        ''' Folds the clauses into a single (and-mask, or-mask) pair.
+
+        >>> a = PermissionMap('u-rw,g=x,o+x')
+        >>> [oct(i) for i in a.compile()]
+        ['-0o671', '0o11']
+        '''
+
+        # Absolute permissions replace all bits
 
         if self.__absolute:
-            return self.__permissions
-        else:
+            return (0, self.__permissions)
+
+        and_mask = ~0
+        or_mask  = 0
+
+        for i in self.__permissions:
 
-            for i in self.__permissions:
+            (entity, operator, perm) = self.valid.match(i).groups()
 
-                # Permission mask. More complex
+            # Generate the permission bits
 
-                entity   = self.valid.match(i).group(1)
-                operator = self.valid.match(i).group(2)
-                perm     = self.valid.match(i).group(3)
+            perm_bit = 0
 
-                # Generate the permission bits
+            for j in perm:
+                perm_bit |= {'r' : READ, 'w' : WRITE, 'x' : EXECUTE}[j]
 
-                perm_bit = 0
+            shift = []
 
-                for i in perm:
-                    if i == 'r':
-                        perm_bit |= READ
-                    if i == 'w':
-                        perm_bit |= WRITE
-                    if i == 'x':
-                        perm_bit |= EXECUTE
+            for j in entity:
+                if j == 'a':
+                    shift += [ USER, GROUP, OTHER ]
+                else:
+                    shift += [{'u' : USER, 'g' : GROUP, 'o' : OTHER}[j]]
 
-                for i in entity:
-                    if i == 'u':
-                        shift = [ USER  ]
-                    if i == 'g':
-                        shift = [ GROUP ]
-                    if i == 'o':
-                        shift = [ OTHER ]
-                    if i == 'a':
-                        shift = [ USER, GROUP, OTHER ]
+            # Every clause maps x to (x & clear) | add. Applying it
+            # after the previous clauses gives
+            # (x & and_mask & clear) | (or_mask & clear) | add
 
-                    for j in shift:
-                        if operator == '=':
-                            permissions &= ~(ALL << j)
-                        if operator == '-':
-                            permissions &= ~(perm_bit << j)
-                        if operator == '+' or operator == '=':
-                            permissions |= (perm_bit << j)
+            clear = ~0
+            add   = 0
 
-        return permissions
+            for j in shift:
+                if operator == '=':
+                    clear &= ~(ALL << j)
+                if operator == '-':
+                    clear &= ~(perm_bit << j)
+                if operator == '+' or operator == '=':
+                    add   |= (perm_bit << j)
+
+            and_mask &= clear
+            or_mask   = (or_mask & clear) | add
+
+        return (and_mask, or_mask)
 
     def __init__(self, permissions):
         '''Check that the given permission map evaluates to something
@@ -161,7 +176,7 @@ class PermissionMap:
 
         if re.compile('[0-7]{4}').match(permissions):
             self.__absolute    = True
-            self.__permissions = eval("0o"+permissions)
+            self.__permissions = int(permissions, 8)
 
         else:
             # Split on commas first
@@ -179,17 +194,104 @@ class PermissionMap:
             self.__permissions = splitted_permissions
             self.__absolute    = False
 
+        # Applying the map only takes two integer operations
+
+        (self.__and, self.__or) = self.compile()
+        self.__cache = {}
+
     def __str__(self):
       if self.__absolute:
         return 'Absolute: {}'.format(oct(self.__permissions))
       else:
         return 'Relative: {}'.format(self.__permissions)
 
+# ========================================================================
+# User and group resolution
+# ------------------------------------------------------------------------
+
+class NSSCache:
+    '''
+    Remembers the answers of the user and group database. Lookups may
+    be slow if the database is provided by a network service (LDAP,
+    SSSD), so each distinct user or group is only looked up once per
+    process. With a time to live set, answers older than ttl seconds
+    are looked up again. Failed lookups are cached as well.
+
+    >>> cache = NSSCache()
+    >>> cache.user('root'), cache.group(0), cache.user_name(0)
+    (0, 0, 'root')
+    >>> cache.user('does_not_exist')
+    Traceback (most recent call last):
+    ...
+    KeyError: 'The given user "does_not_exist" does not exist!'
+    '''
+
+    def __init__(self, ttl = 0):
+
+        self.ttl       = ttl
+        self.__answers = {}
+
+    def clear(self):
+        ''' Forgets all answers.'''
+        self.__answers = {}
+
+    def lookup(self, kind, key, function):
+        ''' Returns the answer of function(key), looked up only once.'''
+
+        now = time.time()
+        answer = self.__answers.get((kind, key))
+
+        if answer is None or (self.ttl and now - answer[0] > self.ttl):
+            try:
+                answer = (now, function(key), None)
+            except KeyError as e:
+                answer = (now, None, e)
+            self.__answers[(kind, key)] = answer
+
+        if answer[2]:
+            raise KeyError(*answer[2].args)
+
+        return answer[1]
+
+    def user(self, user):
+        ''' Returns the uid of a user name or id.'''
+        return self.lookup('user', str(user), lambda i: resolve_user(user))
+
+    def group(self, group):
+        ''' Returns the gid of a group name or id.'''
+        return self.lookup('group', str(group),
+                           lambda i: resolve_group(group))
+
+    def user_name(self, uid):
+        ''' Returns the name of a uid.'''
+        return self.lookup('user_name', uid, lambda i: pwd.getpwuid(i)[0])
+
+    def group_name(self, gid):
+        ''' Returns the name of a gid.'''
+        return self.lookup('group_name', gid, lambda i: grp.getgrgid(i)[0])
+
+    def resolve(self, users = (), groups = ()):
+        '''
+        Looks up several users and groups in one go, e.g. at startup.
+        Errors are only reported once the value is actually used.
+        '''
+        for (function, values) in [(self.user, users),
+                                   (self.group, groups)]:
+            for i in values:
+                if i != '' and i is not None:
+                    try:
+                        function(i)
+                    except KeyError:
+                        pass
+
+# Cache shared by all users of this process
+NSS = NSSCache()
+
 def get_group(group):
     '''
     Specify a group id either as integer, as string that can
     be transformed into an integer or a string that matches
-    a group name.
+    a group name. The answer is cached.
 
     >>> get_group(0)
     0
@@ -202,6 +304,29 @@ def get_group(group):
     ...
     KeyError: 'The given group "does_not_exist" does not exist!'
     '''
+    return NSS.group(group)
+
+def get_user(user):
+    '''
+    Specify a user id either as integer, as string that can
+    be transformed into an integer or a string that matches
+    a user name. The answer is cached.
+
+    >>> get_user(0)
+    0
+    >>> get_user('0')
+    0
+    >>> get_user('root')
+    0
+    >>> get_user('does_not_exist')
+    Traceback (most recent call last):
+    ...
+    KeyError: 'The given user "does_not_exist" does not exist!'
+    '''
+    return NSS.user(user)
+
+def resolve_group(group):
+    ''' Looks up a group id without caching.'''
 
     gid = -1
     ngroup = -1
@@ -234,23 +359,8 @@ def get_group(group):
 
     return gid
 
-def get_user(user):
-    '''
-    Specify a user id either as integer, as string that can
-    be transformed into an integer or a string that matches
-    a user name.
-
-    >>> get_user(0)
-    0
-    >>> get_user('0')
-    0
-    >>> get_user('root')
-    0
-    >>> get_user('does_not_exist')
-    Traceback (most recent call last):
-    ...
-    KeyError: 'The given user "does_not_exist" does not exist!'
-    '''
+def resolve_user(user):
+    ''' Looks up a user id without caching.'''
     uid = -1
     nuser = -1
 
@@ -0,0 +1,506 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+'''
+Package manager backends used by wrapper.py. The answers of the package
+manager are cached for the lifetime of the process and on disk.
+'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import abc, json, os, os.path, re, subprocess, tempfile, threading
+
+from WebappConfig.debug       import OUT
+from WebappConfig.eprefix     import EPREFIX
+
+# ========================================================================
+# Constants
+# ------------------------------------------------------------------------
+
+# Directory holding the answers cached across runs
+CACHE_DIR = EPREFIX + '/var/cache/webapp-config'
+
+# Environment variables that change the answers of the package manager
+ENVIRONMENT = ['ROOT', 'PORTAGE_CONFIGROOT', 'CONFIG_PROTECT',
+               'CONFIG_PROTECT_MASK']
+
+VERSION = re.compile(r'^(\d+)((?:\.\d+)*)([a-z]?)'
+                     r'((?:_(?:alpha|beta|pre|rc|p)\d*)*)(?:-r(\d+))?$')
+
+SUFFIX  = re.compile(r'_(alpha|beta|pre|rc|p)(\d*)')
+
+# Suffix order, no suffix sorts between "rc" and "p"
+SUFFIXES = {'alpha' : 0, 'beta' : 1, 'pre' : 2, 'rc' : 3, 'p' : 5}
+
+ATOM    = re.compile(r'^(>=|<=|=|~|>|<)?(?:([\w+][\w+.-]*)/)?'
+                     r'([\w+][\w+.-]*?)(\*)?$')
+
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+def split_version(name):
+    '''
+    Splits "pn-pvr" into package name and version. Returns None for the
+    version if name carries none.
+
+    >>> split_version('apache-2.4.58-r1')
+    ('apache', '2.4.58-r1')
+    >>> split_version('mod_auth-ldap-1.0')
+    ('mod_auth-ldap', '1.0')
+    >>> split_version('phpmyadmin')
+    ('phpmyadmin', None)
+    '''
+    i = name.find('-')
+
+    while i > 0:
+        if VERSION.match(name[i + 1:]):
+            return name[:i], name[i + 1:]
+        i = name.find('-', i + 1)
+
+    return name, None
+
+def vercmp(a, b):
+    '''
+    Compares two package versions following the rules of the package
+    manager specification. Returns a negative number, zero or a positive
+    number just like the cmp() function of python 2.
+
+    >>> vercmp('1.3', '2.4.58') < 0
+    True
+    >>> vercmp('1.0_rc1', '1.0') < 0 < vercmp('1.0_p1', '1.0')
+    True
+    >>> vercmp('1.01', '1.1') < 0
+    True
+    >>> vercmp('1.0-r0', '1.0')
+    0
+    '''
+
+    def cmp(x, y):
+        return (x > y) - (x < y)
+
+    (ma, mb) = (VERSION.match(a), VERSION.match(b))
+
+    result = cmp(int(ma.group(1)), int(mb.group(1)))
+    if result:
+        return result
+
+    (ca, cb) = (ma.group(2).split('.')[1:], mb.group(2).split('.')[1:])
+
+    for (x, y) in zip(ca, cb):
+        if x.startswith('0') or y.startswith('0'):
+            result = cmp(x.rstrip('0'), y.rstrip('0'))
+        else:
+            result = cmp(int(x), int(y))
+        if result:
+            return result
+
+    result = (cmp(len(ca), len(cb))
+              or cmp(ma.group(3), mb.group(3)))
+    if result:
+        return result
+
+    (sa, sb) = (SUFFIX.findall(ma.group(4)), SUFFIX.findall(mb.group(4)))
+
+    for k in range(max(len(sa), len(sb))):
+        (x, y) = (sa[k] if k < len(sa) else ('', ''),
+                  sb[k] if k < len(sb) else ('', ''))
+        result = (cmp(SUFFIXES.get(x[0], 4), SUFFIXES.get(y[0], 4))
+                  or cmp(int(x[1] or 0), int(y[1] or 0)))
+        if result:
+            return result
+
+    return cmp(int(ma.group(5) or 0), int(mb.group(5) or 0))
+
+def mtime(path, entries = False):
+    '''
+    Returns the modification time of path or None if it does not
+    exist. With entries set the newest entry of a directory counts as
+    well.
+    '''
+    try:
+        stamp = os.lstat(path).st_mtime
+    except OSError:
+        return None
+
+    if entries and os.path.isdir(path):
+        for i in os.listdir(path):
+            stamp = max(stamp, mtime(os.path.join(path, i)) or 0)
+
+    return stamp
+
+def store_json(path, data, what = 'cache'):
+    '''
+    Atomically replaces the file path with data written as JSON. The
+    directory is created if necessary. Failures are not fatal, the
+    caches simply stay empty.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> store_json(directory + '/a/b.json', {'a' : 1})
+    >>> os.listdir(directory + '/a')
+    ['b.json']
+    >>> store_json('/proc/nonexistent/b.json', {})
+    >>> shutil.rmtree(directory)
+    '''
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        (fd, tmp) = tempfile.mkstemp(prefix = os.path.basename(path) + '.',
+                                     dir = os.path.dirname(path))
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+    except (IOError, OSError) as e:
+        OUT.debug('Unable to store the ' + what + ' (' + str(e) + ')', 7)
+
+# ========================================================================
+# Installed package database
+# ------------------------------------------------------------------------
+
+class VDB:
+    '''
+    Reads the database of installed packages (/var/db/pkg) directly.
+    It understands atoms without slots, USE dependencies or blockers
+    which are all webapp-config needs to ask for.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def listdir(self, path):
+        try:
+            return sorted(os.listdir(path))
+        except OSError:
+            return []
+
+    def packages(self, cat = '', pn = ''):
+        ''' Yields (category, package name, version) of all packages.'''
+
+        for i in ([cat] if cat else self.listdir(self.root)):
+            for j in self.listdir(os.path.join(self.root, i)):
+
+                # Skip packages in the middle of being merged
+                if j.startswith('-') or j.startswith('.'):
+                    continue
+
+                (name, version) = split_version(j)
+
+                if version and (not pn or name == pn):
+                    yield (i, name, version)
+
+    def match(self, atom):
+        '''
+        Returns the installed versions ("cat/pn-pvr") matching atom or
+        None if the atom is too complex to be handled here.
+        '''
+
+        m = ATOM.match(atom)
+
+        if not m or (m.group(4) and m.group(1) != '='):
+            return None
+
+        (op, cat, pn, glob) = m.groups()
+        cat     = cat or ''
+        version = None
+
+        if op:
+            (pn, version) = split_version(pn)
+            if not version:
+                return None
+
+        result = []
+
+        for (i, name, pvr) in self.packages(cat, pn):
+
+            if not op:
+                found = True
+            elif glob:
+                found = pvr.startswith(version)
+            elif op == '~':
+                found = (vercmp(pvr.split('-r')[0],
+                                version.split('-r')[0]) == 0)
+            else:
+                c = vercmp(pvr, version)
+                found = {'=' : c == 0, '>' : c > 0, '<' : c < 0,
+                         '>=': c >= 0, '<=': c <= 0}[op]
+
+            if found:
+                result.append(i + '/' + name + '-' + pvr)
+
+        return result
+
+# ========================================================================
+# Package manager backends
+# ------------------------------------------------------------------------
+
+class PackageManager(abc.ABC):
+    '''
+    Base class of the package manager backends. A backend implements
+    root(), config_protect() and installed().
+
+    Every answer is kept for the lifetime of the process and stored in
+    a cache file so that later runs do not need to ask the package
+    manager again. The cache is dropped as soon as one of the files
+    listed in the stamp changes or the environment is different. The
+    answers about installed packages are dropped as well whenever the
+    database of installed packages changes.
+    '''
+
+    name    = ''
+
+    # Configuration files and directories of the package manager
+    configs = []
+
+    def __init__(self, cache = CACHE_DIR, vdb = None):
+
+        self.cache = cache
+
+        # Derived from the root of the package manager if not given
+        self.__vdb       = VDB(vdb) if vdb else None
+
+        self.__answers   = None
+        self.__stamp     = None
+        self.__installed = None
+        self.__vdb_stamp = None
+        self.__lock      = threading.Lock()
+
+    @property
+    def vdb(self):
+        ''' The database of installed packages below the root.'''
+        if self.__vdb is None:
+            self.__vdb = VDB(os.path.join(self.root(), EPREFIX.lstrip('/'),
+                                          'var/db/pkg'))
+        return self.__vdb
+
+    def cachefile(self):
+        ''' Returns the path to the cache file.'''
+        if self.cache:
+            return os.path.join(self.cache, self.name + '.json')
+
+    def stamp(self):
+        ''' Describes the state the cached settings depend on.'''
+        return ([[i, mtime(i, True)] for i in self.configs]
+                + [[i, os.environ.get(i)] for i in ENVIRONMENT])
+
+    def vdb_stamp(self):
+        ''' Describes the state the cached installed packages depend on.'''
+        return [self.vdb.root, mtime(self.vdb.root)]
+
+    def load(self):
+        ''' Returns the contents of the cache file.'''
+        try:
+            with open(self.cachefile()) as f:
+                cache = json.load(f)
+            if isinstance(cache, dict):
+                return cache
+        except (IOError, OSError, ValueError, TypeError):
+            pass
+        return {}
+
+    def store(self):
+        ''' Writes the answers to disk. Failures are not fatal.'''
+        store_json(self.cachefile(), {'stamp'     : self.__stamp,
+                                      'answers'   : self.__answers,
+                                      'vdb'       : self.__vdb_stamp,
+                                      'installed' : self.__installed},
+                   'package manager cache')
+
+    def cached(self, key, query, installed = False):
+        '''
+        Returns the answer stored under key. The query is only run if
+        the answer is not known yet. Answers about installed packages
+        additionally depend on the database of installed packages.
+        '''
+
+        stamp = self.stamp()
+
+        # Needs the root which is cached itself
+        vdb_stamp = self.vdb_stamp() if installed else None
+
+        with self.__lock:
+
+            if self.__stamp != stamp:
+                cache = self.load() if self.cachefile() else {}
+                valid = cache.get('stamp') == stamp
+                self.__stamp     = stamp
+                self.__answers   = valid and cache.get('answers') or {}
+                self.__vdb_stamp = valid and cache.get('vdb') or None
+                self.__installed = valid and cache.get('installed') or {}
+
+            if installed and self.__vdb_stamp != vdb_stamp:
+                self.__vdb_stamp = vdb_stamp
+                self.__installed = {}
+
+            answers = self.__installed if installed else self.__answers
+
+            if key in answers:
+                return answers[key]
+
+            OUT.debug('Asking ' + self.name + ' for ' + key, 7)
+
+            answer = query()
+            answers[key] = answer
+
+            if self.cachefile():
+                self.store()
+
+            return answer
+
+    @abc.abstractmethod
+    def root(self, cat = '', pn = ''):
+        ''' Returns the $ROOT variable.'''
+
+    @abc.abstractmethod
+    def config_protect(self, cat = '', pn = ''):
+        ''' Returns the $CONFIG_PROTECT variable.'''
+
+    @abc.abstractmethod
+    def installed(self, atom):
+        ''' Returns the installed packages matching atom.'''
+
+class Portage(PackageManager):
+
+    name    = 'portage'
+
+    configs = [EPREFIX + '/etc/make.conf',
+               EPREFIX + '/etc/portage/make.conf',
+               EPREFIX + '/etc/portage/make.profile']
+
+    def portage(self):
+        try:
+            import portage
+        except ImportError as e:
+            OUT.die("Portage libraries not found, quitting:\n%s" % e)
+
+        return portage
+
+    def root(self, cat = '', pn = ''):
+        return self.cached('root',
+                           lambda: self.portage().settings['ROOT'])
+
+    def config_protect(self, cat = '', pn = ''):
+        return self.cached('config_protect',
+                           lambda: self.portage().settings['CONFIG_PROTECT'])
+
+    def installed(self, atom):
+        return self.cached('installed:' + atom, lambda: self.match(atom),
+                           installed = True)
+
+    def match(self, atom):
+        '''
+        The Portage part is stolen from gentoolkit. We are not using
+        gentoolkit directly as it doesn't seem to support ${ROOT}
+        '''
+
+        result = self.vdb.match(atom)
+
+        if result is not None:
+            return result
+
+        portage = self.portage()
+        vartree = portage.db[portage.root]["vartree"]
+
+        try:
+            return vartree.dbapi.match(atom)
+        # catch the "ambiguous package" Exception
+        except ValueError as e:
+            if e.args and isinstance(e.args[0], list):
+                t = []
+                for cp in e.args[0]:
+                    t += vartree.dbapi.match(cp)
+                return t
+            raise
+
+class Paludis(PackageManager):
+
+    name    = 'paludis'
+
+    configs = [EPREFIX + '/etc/paludis']
+
+    def cave(self, *args):
+        ''' Runs cave and returns its output and error lines.'''
+        try:
+            process = subprocess.Popen(('cave',) + args,
+                                       stdout = subprocess.PIPE,
+                                       stderr = subprocess.PIPE,
+                                       universal_newlines = True)
+            (output, error) = process.communicate()
+        except OSError as e:
+            OUT.die('Unable to run cave, quitting:\n%s' % e)
+
+        return output.splitlines(True), error.splitlines(True)
+
+    def variable(self, name, cat, pn):
+        (output, error) = self.cave('print-id-environment-variable', '-b',
+                                    '--format', '%v\n',
+                                    '--variable-name', name,
+                                    cat + '/' + pn)
+        return output
+
+    def root(self, cat = '', pn = ''):
+        if not cat or not pn:
+            return '/'
+
+        def query():
+            output = self.variable('ROOT', cat, pn)
+            if output and output[0].strip():
+                return output[0].strip()
+            return '/'
+
+        return self.cached('root:' + cat + '/' + pn, query)
+
+    def config_protect(self, cat = '', pn = ''):
+        return self.cached('config_protect:' + cat + '/' + pn,
+                           lambda: ' '.join(
+                               self.variable('CONFIG_PROTECT',
+                                             cat, pn)).strip())
+
+    def installed(self, atom):
+
+        def query():
+            (output, error) = self.cave('print-best-version', atom)
+            for i in error:
+                OUT.warn(i)
+            return ' '.join(output)
+
+        return self.cached('installed:' + atom, query, installed = True)
+
+# ------------------------------------------------------------------------
+# Backends shared by all callers of this process
+# ------------------------------------------------------------------------
+
+BACKENDS  = {'portage' : Portage,
+             'paludis' : Paludis}
+
+INSTANCES = {}
+
+def backend(pm):
+    ''' Returns the backend for the named package manager.'''
+
+    if not pm in INSTANCES:
+        if not pm in BACKENDS:
+            OUT.die("Unknown package manager: " + str(pm))
+        INSTANCES[pm] = BACKENDS[pm]()
+
+    return INSTANCES[pm]
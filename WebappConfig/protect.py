@@ -44,6 +44,14 @@ class Protection:
         self.protect_prefix = WebappConfig.wrapper.protect_prefix
         self.update_command = WebappConfig.wrapper.update_command
 
+        # Next free protection number for each directory we have already
+        # scanned during this run
+        self.__numbers = {}
+
+        # Compiled form of config_protect (see protected_tree())
+        self.__tree        = {}
+        self.__tree_source = None
+
     # ------------------------------------------------------------------------
     # Outputs:
     #   $my_return = the new mangled name (that you can use instead of
@@ -70,28 +78,67 @@ class Protection:
         my_filedir = destination + '/' + os.path.dirname(filename)
 
         # find the highest numbered protected file that already
-        # exists, and increment it by one
+        # exists, and increment it by one. Each directory is only
+        # scanned once, afterwards the numbers are handed out from
+        # memory.
+
+        key = re.compile('/+').sub('/', my_filedir)
 
-        entries = os.listdir(my_filedir)
+        if not key in self.__numbers:
+            self.__numbers[key] = self.scan_protected(my_filedir)
+
+        max_n = self.__numbers[key]
+        self.__numbers[key] = max_n + 1
+
+        return  my_filedir + '/%s%.4d_%s' % (self.protect_prefix, max_n, my_file)
+
+    def scan_protected(self, directory):
+        '''
+        Returns the number following the highest numbered protected file
+        in the given directory.
+        '''
 
         OUT.debug('Identifying possible file number', 7)
 
-        numbers = []
-        prefix  = self.protect_prefix
-        rep = re.compile(prefix.replace('.','\.') + '(\d{4})_')
+        rep = re.compile(re.escape(self.protect_prefix) + r'(\d{4})_')
+
+        max_n = -1
 
-        for i in entries:
+        for i in os.listdir(directory):
             rem = rep.match(i)
             if rem:
-                numbers.append(int(rem.group(1)))
+                max_n = max(max_n, int(rem.group(1)))
+
+        return max_n + 1
+
 
-        if numbers:
-            max_n = max(numbers) + 1
-        else:
-            max_n = 0
+    def protected_tree(self):
+        '''
+        Returns the config protected directories as a path trie. Each
+        node maps a path component to its children, protected directories
+        are marked with a None key. The trie is only rebuilt if
+        config_protect changed since the last call.
+        '''
+
+        if self.__tree_source != self.config_protect:
+
+            OUT.debug('Compiling config protected directories', 7)
+
+            tree = {}
+
+            for i in self.config_protect.split():
+                parts = [j for j in i.split('/') if j]
+                if i[0] != '/' or not parts:
+                    continue
+                node = tree
+                for j in parts:
+                    node = node.setdefault(j, {})
+                node[None] = True
 
-        return  my_filedir + '/%s%.4d_%s' % (prefix, max_n, my_file)
+            self.__tree        = tree
+            self.__tree_source = self.config_protect
 
+        return self.__tree
 
     def dirisconfigprotected(self, installdir):
         '''
@@ -100,32 +147,19 @@ class Protection:
         of config protected files.
         '''
 
-        my_master = []
-        for i in self.config_protect.split(' '):
-            if i[0] == '/':
-                if i[-1] == '/':
-                    my_master.append(i[:-1])
-                else:
-                    my_master.append(i)
-
         if installdir[0] != '/':
             OUT.die('BUG! Don\'t call this with a relative path.')
 
-        if installdir[-1] == '/':
-            my_dir = installdir[:-1]
-        else:
-            my_dir = installdir
-
-        while my_dir:
-
-            if my_dir == '.' or my_dir == '/':
-                return False
+        node = self.protected_tree()
 
-            for x in my_master:
-                if my_dir == x:
-                    return True
-
-            my_dir = os.path.dirname(my_dir)
+        for i in installdir.split('/'):
+            if not i:
+                continue
+            if not i in node:
+                break
+            node = node[i]
+            if None in node:
+                return True
 
         # nope, the directory isn't config-protected at this time
         return False
@@ -136,18 +170,19 @@ class Protection:
         '''
         my_command = self.update_command
 
+        # Sorting by path components places every directory right in
+        # front of its subdirectories so that a single pass drops all
+        # directories already covered by a parent.
+
         directories = []
 
-        for i in dirs:
-            present = False
-            if directories:
-                for j in directories:
-                    if (i == j[:len(i)] or 
-                        j == i[:len(j)]):
-                        present = True
-                        break
-            if not present:
-                directories.append(i)
+        for i in sorted(set([re.compile('/+').sub('/', j).rstrip('/') or '/'
+                             for j in dirs]),
+                        key = lambda j: j.split('/')):
+            if (directories
+                    and i.startswith(directories[-1].rstrip('/') + '/')):
+                continue
+            directories.append(i)
 
         my_command_list = ''
 
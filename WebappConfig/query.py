@@ -0,0 +1,98 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Cache of the --query results used by webapp.eclass.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import hashlib, json, os, os.path
+
+from WebappConfig.debug       import OUT
+from WebappConfig.pkgmgr      import CACHE_DIR, store_json
+
+# ========================================================================
+# Query cache
+# ------------------------------------------------------------------------
+
+class QueryCache:
+    '''
+    Stores the variables reported by --query on disk. The results are
+    stored under a key built from everything they depend on: the
+    configuration file, the settings of the package manager, the
+    configuration values and the package itself. A changed setting
+    simply leads to a different key. Only the most recently stored
+    results are kept.
+
+    >>> cache = QueryCache(cache = None)
+    >>> key = cache.key({'pn' : 'phpmyadmin', 'pvr' : '5.2.1'})
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, [['PN', 'phpmyadmin']])
+    >>> cache.get(key)
+    [['PN', 'phpmyadmin']]
+    '''
+
+    def __init__(self, cache = CACHE_DIR, size = 256):
+
+        self.cache = cache
+        self.size  = size
+
+        self.__results = None
+
+    def cachefile(self):
+        ''' Returns the path to the cache file.'''
+        if self.cache:
+            return os.path.join(self.cache, 'query.json')
+
+    def key(self, state):
+        ''' Returns the key for the given state.'''
+        return hashlib.sha1(json.dumps(state, sort_keys = True)
+                            .encode('utf-8')).hexdigest()
+
+    def results(self):
+        ''' Returns the stored results as a list of [key, records].'''
+
+        if self.__results is None:
+            self.__results = []
+            if self.cachefile():
+                try:
+                    with open(self.cachefile()) as f:
+                        self.__results = [[key, records] for (key, records)
+                                          in json.load(f)]
+                except (IOError, OSError, ValueError, TypeError):
+                    pass
+
+        return self.__results
+
+    def get(self, key):
+        ''' Returns the records stored under key or None.'''
+        for (i, records) in self.results():
+            if i == key:
+                OUT.debug('Using the cached query result', 7)
+                return records
+        return None
+
+    def put(self, key, records):
+        ''' Stores the records under key. Failures are not fatal.'''
+
+        results = [[key, records]] + [i for i in self.results()
+                                      if i[0] != key]
+        self.__results = results[:self.size]
+
+        if self.cachefile():
+            store_json(self.cachefile(), self.__results, 'query cache')
@@ -0,0 +1,203 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Registry of the supported web server backends.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import importlib, os, os.path
+
+from WebappConfig.debug       import OUT
+
+# ========================================================================
+# Known backends
+# ------------------------------------------------------------------------
+
+# Servers shipped with webapp-config. They are only imported once one
+# of them is actually selected.
+BUILTIN = [('apache',   'WebappConfig.server:Apache'),
+           ('lighttpd', 'WebappConfig.server:Lighttpd'),
+           ('cherokee', 'WebappConfig.server:Cherokee'),
+           ('nginx',    'WebappConfig.server:Nginx'),
+           ('gatling',  'WebappConfig.server:Gatling'),
+           ('tracd',    'WebappConfig.server:Tracd'),
+           ('uwsgi',    'WebappConfig.server:uWSGI'),]
+
+# Installed python packages may register servers in this entry point
+# group, e.g. "phpfpm = mypackage.server:PhpFpm".
+ENTRY_POINTS = 'webapp_config.servers'
+
+# ========================================================================
+# Helper functions
+# ------------------------------------------------------------------------
+
+def entry_points(group):
+    ''' Returns the entry points registered in the given group.'''
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        return []
+
+    points = metadata.entry_points()
+
+    if hasattr(points, 'select'):
+        return list(points.select(group = group))
+
+    return list(points.get(group, []))
+
+def load_spec(spec):
+    '''
+    Imports the object described by a "module:attribute" string.
+
+    >>> load_spec('os.path:join') is os.path.join
+    True
+    '''
+    (module, attribute) = spec.split(':', 1)
+
+    return getattr(importlib.import_module(module), attribute)
+
+def load_dropin(name, path):
+    ''' Imports the "Server" class from a drop-in file.'''
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(
+        'WebappConfig.dropin.' + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module.Server
+
+# ========================================================================
+# Server registry
+# ------------------------------------------------------------------------
+
+class ServerRegistry:
+    '''
+    Maps server names to backend classes. The available names are
+    collected from the builtin table, the entry point group and the
+    drop-in directory (in increasing order of precedence) without
+    importing any backend. A backend is only imported when load() is
+    called for it.
+
+    A file <server>.py in the drop-in directory registers the server
+    <server>. The file needs to define the backend class under the name
+    "Server".
+
+    >>> registry = ServerRegistry(dropins = '/nonexistent')
+    >>> registry.names()[:3]
+    ['apache', 'lighttpd', 'cherokee']
+    >>> registry.load('nginx').name
+    'Nginx'
+    >>> registry.load('unknown') is None
+    True
+    '''
+
+    def __init__(self, dropins = None):
+
+        self.dropins = dropins
+
+        self.__sources = None
+        self.__classes = {}
+
+    def sources(self):
+        ''' Returns the (name, (kind, source)) pairs of all servers.'''
+
+        if self.__sources is None:
+
+            OUT.debug('Collecting server backends', 7)
+
+            sources = [(name, ('builtin', spec)) for (name, spec) in BUILTIN]
+
+            for i in entry_points(ENTRY_POINTS):
+                sources.append((i.name, ('entry point', i)))
+
+            if self.dropins and os.path.isdir(self.dropins):
+                for i in sorted(os.listdir(self.dropins)):
+                    if i.endswith('.py') and not i.startswith('.'):
+                        sources.append((i[:-3], ('drop-in',
+                                         os.path.join(self.dropins, i))))
+
+            # Later definitions replace earlier ones but keep the order
+            # of first appearance
+            names = {}
+            for (name, source) in sources:
+                if not name in names:
+                    names[name] = len(names)
+            self.__sources = sorted(dict(sources).items(),
+                                    key = lambda i: names[i[0]])
+
+        return self.__sources
+
+    def names(self):
+        ''' Returns the names of all known servers.'''
+        return [name for (name, source) in self.sources()]
+
+    def load(self, name):
+        '''
+        Returns the backend class for the given server or None if the
+        server is unknown.
+        '''
+
+        if name in self.__classes:
+            return self.__classes[name]
+
+        source = dict(self.sources()).get(name)
+
+        if not source:
+            return None
+
+        OUT.debug('Loading server backend', 7)
+
+        (kind, origin) = source
+
+        try:
+            if kind == 'builtin':
+                server = load_spec(origin)
+            elif kind == 'entry point':
+                server = origin.load()
+            else:
+                server = load_dropin(name, origin)
+        except Exception as e:
+            OUT.die('Unable to load the "' + name + '" web server ('
+                    + kind + ').\nError was: ' + str(e))
+
+        from WebappConfig.server import Basic
+
+        if not isinstance(server, type) or not issubclass(server, Basic):
+            OUT.die('The "' + name + '" web server (' + kind + ') does'
+                    ' not provide a server class.')
+
+        self.__classes[name] = server
+
+        return server
+
+    def listservers(self):
+        ''' Lists the known servers.'''
+
+        if OUT.structured():
+            for (name, (kind, origin)) in self.sources():
+                server = self.load(name)
+                OUT.record({'server' : name,
+                            'name'   : server.name,
+                            'desc'   : server.desc,
+                            'dep'    : server.dep,
+                            'source' : kind})
+            OUT.end_records()
+            return
+
+        OUT.notice('\n'.join(self.names()))
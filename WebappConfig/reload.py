@@ -0,0 +1,150 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Coalesced reloading of the web server.'''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import shlex, subprocess, threading
+
+from WebappConfig.debug     import OUT
+
+# ========================================================================
+# Reload queue
+# ------------------------------------------------------------------------
+
+class ReloadQueue:
+    '''
+    Collects the reload commands requested by the server backends and
+    runs each distinct command only once when the queue is flushed.
+
+    With a debounce time set the queue flushes itself once no further
+    request arrived for the given number of seconds. This is meant for
+    long-running processes that handle one request after the other.
+
+    If a handoff function is set, flushing passes each command to it
+    instead of running the command. The daemon uses this to reload the
+    web server once for the changes of several requests.
+
+    >>> queue = ReloadQueue()
+    >>> queue.request('nginx -s reload', pretend = True)
+    >>> queue.request('nginx -s reload', pretend = True)
+    >>> queue.pending()
+    ['nginx -s reload']
+    '''
+
+    def __init__(self, debounce = 0):
+
+        self.debounce = debounce
+        self.handoff  = None
+
+        self.__pending = {}
+        self.__lock    = threading.Lock()
+        self.__timer   = None
+
+    def pending(self):
+        ''' Returns the commands waiting to be run.'''
+        with self.__lock:
+            return list(self.__pending.keys())
+
+    def request(self, command, pretend = False):
+        '''
+        Queues a reload command. In pretend mode the command will only
+        be reported.
+        '''
+
+        if not command:
+            return
+
+        OUT.debug('Queueing web server reload', 7)
+
+        with self.__lock:
+            self.__pending[command] = (pretend
+                                       and self.__pending.get(command, True))
+
+            if self.debounce > 0:
+                if self.__timer:
+                    self.__timer.cancel()
+                self.__timer = threading.Timer(self.debounce, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def take(self):
+        '''
+        Removes all queued commands from the queue. Returns them as
+        pairs of the command and the pretend flag.
+        '''
+
+        with self.__lock:
+            if self.__timer:
+                self.__timer.cancel()
+                self.__timer = None
+            pending = list(self.__pending.items())
+            self.__pending = {}
+
+        return pending
+
+    def report(self, command, status):
+        '''
+        Reports the outcome of a reload command. Returns False if it
+        failed.
+        '''
+
+        if status:
+            OUT.warn('Reloading the web server failed ("' + command
+                     + '" returned ' + str(status) + ').\nPlease reload'
+                     ' the web server by hand.')
+            return False
+
+        return True
+
+    def flush(self):
+        '''
+        Runs all queued reload commands. Returns False if one of them
+        failed.
+        '''
+
+        success = True
+
+        for (command, pretend) in self.take():
+
+            if pretend:
+                OUT.info('    would have reloaded the web server ("'
+                         + command + '")')
+                continue
+
+            if self.handoff:
+                self.handoff(command)
+                continue
+
+            OUT.info('Reloading the web server ("' + command + '")')
+
+            try:
+                status = subprocess.call(shlex.split(command))
+            except OSError as e:
+                status = str(e)
+
+            success = self.report(command, status) and success
+
+        return success
+
+# ------------------------------------------------------------------------
+# Queue shared by all installs of this process
+# ------------------------------------------------------------------------
+
+RELOAD = ReloadQueue()
@@ -22,21 +22,146 @@ Sandbox operations
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os, os.path, sys
-
-# stolen from portage
-try:
-    import resource
-    max_fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
-except ImportError:
-    max_fd_limit = 256
-if os.path.isdir("/proc/%i/fd" % os.getpid()):
-    def get_open_fds():
-        return (int(fd) for fd in os.listdir("/proc/%i/fd" % os.getpid()) if fd.isdigit())
-else:
-    def get_open_fds():
-        return list(range(max_fd_limit))
+import os, os.path, re, signal, subprocess, sys, time
+
+# Flags of unshare(2) and mount(2)
+CLONE_NEWNS   = 0x00020000
+CLONE_NEWUSER = 0x10000000
+
+MS_RDONLY     = 1
+MS_REMOUNT    = 32
+MS_BIND       = 4096
+MS_REC        = 16384
+MS_PRIVATE    = 1 << 18
+
+# Mount flags that need to be kept when remounting, as reported by
+# statvfs(3) and as understood by mount(2). Some of the ST_* constants
+# only exist on Linux.
+MS_KEEP       = [(getattr(os, name, 0), flag) for (name, flag) in
+                 [('ST_NOSUID',     2),
+                  ('ST_NODEV',      4),
+                  ('ST_NOEXEC',     8),
+                  ('ST_NOATIME',    1024),
+                  ('ST_NODIRATIME', 2048),
+                  ('ST_RELATIME',   1 << 21)]]
+
+# Kernel filesystems that are not made read-only
+PSEUDO        = ['/proc', '/sys', '/dev']
 
+# ========================================================================
+# Namespace sandbox
+# ------------------------------------------------------------------------
+
+def describe_status(status):
+    '''
+    Describes a status returned by Sandbox.spawn().
+
+    >>> describe_status(1)
+    'exit status 1'
+    >>> describe_status(9 << 8)
+    'killed by signal 9'
+    '''
+    if status > 0xff:
+        return 'killed by signal ' + str(status >> 8)
+    return 'exit status ' + str(status)
+
+def below(path, parents):
+    '''
+    Is path one of the parents or located below one of them?
+
+    >>> below('/var/www/localhost/htdocs', ['/tmp', '/var/www/localhost'])
+    True
+    >>> below('/var/www/localhost2', ['/var/www/localhost'])
+    False
+    '''
+    for i in parents:
+        if path == i or path.startswith(i.rstrip('/') + '/'):
+            return True
+    return False
+
+def unescape(path):
+    '''
+    Decodes the octal escapes used for blanks and the like in
+    /proc/self/mountinfo.
+
+    >>> unescape('/mnt/my\\\\040disk')
+    '/mnt/my disk'
+    >>> unescape('/mnt/' + chr(0x4e2d) + '\\\\011x') == '/mnt/\\u4e2d\\tx'
+    True
+    '''
+    return re.sub(r'\\[0-7]{3}', lambda m: chr(int(m.group(0)[1:], 8)),
+                  path)
+
+def mountpoints():
+    ''' Returns the mount points of the current mount namespace.'''
+    result = []
+    with open('/proc/self/mountinfo') as f:
+        for i in f:
+            result.append(unescape(i.split()[4]))
+    return result
+
+def confine(write):
+    '''
+    Moves the current process into a mount namespace of its own in
+    which everything except the paths in write is read-only. An
+    unprivileged user namespace is created first unless running as
+    root. Raises OSError if the namespace cannot be set up.
+    '''
+
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno = True)
+
+    def check(result, what):
+        if result != 0:
+            e = ctypes.get_errno()
+            raise OSError(e, what + ': ' + os.strerror(e))
+
+    def mount(source, target, flags):
+        return libc.mount(source and source.encode(), target.encode(),
+                          None, ctypes.c_ulong(flags), None)
+
+    (uid, gid) = (os.geteuid(), os.getegid())
+
+    if uid:
+        check(libc.unshare(CLONE_NEWNS | CLONE_NEWUSER), 'unshare')
+
+        # Keep the identity of the user within the namespace
+        for (name, value) in [('setgroups', 'deny'),
+                              ('uid_map', '%d %d 1' % (uid, uid)),
+                              ('gid_map', '%d %d 1' % (gid, gid))]:
+            with open('/proc/self/' + name, 'w') as f:
+                f.write(value)
+    else:
+        check(libc.unshare(CLONE_NEWNS), 'unshare')
+
+    # Nothing done in here may leak to the outside
+    check(mount(None, '/', MS_REC | MS_PRIVATE), 'mount /')
+
+    write = [os.path.realpath(i) for i in write
+             if os.path.isabs(i) and not below(i, PSEUDO)
+             and os.path.exists(i)]
+
+    # Writable paths become mount points of their own so that they are
+    # not affected by making their parent read-only
+    for i in write:
+        check(mount(i, i, MS_BIND | MS_REC), 'bind ' + i)
+
+    for i in reversed(mountpoints()):
+
+        if below(i, PSEUDO) or below(i, write):
+            continue
+
+        flags = MS_REMOUNT | MS_BIND | MS_RDONLY
+        for (st, ms) in MS_KEEP:
+            if os.statvfs(i).f_flag & st:
+                flags |= ms
+
+        check(mount(None, i, flags), 'read-only ' + i)
+
+# ========================================================================
+# Sandbox handler
+# ------------------------------------------------------------------------
 
 class Sandbox:
     '''
@@ -54,8 +179,16 @@ class Sandbox:
 
         self.sandbox_binary = '/usr/bin/sandbox'
 
+        # Runs commands in a namespace if there is no sandbox binary
+        self.namespace_runner = [sys.executable, '-I',
+                                 os.path.abspath(__file__)]
+
         self.env      = {'SANDBOX_WRITE' : self.get_write() }
 
+        # Details about the last command spawned
+        self.cputime  = 0.0
+        self.timedout = False
+
     def get_write(self):
         '''Return write paths.'''
         return ':'.join ( map ( self.get_config, self.__write ) ) \
@@ -65,26 +198,27 @@ class Sandbox:
         ''' Return a config option.'''
         return self.config.config.get('USER', option)
 
-    # stolen from portage
-    def spawn(self, mycommand, full_env):
+    def spawn(self, mycommand, full_env, timeout = 0, logfile = None):
         """
         Spawns a given command.
 
         @param mycommand: the command to execute
-        @type mycommand: String or List (Popen style list)
+        @type mycommand: String
         @param full_env: A dict of Key=Value pairs for env variables
         @type full_env: Dictionary
+        @param timeout: Seconds after which the command is killed, 0 to
+        wait forever
+        @type timeout: Number
+        @param logfile: File the output of the command is appended to
+        @type logfile: String
+        @rtype: Integer
+        @returns: The exit code or the signal shifted by 8 bits
         """
 
-        # Default to propagating our stdin, stdout and stderr.
-        fd_pipes = {0:0, 1:1, 2:2}
-
-        # mypids will hold the pids of all processes created.
-        mypids = []
+        command = [self.sandbox_binary, mycommand]
 
-        command = []
-        command.append(self.sandbox_binary)
-        command.append(mycommand)
+        if not os.access(self.sandbox_binary, os.X_OK):
+            command = self.namespace_runner + [mycommand]
 
         # merge full_env (w-c variables) with env (write path)
         self.env.update(full_env)
@@ -92,85 +226,96 @@ class Sandbox:
             if not self.env[a]:
                 self.env[a] = ''
 
-        pid = os.fork()
+        self.cputime  = 0.0
+        self.timedout = False
 
-        if not pid:
+        # Default to propagating our stdin, stdout and stderr.
+        log = None
+        if logfile:
+            log = os.open(logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o600)
+            os.write(log, ('=== ' + time.strftime('%Y-%m-%d %H:%M:%S')
+                           + ' ' + mycommand + '\n').encode('utf-8'))
+
+        # Only the standard descriptors are passed on. subprocess
+        # closes all others in a single call no matter how high the
+        # descriptor limit is. A new session allows killing the command
+        # together with its children once it timed out.
+        try:
             try:
-                self._exec(command, self.env, fd_pipes)
-            except Exception as e:
-                # We need to catch _any_ exception so that it doesn't
-                # propagate out of this function and cause exiting
-                # with anything other than os._exit()
-                sys.stderr.write("%s:\n   %s\n" % (e, " ".join(command)))
-                sys.stderr.flush()
-                os._exit(1)
-
-        # Add the pid to our list
-        mypids.append(pid)
-
-        # Clean up processes
-        while mypids:
-
-            # Pull the last reader in the pipe chain. If all processes
-            # in the pipe are well behaved, it will die when the process
-            # it is reading from dies.
-            pid = mypids.pop(0)
-
-            # and wait for it.
-            retval = os.waitpid(pid, 0)[1]
-
-            if retval:
-                # If it failed, kill off anything else that
-                # isn't dead yet.
-                for pid in mypids:
-                    if os.waitpid(pid, os.WNOHANG) == (0,0):
-                        os.kill(pid, signal.SIGTERM)
-                        os.waitpid(pid, 0)
-
-                # If it got a signal, return the signal that was sent.
-                if (retval & 0xff):
-                    return ((retval & 0xff) << 8)
-
-                # Otherwise, return its exit code.
-                return (retval >> 8)
-
-        # Everything succeeded
-        return 0
-
-    # stolen from portage
-    def _exec(self, binary, env, fd_pipes):
-
-        """
-        Execute a given binary with options in a sandbox
-
-        @param binary: Name of program to execute
-        @type binary: String
-        @param env: Key,Value mapping for Environmental Variables
-        @type env: Dictionary
-        @param fd_pipes: Mapping pipes to destination; { 0:0, 1:1, 2:2 }
-        @type fd_pipes: Dictionary
-        @rtype: None
-        @returns: Never returns (calls os.execve)
-        """
-
-        # Set up the command's pipes.
-        my_fds = {}
-        # To protect from cases where direct assignment could
-        # clobber needed fds ({1:2, 2:1}) we first dupe the fds
-        # into unused fds.
-        for fd in fd_pipes:
-            my_fds[fd] = os.dup(fd_pipes[fd])
-        # Then assign them to what they should be.
-        for fd in my_fds:
-            os.dup2(my_fds[fd], fd)
-        # Then close _all_ fds that haven't been explictly
-        # requested to be kept open.
-        for fd in get_open_fds():
-            if fd not in my_fds:
+                process = subprocess.Popen(command,
+                                           env = self.env,
+                                           stdout = log,
+                                           stderr = log,
+                                           close_fds = True,
+                                           start_new_session = bool(timeout))
+            except (OSError, ValueError) as e:
+                message = "%s:\n   %s\n" % (e, " ".join(command))
+                if log is not None:
+                    os.write(log, message.encode('utf-8'))
+                else:
+                    sys.stderr.write(message)
+                    sys.stderr.flush()
+                return 1
+        finally:
+            if log is not None:
+                os.close(log)
+
+        retval = self.wait(process.pid, timeout)
+
+        # The process has been reaped already
+        process.returncode = retval
+
+        # If it got a signal, return the signal that was sent.
+        if (retval & 0xff):
+            return ((retval & 0xff) << 8)
+
+        # Otherwise, return its exit code.
+        return (retval >> 8)
+
+    def wait(self, pid, timeout = 0):
+        '''
+        Waits for the process to finish and returns its status. The
+        process group is terminated if it did not finish in time and
+        killed if it does not react within a few seconds.
+        '''
+
+        deadline = timeout and time.time() + timeout
+        delay    = 0.01
+
+        while True:
+            (done, status, usage) = os.wait4(pid,
+                                             deadline and os.WNOHANG or 0)
+
+            if done:
+                self.cputime = usage.ru_utime + usage.ru_stime
+                return status
+
+            if time.time() >= deadline:
                 try:
-                    os.close(fd)
+                    if not self.timedout:
+                        self.timedout = True
+                        os.killpg(pid, signal.SIGTERM)
+                        deadline = time.time() + 5
+                    else:
+                        os.killpg(pid, signal.SIGKILL)
+                        deadline = 0
                 except OSError:
                     pass
+                continue
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+if __name__ == '__main__':
+
+    # Namespace sandbox: confine the SANDBOX_WRITE paths and run the
+    # command just like the sandbox binary does
+    try:
+        confine(os.environ.get('SANDBOX_WRITE', '').split(':'))
+    except OSError as e:
+        sys.stderr.write('Unable to set up the write sandbox (%s):\n   %s\n'
+                         % (e, sys.argv[1]))
+        sys.exit(1)
 
-        # And switch to the new process.
-        os.execve(binary[0], binary, env)
+    os.execv('/bin/sh', ['/bin/sh', '-c', sys.argv[1]])
@@ -25,6 +25,7 @@ from WebappConfig.debug        import OUT
 from WebappConfig.eprefix      import EPREFIX
 from WebappConfig.worker       import WebappRemove, WebappAdd
 from WebappConfig.permissions  import get_group, get_user
+from WebappConfig.reload       import RELOAD
 
 from WebappConfig.wrapper      import package_installed
 
@@ -37,6 +38,8 @@ class Basic:
     name   = 'Basic Server'
     desc   = 'supports installation on all webservers'
     dep    = ''
+    # Command that makes the server pick up changed installs
+    reload = ''
 
     def set_server_user(self):
         self.vhost_server_uid = get_user(0)
@@ -90,9 +93,11 @@ class Basic:
         self.__dotconfig = handler['dotconfig']
         self.__ebuild    = handler['ebuild']
         self.__db        = handler['db']
+        self.__journal   = handler.get('journal')
 
         self.__v         = flags['verbose']
         self.__p         = flags['pretend']
+        self.__reload    = flags.get('reload', '')
 
         wd = WebappRemove(self.__content,
                           self.__v,
@@ -118,6 +123,15 @@ class Basic:
 
         OUT.info('Removing old version ' + self.__dotconfig.packagename())
 
+        # The removal forgets the old entries. Keep them so that files
+        # left behind can still be compared with what was installed.
+        self.__handler['previous'] = self.__content.copy()
+
+        # Recorded in the dotconfig file for --merge-config
+        (cat, pn, pvr) = self.__content.get_package()
+        self.__flags['upgraded_from'] = '/'.join([i for i in (cat, pn)
+                                                  if i]) + '-' + pvr
+
         self.clean()
 
         # now install the new one
@@ -130,15 +144,31 @@ class Basic:
 
         self.install(True)
 
+    def journaled(self, action, work, upgraded_from = ''):
+        '''
+        Runs work() while the journal records the changes to the
+        contents. The journal is kept if work() fails.
+        '''
+        if not self.__journal:
+            return work()
+
+        self.__journal.begin(action, self.__content, upgraded_from)
+
+        try:
+            work()
+        except BaseException:
+            self.__journal.abort(action)
+            raise
+
+        self.__journal.commit()
+
     def clean(self):
 
         self.file_behind_flag = False
 
         OUT.debug('Basic server clean', 7)
 
-        self.file_behind_flag |= self.__del.remove_files()
-
-        self.file_behind_flag |= self.__del.remove_dirs()
+        self.journaled('clean', self.remove_contents)
 
         OUT.info('Any files or directories listed above must be removed b'
                  'y hand')
@@ -180,8 +210,21 @@ class Basic:
         if self.file_behind_flag:
             OUT.warn('Remove whatever is listed above by hand')
 
+        self.request_reload()
+
+
+    def remove_contents(self):
+
+        self.file_behind_flag |= self.__del.remove_files()
+
+        self.file_behind_flag |= self.__del.remove_dirs()
 
     def install(self, upgrade = False):
+        self.journaled('install', lambda: self.install_files(upgrade),
+                       self.__flags.get('upgraded_from', '')
+                       if upgrade else '')
+
+    def install_files(self, upgrade = False):
 
         self.config_protected_dirs = []
 
@@ -266,7 +309,9 @@ class Basic:
                                self.__flags['host'],
                                self.__flags['orig'],
                                str(self.__perm['file']['config-owned'][0])
-                               + ':' + str(self.__perm['file']['config-owned'][1]),)
+                               + ':' + str(self.__perm['file']['config-owned'][1]),
+                               self.__flags.get('upgraded_from', '')
+                               if upgrade else '')
 
         self.__db.add(self.__destd,
                       self.__perm['file']['config-owned'][0],
@@ -295,10 +340,20 @@ class Basic:
 
         self.__content.write()
 
+        self.request_reload()
+
         # and we're done
 
         OUT.info('Install completed - success', 1)
 
+    def request_reload(self):
+        '''
+        Asks for a reload of the web server. Requests are collected and
+        the server is reloaded only once after all installs are done.
+        '''
+        if self.__reload:
+            RELOAD.request(self.__reload, self.__p)
+
     def supported(self, pm):
         # I don't think we should be forcing to have a webserver installed -- rl03
         # Maybe, but the test should then be disabled somewhere else.
@@ -312,6 +367,7 @@ class Apache(Basic):
     name   = 'Apache'
     desc   = 'supports installation on Apache 1 & 2'
     dep    = '>=www-servers/apache-1.3'
+    reload = 'apache2ctl graceful'
 
     def set_server_user(self):
         self.vhost_server_uid = get_user('apache')
@@ -342,6 +398,7 @@ class Nginx(Basic):
     name   = 'Nginx'
     desc   = 'supports installation on Nginx'
     dep    = 'www-servers/nginx'
+    reload = 'nginx -s reload'
 
     def set_server_user(self):          
         self.vhost_server_uid = get_user('nginx')
@@ -376,13 +433,3 @@ class uWSGI(Basic):
     def set_server_user(self):
         self.vhost_server_uid = get_user('uwsgi')
         self.vhost_server_gid = get_group('uwsgi')
-
-def listservers():
-
-    OUT.notice('\n'.join(['apache',
-                          'lighttpd',
-                          'cherokee',
-                          'nginx',
-                          'gatling',
-                          'tracd',
-                          'uwsgi',]))
@@ -18,24 +18,49 @@ from __future__ import print_function
 
 '''Runs external (non-doctest) test cases.'''
 
+import asyncio
+import io
+import json
 import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 import sys
+import time
 
+from  WebappConfig.api       import CONTEXT, ConfigurationError, UsageError
+from  WebappConfig.batch     import Batch
 from  WebappConfig.config    import Config
 from  WebappConfig.content   import Contents
+from  WebappConfig.daemon    import Daemon
 from  WebappConfig.db        import WebappDB, WebappSource
 from  WebappConfig.debug     import OUT
 from  WebappConfig.dotconfig import DotConfig
 from  WebappConfig.ebuild    import Ebuild
 from  WebappConfig.filetype  import FileType
+from  WebappConfig.journal   import Journal
+from  WebappConfig.merge     import ConfigMerge
+from  WebappConfig.permissions import NSSCache
+from  WebappConfig.pkgmgr    import INSTANCES, PackageManager, Portage
 from  WebappConfig.protect   import Protection
+from  WebappConfig.query     import QueryCache
+from  WebappConfig.registry  import ServerRegistry
+from  WebappConfig.reload    import ReloadQueue
+from  WebappConfig.sandbox   import Sandbox
 from  WebappConfig.server    import Basic
 from  WebappConfig.worker    import WebappAdd, WebappRemove
 from  warnings               import filterwarnings, resetwarnings
 
 HERE = os.path.dirname(os.path.realpath(__file__))
 
+class StaticPackageManager:
+    ''' Package manager without CONFIG_PROTECT, for tests without portage.'''
+    def config_protect(self, cat = '', pn = ''):
+        return ''
+
+INSTANCES['static'] = StaticPackageManager()
+
 class ContentsTest(unittest.TestCase):
     def test_add_pretend(self):
         loc = '/'.join((HERE, 'testfiles', 'contents', 'app'))
@@ -139,6 +164,27 @@ class ContentsTest(unittest.TestCase):
                                                           '.webapp-test-1.0!'))
         self.assertEqual(output[0], expected)
 
+    def test_verify(self):
+        loc = tempfile.mkdtemp()
+        for i in ['test1', 'test2']:
+            with open(loc + '/' + i, 'w') as f:
+                f.write(i + '\n')
+
+        contents = Contents(loc, package = 'test', version = '1.0')
+        for i in ['/test1', '/test2']:
+            contents.add('file', 'config_owned', destination = loc, path = i,
+                         real_path = loc + i, relative = True)
+        self.assertEqual(contents.verify(), [])
+
+        with open(loc + '/test1', 'a') as f:
+            f.write('changed\n')
+        os.unlink(loc + '/test2')
+        self.assertEqual(contents.verify(), [(loc + '/test1', 'modified'),
+                                             (loc + '/test2', 'missing')])
+
+        os.unlink(loc + '/test1')
+        os.rmdir(loc)
+
 class WebappDBTest(unittest.TestCase):
     def test_list_installs(self):
         OUT.color_off()
@@ -155,6 +201,48 @@ class WebappDBTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
         self.assertEqual(output[5], '* Installs for horde-3.0.5')
 
+    def test_list_installs_structured(self):
+        db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')))
+
+        OUT.set_format('ndjson')
+        try:
+            db.listinstalls()
+        finally:
+            OUT.set_format('text')
+
+        output = sys.stdout.getvalue().strip('\n').split('\n')
+        self.assertEqual(len(output), 3)
+        self.assertEqual(json.loads(output[1]),
+                         {'package': 'horde-3.0.5',
+                          'installdir': '/var/www/localhost/htdocs/horde',
+                          'timestamp': 1124612110,
+                          'uid': 'root',
+                          'gid': 'root'})
+
+        # A JSON array is written incrementally as well:
+        OUT.set_format('json')
+        try:
+            db.listinstalls()
+        finally:
+            OUT.set_format('text')
+
+        output = sys.stdout.getvalue().split('\n', 3)[3]
+        self.assertEqual(len(json.loads(output)), 3)
+
+        # A fatal error terminates the records written so far
+        start = len(sys.stdout.getvalue())
+        (error_out, OUT.error_out) = (OUT.error_out, io.StringIO())
+        OUT.set_format('json')
+        try:
+            OUT.record({'package' : 'horde-3.0.5'})
+            self.assertRaises(SystemExit, OUT.die, 'Failed')
+        finally:
+            OUT.set_format('text')
+            OUT.error_out = error_out
+
+        self.assertEqual(json.loads(sys.stdout.getvalue()[start:]),
+                         [{'package' : 'horde-3.0.5'}])
+
     def test_list_locations(self):
         OUT.color_off()
         db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')))
@@ -176,6 +264,34 @@ class WebappDBTest(unittest.TestCase):
         sorted_db = [i[1] for i in db.list_locations().items()]
         self.assertEqual(sorted_db, [])
         
+    def test_find_installs(self):
+        OUT.color_off()
+        db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')),
+                      pretend = True)
+
+        found = db.lookup('/var/www/localhost/htdocs')
+        self.assertEqual([i[0:2] for i in found],
+                         [('gallery-1.4.4_p6',
+                           '/var/www/localhost/htdocs/gallery'),
+                          ('horde-3.0.5',
+                           '/var/www/localhost/htdocs/horde'),
+                          ('phpldapadmin-0.9.7_alpha4',
+                           '/var/www/localhost/htdocs/phpldapadmin')])
+
+        # The install location itself matches as well:
+        found = db.lookup('/var/www//localhost/htdocs/horde/')
+        self.assertEqual(found, [('horde-3.0.5',
+                                  '/var/www/localhost/htdocs/horde',
+                                  '1124612110', 'root', 'root')])
+
+        # But a mere string prefix does not:
+        self.assertEqual(db.lookup('/var/www/localhost/htdocs/hor'), [])
+
+        db.findinstalls('/var/www/localhost/htdocs/gallery')
+        output = sys.stdout.getvalue().split('\n')
+        self.assertEqual(output[0], 'gallery-1.4.4_p6 '
+                                    '/var/www/localhost/htdocs/gallery')
+
     def test_add_rm(self):
         OUT.color_off()
         db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')),
@@ -199,6 +315,71 @@ class WebappDBTest(unittest.TestCase):
                                      '/var/www/localhost/htdocs/horde')
 
 
+    def test_add_rm_index(self):
+        OUT.color_off()
+        root = tempfile.mkdtemp()
+        shutil.copytree('/'.join((HERE, 'testfiles', 'webapps', 'horde')),
+                        root + '/horde')
+        db = WebappDB(root = root, package = 'horde', version = '3.0.5')
+
+        self.assertEqual(len(db.lookup('/')), 1)
+        db.add('/var/www/localhost/htdocs/horde2', user = 'me', group = 'me')
+        self.assertEqual([i[1] for i in db.lookup('/var/www')],
+                         ['/var/www/localhost/htdocs/horde',
+                          '/var/www/localhost/htdocs/horde2'])
+
+        # Adding the same install again, e.g. when resuming, changes nothing
+        db.add('/var/www/localhost/htdocs/horde2', user = 'me', group = 'me')
+        self.assertEqual(len(db.lookup('/var/www')), 2)
+        self.assertEqual(len(db.read_db()['horde-3.0.5']), 2)
+
+        db.remove('/var/www/localhost/htdocs/horde')
+        self.assertEqual([i[1] for i in db.lookup('/var/www')],
+                         ['/var/www/localhost/htdocs/horde2'])
+
+        # No temporary index files are left behind
+        self.assertEqual(sorted(os.listdir(root)),
+                         ['.installdirs', '.lock', 'horde'])
+
+        shutil.rmtree(root)
+
+    def test_concurrent_remove(self):
+        OUT.color_off()
+        root = tempfile.mkdtemp()
+        shutil.copytree('/'.join((HERE, 'testfiles', 'webapps', 'horde')),
+                        root + '/horde')
+        db = WebappDB(root = root, package = 'horde', version = '3.0.5')
+        db.lookup('/')
+
+        # Several processes updating the same installs file must not lose
+        # each other's changes
+        children = []
+        for i in range(4):
+            pid = os.fork()
+            if not pid:
+                try:
+                    for j in range(10):
+                        db.add('/var/www/h%d/%d' % (i, j), 'me', 'me')
+                    for j in range(0, 10, 2):
+                        db.remove('/var/www/h%d/%d' % (i, j))
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for i in children:
+            os.waitpid(i, 0)
+
+        expected = sorted(['/var/www/localhost/htdocs/horde'] +
+                          ['/var/www/h%d/%d' % (i, j)
+                           for i in range(4) for j in range(1, 10, 2)])
+        self.assertEqual(sorted(i[3].strip()
+                                for i in db.read_db()['horde-3.0.5']),
+                         expected)
+        self.assertEqual(sorted(i[1] for i in db.lookup('/var/www')),
+                         expected)
+
+        shutil.rmtree(root)
+
+
 class WebappSourceTest(unittest.TestCase):
         SHARE = '/'.join((HERE, 'testfiles', 'share-webapps'))
         def test_list_unused(self):
@@ -250,6 +431,32 @@ class WebappSourceTest(unittest.TestCase):
             files = source.get_source_files('htdocs')
             self.assertEqual(files, ['test1', 'test2'])
 
+        def test_remembered(self):
+            root = tempfile.mkdtemp()
+            shutil.copytree(self.SHARE + '/horde', root + '/horde')
+            source = WebappSource(root = root, category = '',
+                                  package = 'horde', version = '3.0.5')
+
+            # Unchanged sources are only read once
+            self.assertIs(source.listing('htdocs/'),
+                          source.listing('htdocs'))
+            source.read()
+            types = source.filetype('test1')
+
+            # Changed ones are read again
+            time.sleep(0.01)
+            open(root + '/horde/3.0.5/htdocs/test3', 'w').close()
+            self.assertEqual(source.get_source_files('htdocs'),
+                             ['test1', 'test2', 'test3'])
+            with open(root + '/horde/3.0.5/config-files', 'w') as f:
+                f.write('test3\n')
+            source.read()
+            self.assertEqual(source.filetype('test1'), 'virtual')
+            self.assertEqual(source.filetype('test3'), 'config-owned')
+            self.assertEqual(types, 'config-owned')
+
+            shutil.rmtree(root)
+
         def test_pkg_avail(self):
             source = WebappSource(root = '/'.join((HERE, 'testfiles',
                                                    'share-webapps')),
@@ -260,6 +467,42 @@ class WebappSourceTest(unittest.TestCase):
             self.assertEqual(source.packageavail(), 0)
 
 
+class DaemonTest(unittest.TestCase):
+    def test_lock_key(self):
+        config = Config()
+        config.config.set('USER', 'vhost_hostname', 'localhost')
+        daemon = Daemon(config, '/nonexistent')
+
+        self.assertEqual(daemon.lock_key(['-I', 'www-apps/pma', '1.0']),
+                         ('install', 'localhost:pma'))
+        self.assertEqual(daemon.lock_key(['-C', 'pma', '1.0', '-h', 'web',
+                                          '-d', '//tools/pma/']),
+                         ('clean', 'web:tools/pma'))
+        self.assertEqual(daemon.lock_key(['--query', 'pma', '1.0']),
+                         ('query', None))
+        self.assertEqual(daemon.lock_key(['--list-installs'])[0], None)
+        self.assertEqual(daemon.lock_key(['-I', 'pma'])[0], None)
+
+
+    def test_reload(self):
+        OUT.color_off()
+        daemon = Daemon(Config(), '/nonexistent')
+        daemon.debounce = 0
+
+        async def run():
+            daemon.reload('sleep 0.5')
+            start = time.time()
+            await asyncio.sleep(0.1)
+            # Requests are still handled while the web server reloads
+            self.assertTrue(time.time() - start < 0.4)
+            await asyncio.sleep(0.6)
+
+        asyncio.run(run())
+
+        output = sys.stdout.getvalue().split('\n')
+        self.assertTrue('* Reloading the web server ("sleep 0.5")' in output)
+
+
 class DotConfigTest(unittest.TestCase):
     def test_has_dotconfig(self):
         dotconf = DotConfig('/'.join((HERE, 'testfiles', 'htdocs', 'horde')))
@@ -275,6 +518,15 @@ class DotConfigTest(unittest.TestCase):
         dotconf = DotConfig('/'.join((HERE, 'testfiles', 'htdocs', 'complain')))
         self.assertEqual(dotconf.is_empty(), '!morecontents .webapp-cool-1.1.1')
 
+    def test_read(self):
+        dotconf = DotConfig('/'.join((HERE, 'testfiles', 'htdocs', 'horde')))
+        dotconf.read()
+        self.assertEqual(dotconf.packagename(), 'horde-3.0.5')
+        self.assertEqual(dotconf['WEB_INSTALLEDDATE'], '2005-08-21 10:15:23')
+        self.assertEqual(dotconf['WEB_INSTALLEDFOR'], 'root:root')
+        # Old files do not specify a category:
+        self.assertEqual(dotconf['WEB_CATEGORY'], '')
+
     def test_show_installed(self):
         dotconf = DotConfig('/'.join((HERE, 'testfiles', 'htdocs', 'horde')))
         dotconf.show_installed()
@@ -368,6 +620,123 @@ class FileTypeTest(unittest.TestCase):
         self.assertEqual(types.dirtype('foo.txt'), 'default-owned')
 
 
+    def test_subtrees(self):
+        config_owned = ('htdocs/config.php', 'htdocs/cache/x.conf')
+        server_owned = ('htdocs/cache/**', 'htdocs/upload/ ', '', 'data/**/')
+
+        types = FileType(config_owned, server_owned)
+
+        # A subtree rule covers the directory and everything below it:
+        self.assertEqual(types.dirtype('htdocs/cache'),       'server-owned')
+        self.assertEqual(types.dirtype('htdocs/cache/a/b'),   'server-owned')
+        self.assertEqual(types.filetype('htdocs//cache/a/f'), 'server-owned')
+        self.assertEqual(types.filetype('data/f'),            'server-owned')
+        # Rules for the same path combine:
+        self.assertEqual(types.filetype('htdocs/cache/x.conf'),
+                         'config-server-owned')
+        # Exact rules still only match the exact path:
+        self.assertEqual(types.filetype('htdocs/upload/f'),   'virtual')
+        self.assertEqual(types.dirtype('htdocs/upload'),      'server-owned')
+        self.assertEqual(types.dirtype('htdocs/cachet'),      'default-owned')
+        self.assertEqual(types.filetype('htdocs/config.php'), 'config-owned')
+
+
+    def test_patterns(self):
+        config_owned = ('*/config.inc.php', 'htdocs/locale/*/conf[ig].php',
+                        'htdocs/[old]?.php')
+        server_owned = ('/htdocs/cache/**', 'htdocs/*/tmp/**')
+
+        types = FileType(config_owned, server_owned)
+
+        self.assertEqual(types.filetype('htdocs/config.inc.php'),
+                         'config-owned')
+        self.assertEqual(types.filetype('htdocs/plugins/a/config.inc.php'),
+                         'config-owned')
+        self.assertEqual(types.filetype('config.inc.php'), 'virtual')
+        self.assertEqual(types.filetype('htdocs/locale/de/confg.php'),
+                         'config-owned')
+        self.assertEqual(types.filetype('htdocs/locale/de/conf.php'),
+                         'virtual')
+
+        # Entries without "*" are literal paths:
+        self.assertEqual(types.filetype('htdocs/[old]?.php'), 'config-owned')
+        self.assertEqual(types.filetype('htdocs/o1.php'),     'virtual')
+
+        # A leading slash does not matter for subtrees and patterns:
+        self.assertEqual(types.dirtype('htdocs/cache'),       'server-owned')
+        self.assertEqual(types.filetype('htdocs/cache/config.inc.php'),
+                         'config-server-owned')
+        self.assertEqual(types.filetype('htdocs/a/tmp/f'),    'server-owned')
+        self.assertEqual(types.dirtype('htdocs/a/tmp'),       'server-owned')
+        self.assertEqual(types.dirtype('htdocs/a/b'),         'default-owned')
+
+
+class NSSCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        calls = []
+        def lookup(key):
+            calls.append(key)
+            if key == 'nobody':
+                raise KeyError(key)
+            return 42
+
+        cache = NSSCache()
+        for i in range(3):
+            self.assertEqual(cache.lookup('user', 'web', lookup), 42)
+            self.assertRaises(KeyError, cache.lookup, 'user', 'nobody',
+                              lookup)
+        self.assertEqual(calls, ['web', 'nobody'])
+
+        cache.ttl = 0.01
+        time.sleep(0.05)
+        cache.lookup('user', 'web', lookup)
+        self.assertEqual(calls, ['web', 'nobody', 'web'])
+
+
+class PackageManagerTest(unittest.TestCase):
+    def test_installed(self):
+        loc = tempfile.mkdtemp()
+        os.makedirs(loc + '/pkg/www-servers/apache-2.4.58-r1')
+        os.makedirs(loc + '/pkg/www-servers/-MERGING-nginx-1.24.0')
+
+        pm = Portage(cache = loc, vdb = loc + '/pkg')
+        self.assertEqual(pm.installed('>=www-servers/apache-1.3'),
+                         ['www-servers/apache-2.4.58-r1'])
+        self.assertEqual(pm.installed('<www-servers/apache-2.4'), [])
+        self.assertEqual(pm.installed('nginx'), [])
+        self.assertTrue(os.path.isfile(loc + '/portage.json'))
+
+        # Answers are kept until the package database changes
+        os.makedirs(loc + '/pkg/www-servers/nginx-1.24.0')
+        os.utime(loc + '/pkg', (0, 0))
+        self.assertEqual(Portage(cache = loc, vdb = loc + '/pkg')
+                         .installed('nginx'), ['www-servers/nginx-1.24.0'])
+
+        for i in ['apache-2.4.58-r1', '-MERGING-nginx-1.24.0',
+                  'nginx-1.24.0']:
+            os.rmdir(loc + '/pkg/www-servers/' + i)
+        os.rmdir(loc + '/pkg/www-servers')
+        os.rmdir(loc + '/pkg')
+        os.unlink(loc + '/portage.json')
+        os.rmdir(loc)
+
+    def test_vdb_root(self):
+        # Backends need to answer all questions
+        self.assertRaises(TypeError, PackageManager)
+
+        class Rooted(PackageManager):
+            def root(self, cat = '', pn = ''):
+                return '/chroot'
+            def config_protect(self, cat = '', pn = ''):
+                return ''
+            def installed(self, atom):
+                return []
+
+        self.assertEqual(Rooted(cache = None).vdb.root[:len('/chroot/')],
+                         '/chroot/')
+        self.assertTrue(Rooted(cache = None).vdb.root.endswith('/var/db/pkg'))
+
+
 class ProtectTest(unittest.TestCase):
     def test_getprotectedname(self):
         pro = Protection('', 'horde', '3.0.5', 'portage')
@@ -379,6 +748,23 @@ class ProtectTest(unittest.TestCase):
                         '/'.join((HERE, 'testfiles', 'protect', 'empty',
                                   '/._cfg0000_test')))
 
+        # Numbers are handed out from memory once a directory is known:
+        self.assertEqual(pro.get_protectedname('/'.join((HERE,
+                                                         'testfiles',
+                                                         'protect',
+                                                         'empty')),
+                                               'test'),
+                        '/'.join((HERE, 'testfiles', 'protect', 'empty',
+                                  '/._cfg0001_test')))
+
+        self.assertEqual(pro.get_protectedname('/'.join((HERE,
+                                                         'testfiles',
+                                                         'protect',
+                                                         'complex')),
+                                               'test'),
+                        '/'.join((HERE, 'testfiles', 'protect', 'complex',
+                                  '/._cfg0801_test')))
+
     def test_dirisconfprotected(self):
         pro = Protection('', 'horde', '3.0.5', 'portage')
         strange_htdocs = '/'.join(('/my', 'strange', 'htdocs'))
@@ -419,8 +805,313 @@ class ProtectTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
 
         self.assertEqual(output[8], '* etc-update')
+
+        # Subdirectories are reported through their parent only:
+        pro = Protection('', 'horde', '3.0.5', 'portage')
+        pro.how_to_update(['/srv/b/inc', '/srv/a-b', '/srv/b//', '/srv/a',
+                           '/srv/a/x'])
+        output = sys.stdout.getvalue().split('\n')
+
+        self.assertEqual(output[12:15],
+                         ['* CONFIG_PROTECT="/srv/a" etc-update',
+                          '* CONFIG_PROTECT="/srv/a-b" etc-update',
+                          '* CONFIG_PROTECT="/srv/b" etc-update'])
         
 
+class JournalTest(unittest.TestCase):
+    def test_resume(self):
+        OUT.color_off()
+        loc = tempfile.mkdtemp()
+        with open(loc + '/test1', 'w') as f:
+            f.write('test1')
+
+        contents = Contents(loc, category = 'app-misc', package = 'test',
+                            version = '1.0')
+        journal = Journal(loc)
+        journal.begin('install', contents, 'app-misc/test-0.9')
+        contents.add('file', 'virtual', destination = loc, path = '/test1',
+                     real_path = loc + '/test1', relative = True)
+        journal.abort('install')
+
+        self.assertTrue(journal.exists())
+        header, records = journal.read()
+        self.assertEqual(header['action'], 'install')
+        self.assertEqual(header['version'], '1.0')
+        self.assertEqual(header['upgrade'], 'app-misc/test-0.9')
+        self.assertEqual([i[0] for i in records], ['add'])
+
+        # An interrupted install can not be resumed as a removal
+        self.assertRaises(SystemExit, journal.begin, 'clean', contents)
+
+        resumed = Contents(loc, category = 'app-misc', package = 'test',
+                           version = '1.0')
+        journal.begin('install', resumed)
+        self.assertTrue(resumed.resumed(loc + '/test1'))
+        self.assertEqual(resumed.get_files(), [loc + '/test1'])
+
+        journal.commit()
+        self.assertFalse(journal.exists())
+
+        os.unlink(loc + '/test1')
+        os.rmdir(loc)
+
+
+class QueryCacheTest(unittest.TestCase):
+    def test_cache(self):
+        loc = tempfile.mkdtemp()
+        cache = QueryCache(cache = loc, size = 2)
+        keys = [cache.key({'pn' : 'foo', 'pvr' : str(i)}) for i in range(3)]
+        self.assertEqual(len(set(keys)), 3)
+
+        for key in keys:
+            cache.put(key, [['PVR', key]])
+
+        # Only the most recent results are kept on disk
+        cache = QueryCache(cache = loc, size = 2)
+        self.assertEqual(cache.get(keys[0]), None)
+        self.assertEqual(cache.get(keys[2]), [['PVR', keys[2]]])
+
+        os.unlink(loc + '/query.json')
+        os.rmdir(loc)
+
+
+class ApiTest(unittest.TestCase):
+    def test_errors(self):
+        error_out = OUT.error_out
+
+        # Depending on the configuration file of the host this fails
+        # reading the configuration or parsing the arguments
+        try:
+            CONTEXT.run(['-I', 'foo'])
+            self.fail('No exception raised')
+        except ConfigurationError as e:
+            self.assertTrue('configuration file' in str(e))
+        except UsageError as e:
+            self.assertEqual(e.status, 2)
+            self.assertTrue('expected 2 arguments' in str(e))
+
+        self.assertFalse(OUT.has_error)
+        self.assertEqual(OUT.error_out, error_out)
+
+    def test_usage(self):
+        # Invalid arguments are reported as such, unless the configuration
+        # file of the host cannot be read first
+        for args in [['--query', 'foo'], ['-li', 'a', 'b', 'c'],
+                     ['-I', 'foo', 'abc'], ['-I', 'a/b/c', '1.0'], []]:
+            try:
+                CONTEXT.run(args)
+                self.fail('No exception raised for ' + ' '.join(args))
+            except ConfigurationError as e:
+                self.assertTrue('configuration file' in str(e))
+            except UsageError as e:
+                self.assertEqual(e.status, 2)
+
+
+class BatchTest(unittest.TestCase):
+    def test_run(self):
+        OUT.color_off()
+        (fd, path) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('# install\n-I foo\n\n--batch ' + path + '\n'
+                    '--bat=' + path + '\n--daem\n')
+
+        batch = Batch(path)
+        self.assertEqual(batch.run(), 1)
+        self.assertEqual([i['line'] for i in batch.results
+                          if i['status']], [2, 4, 5, 6])
+        for i in batch.results[1:]:
+            self.assertTrue('cannot start another batch' in i['output'])
+
+        output = sys.stdout.getvalue().split('\n')
+        self.assertTrue('4 operations, 4 failed.' in output)
+
+        os.unlink(path)
+
+
+class ConfigTest(unittest.TestCase):
+    def test_startup(self):
+        # Setting up the configuration must neither resolve the host name
+        # nor import the modules only needed by some actions
+        script = ('import sys\n'
+                  'from WebappConfig.config import Config\n'
+                  'Config()\n'
+                  'print(sorted(set(sys.modules) & set(sys.argv[1:])))\n')
+        modules = ['socket', 'inspect', 'subprocess',
+                   'WebappConfig.server', 'WebappConfig.pkgmgr']
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(HERE))
+        output = subprocess.check_output([sys.executable, '-c', script]
+                                         + modules, env = env)
+        self.assertEqual(output.decode().strip(), '[]')
+
+    def test_lazy_default(self):
+        config = Config()
+        self.assertFalse('\0' in config.config.get('USER', 'vhost_root'))
+        self.assertEqual(config.config.get('USER', 'vhost_root'),
+                         '/var/www/'
+                         + config.config.get('USER', 'vhost_hostname'))
+
+    def test_invalidate(self):
+        config = Config().config
+        config.set('USER', 'pn', 'foo')
+        config.set('USER', 'pvr', '1.0')
+        config.set('USER', 'my_appsuffix', '${pn}/${pvr}')
+        config.set('USER', 'vhost_hostname', 'localhost')
+        self.assertEqual(config.get('USER', 'my_appdir'),
+                         '/usr/share/webapps/foo/1.0')
+        self.assertEqual(config.get('USER', 'vhost_root'), '/var/www/localhost')
+
+        # Only the values built from the changed option are interpolated
+        # again
+        read = []
+        config.uses = lambda names: read.append(names)
+        config.set('USER', 'pvr', '2.0')
+        self.assertEqual(config.get('USER', 'vhost_root'), '/var/www/localhost')
+        self.assertEqual(read, [])
+        self.assertEqual(config.get('USER', 'my_appdir'),
+                         '/usr/share/webapps/foo/2.0')
+        self.assertNotEqual(read, [])
+
+
+class ConfigMergeTest(unittest.TestCase):
+    def test_merge(self):
+        OUT.color_off()
+        loc = '/'.join((HERE, 'testfiles', 'merge'))
+        merge = ConfigMerge(loc + '/1.0/htdocs', [loc + '/install'],
+                            pretend = True)
+
+        self.assertEqual(merge.run(),
+                         [loc + '/install/._cfg0000_conflict.conf'])
+
+        output = sys.stdout.getvalue().split('\n')
+        self.assertEqual(output[0], '*     would have merged "' + loc +
+                                    '/install/._cfg0000_clean.conf"')
+        self.assertEqual(output[2], '* 1 of 2 config protected files merged.')
+
+    def test_merge_files(self):
+        OUT.color_off()
+        loc = tempfile.mkdtemp()
+        shutil.copytree('/'.join((HERE, 'testfiles', 'merge', 'install')),
+                        loc + '/install')
+        install = loc + '/install'
+
+        # A stale protected file of an earlier upgrade
+        os.rename(install + '/._cfg0000_clean.conf',
+                  install + '/._cfg0001_clean.conf')
+        with open(install + '/._cfg0000_clean.conf', 'w') as f:
+            f.write('stale\n')
+
+        # A virtual install nested in the first one
+        os.mkdir(install + '/nested')
+        for i in ['.webapp', 'clean.conf', '._cfg0000_clean.conf']:
+            shutil.copy(install + '/clean.conf', install + '/nested/' + i)
+
+        merge = ConfigMerge('/'.join((HERE, 'testfiles', 'merge', '1.0',
+                                      'htdocs')), [install])
+
+        self.assertEqual(merge.run(), [install + '/._cfg0000_conflict.conf'])
+
+        with open(install + '/clean.conf') as f:
+            self.assertEqual(f.read(), 'host = db.example.org\nuser = web\n'
+                                       'debug = 0\ncache = 1\n')
+
+        self.assertEqual(sorted(os.listdir(install)),
+                         ['._cfg0000_conflict.conf', 'clean.conf',
+                          'conflict.conf', 'nested'])
+        self.assertTrue(os.path.isfile(install
+                                       + '/nested/._cfg0000_clean.conf'))
+
+        shutil.rmtree(loc)
+
+
+class ReloadQueueTest(unittest.TestCase):
+    def test_coalesce(self):
+        OUT.color_off()
+        queue = ReloadQueue()
+        queue.request('nginx -s reload', pretend = True)
+        queue.request('', pretend = True)
+        queue.request('nginx -s reload', pretend = True)
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(queue.pending(), [])
+
+        output = sys.stdout.getvalue().strip('\n').split('\n')
+        self.assertEqual(output, ['*     would have reloaded the web server'
+                                  ' ("nginx -s reload")'])
+
+    def test_debounce(self):
+        queue = ReloadQueue(debounce = 0.05)
+        queue.request('true')
+        self.assertEqual(queue.pending(), ['true'])
+
+        time.sleep(0.5)
+        self.assertEqual(queue.pending(), [])
+
+
+class SandboxTest(unittest.TestCase):
+    def test_spawn(self):
+        loc = tempfile.mkdtemp()
+        with open(loc + '/run', 'w') as f:
+            f.write('#!/bin/sh\nexec /bin/sh -c "$1"\n')
+        os.chmod(loc + '/run', 0o755)
+
+        sandbox = Sandbox(Config())
+        sandbox.sandbox_binary = loc + '/run'
+
+        self.assertEqual(sandbox.spawn('echo hook; exit 3', {},
+                                       logfile = loc + '/log'), 3)
+        self.assertFalse(sandbox.timedout)
+        with open(loc + '/log') as f:
+            self.assertEqual(f.read().split('\n')[1:], ['hook', ''])
+
+        # Descriptors other than stdin, stdout and stderr are closed
+        fd = os.open(loc + '/log', os.O_RDONLY)
+        os.set_inheritable(fd, True)
+        self.assertEqual(sandbox.spawn('test -e /dev/fd/' + str(fd), {}), 1)
+        os.close(fd)
+
+        start = time.time()
+        self.assertNotEqual(sandbox.spawn('sleep 10', {}, timeout = 0.2), 0)
+        self.assertTrue(sandbox.timedout)
+        self.assertTrue(time.time() - start < 5)
+
+        os.unlink(loc + '/log')
+        os.unlink(loc + '/run')
+        os.rmdir(loc)
+
+
+    def test_namespace(self):
+        loc = tempfile.mkdtemp()
+        os.mkdir(loc + '/rw')
+        os.mkdir(loc + '/ro')
+
+        # Without the sandbox binary only SANDBOX_WRITE is writable
+        sandbox = Sandbox(Config())
+        sandbox.sandbox_binary = loc + '/sandbox'
+        env = {'SANDBOX_WRITE' : loc + '/rw:/dev/null'}
+
+        self.assertEqual(sandbox.spawn('touch ' + loc + '/rw/file', env), 0)
+        self.assertEqual(sandbox.spawn('touch ' + loc + '/ro/file 2>/dev/null',
+                                       env), 1)
+        self.assertFalse(os.path.exists(loc + '/ro/file'))
+
+        os.unlink(loc + '/rw/file')
+        os.rmdir(loc + '/rw')
+        os.rmdir(loc + '/ro')
+        os.rmdir(loc)
+
+
+class ServerRegistryTest(unittest.TestCase):
+    def test_dropins(self):
+        registry = ServerRegistry('/'.join((HERE, 'testfiles', 'servers')))
+
+        self.assertEqual(registry.names()[0], 'apache')
+        self.assertEqual(registry.names()[-1], 'localfpm')
+        self.assertEqual(registry.load('localfpm').name, 'LocalFpm')
+        self.assertTrue(issubclass(registry.load('apache'), Basic))
+        self.assertEqual(registry.load('iis'), None)
+
+
 class WebappAddTest(unittest.TestCase):
     def test_mk(self):
         OUT.color_off()
@@ -485,6 +1176,91 @@ class WebappAddTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
         self.assertEqual(output[20], '^o^ hiding /test3')
 
+    def test_mk_identical(self):
+        OUT.color_off()
+        installdir = '/'.join((HERE, 'testfiles', 'cfgtest'))
+        contents = Contents(installdir, pretend = True)
+        webrm = WebappRemove(contents, True, True)
+        protect = Protection('', 'cfgtest', '1.0', 'static')
+        source = WebappSource(root = '/'.join((HERE, 'testfiles',
+                                             'share-cfgtest')),
+                              category = '', package = 'cfgtest',
+                              version = '1.0')
+        source.read()
+
+        webadd = WebappAdd('htdocs', installdir,
+                           {'file': {'config-owned': ('nobody',
+                                                      'nobody',
+                                                      '0600')}},
+                           {'content': contents,
+                            'removal': webrm,
+                            'protect': protect,
+                            'source' : source},
+                           {'relative': 1,
+                            'upgrade' : False,
+                            'pretend' : True,
+                            'verbose' : False,
+                            'linktype': 'soft'})
+        webadd.mkfile('conf')
+
+        output = sys.stdout.getvalue().split('\n')
+        self.assertEqual(output[0], '*     would have replaced "' +
+                                    installdir + '/conf"')
+        self.assertEqual(output[1], '*     pretending to add: file 1 ' +
+                                    'config-owned "conf"')
+        self.assertEqual(webadd.config_protected_dirs, [])
+
+
+    def test_mk_unmodified(self):
+        OUT.color_off()
+        installdir = tempfile.mkdtemp()
+        with open(installdir + '/conf', 'w') as f:
+            f.write('old\n')
+
+        # The contents of the version being upgraded
+        previous = Contents(installdir)
+        previous.add('file', 'config-owned', destination = installdir,
+                     path = '/conf', real_path = installdir + '/conf',
+                     relative = True)
+
+        contents = Contents(installdir, pretend = True)
+        source = WebappSource(root = '/'.join((HERE, 'testfiles',
+                                             'share-cfgtest')),
+                              category = '', package = 'cfgtest',
+                              version = '1.0')
+        source.read()
+
+        webadd = WebappAdd('htdocs', installdir,
+                           {'file': {'config-owned': ('nobody',
+                                                      'nobody',
+                                                      '0600')}},
+                           {'content' : contents,
+                            'removal' : WebappRemove(contents, True, True),
+                            'protect' : Protection('', 'cfgtest', '1.0',
+                                                   'static'),
+                            'source'  : source,
+                            'previous': previous},
+                           {'relative': 1,
+                            'upgrade' : False,
+                            'pretend' : True,
+                            'verbose' : False,
+                            'linktype': 'soft'})
+        webadd.mkfile('conf')
+
+        output = sys.stdout.getvalue().split('\n')
+        self.assertEqual(output[0], '*     would have replaced "' +
+                                    installdir + '/conf"')
+        self.assertEqual(webadd.config_protected_dirs, [])
+
+        # A modified file is hidden
+        with open(installdir + '/conf', 'w') as f:
+            f.write('changed\n')
+        webadd.mkfile('conf')
+        self.assertEqual(webadd.config_protected_dirs, [installdir + '/'])
+
+        os.unlink(installdir + '/conf')
+        os.rmdir(installdir)
+
 
 class WebappRemoveTest(unittest.TestCase):
     def test_remove_files(self):
@@ -0,0 +1,7 @@
+from WebappConfig.server import Basic
+
+class Server(Basic):
+
+    name   = 'LocalFpm'
+    desc   = 'supports installation for a local php-fpm pool'
+    dep    = ''
@@ -23,6 +23,7 @@ files of a virtual install location.  '''
 
 import sys, os, os.path, shutil, stat, re
 
+from WebappConfig.compat   import create_md5
 from WebappConfig.debug    import OUT
 
 # ========================================================================
@@ -163,6 +164,7 @@ class WebappAdd:
         self.__content   = handler['content']
         self.__remove    = handler['removal']
         self.__protect   = handler['protect']
+        self.__previous  = handler.get('previous')
         self.__link_type = flags['linktype']
         self.__relative  = flags['relative']
         self.__u         = flags['upgrade']
@@ -271,6 +273,38 @@ class WebappAdd:
                            directory,
                            self.__relative)
 
+    def replaceable(self, filename):
+        '''
+        Checks whether an existing, config protected file may simply be
+        replaced instead of hiding the new version behind a ._cfg name.
+        This is the case if the new file is identical to the existing one
+        or if the existing file still matches the md5 hash recorded in
+        the contents of the version being upgraded. The removal of that
+        version leaves such files behind if only their modification time
+        changed.
+
+        filename    - name of the file
+        '''
+
+        src_name = re.compile('/+').sub('/', self.__ws.appdir() + '/'
+                                        + self.__sourced + '/' + filename)
+        dst_name = re.compile('/+').sub('/', self.__destd + '/' + filename)
+
+        if (os.path.islink(dst_name) or not os.path.isfile(dst_name)
+                or os.path.islink(src_name) or not os.path.isfile(src_name)):
+            return False
+
+        if create_md5(dst_name) == create_md5(src_name):
+            OUT.debug('Existing file is identical', 7)
+            return True
+
+        if self.__previous and self.__previous.unmodified(dst_name):
+            if self.__v:
+                OUT.notice('>>> replacing unmodified ' + filename)
+            return True
+
+        return False
+
     def mkfile(self, filename):
         '''
         This is what we are all about.  No more games - lets take a file
@@ -284,6 +318,12 @@ class WebappAdd:
         OUT.debug('Creating file', 6)
 
         dst_name  = self.__destd + '/' + filename
+
+        # already installed by an interrupted run?
+        if self.__content.resumed(re.compile('/+').sub('/', dst_name)):
+            OUT.debug('File already installed', 7)
+            return
+
         file_type = self.__ws.filetype(self.__sourced + '/' + filename)
 
         OUT.debug('File type determined', 7)
@@ -308,6 +348,13 @@ class WebappAdd:
             elif file_type[0:6] == 'config':
                 my_canremove = False
 
+            # ... unless the new file would not change anything or the
+            # old one still has the content we installed
+            my_replace = not my_canremove and self.replaceable(filename)
+
+            if my_replace:
+                my_canremove = True
+
             if not my_canremove:
                 # not able to remove the file
                 #           or
@@ -334,6 +381,8 @@ class WebappAdd:
                         os.rmdir(dst_name)
                     else:
                         os.unlink(dst_name)
+                elif my_replace:
+                    OUT.info('    would have replaced "' + dst_name + '"')
                 else:
                     OUT.info('    would have removed "' +  dst_name + '" s'
                              'ince it is in the way for the current instal'
@@ -24,10 +24,6 @@ to use the tool on other distributions.
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os
-
-from WebappConfig.debug       import OUT
-
 from WebappConfig.debug   import OUT
 from WebappConfig.version import WCVERSION
 
@@ -43,26 +39,9 @@ bugs_link  = 'http://bugs.gentoo.org/'
 
 def config_protect(cat, pn, pvr, pm):
     '''Return CONFIG_PROTECT (used by protect.py)'''
-    if pm == "portage":
-        try:
-            import portage
-        except ImportError as e:
-            OUT.die("Portage libraries not found, quitting:\n%s" % e)
-
-        return portage.settings['CONFIG_PROTECT']
-
-    elif pm == "paludis":
-        cmd="cave print-id-environment-variable -b --format '%%v\n' --variable-name CONFIG_PROTECT %s/%s" % (cat,pn)
+    from WebappConfig.pkgmgr import backend
 
-        fi, fo, fe = os.popen3(cmd)
-        fi.close()
-        result_lines = fo.readlines()
-        fo.close()
-        fe.close()
-
-        return ' '.join(result_lines).strip()
-    else:
-        OUT.die("Unknown package manager: " + pm)
+    return backend(pm).config_protect(cat, pn)
 
 def config_libdir(pm):
     OUT.die("I shouldn't get called at all")
@@ -84,80 +63,20 @@ def want_category(config):
 
 def get_root(config):
     '''Returns the $ROOT variable'''
-    if config.config.get('USER', 'package_manager') == "portage":
-        try:
-            import portage
-        except ImportError as e:
-            OUT.die("Portage libraries not found, quitting:\n%s" % e)
+    from WebappConfig.pkgmgr import backend
 
-        return portage.settings['ROOT']
-
-    elif config.config.get('USER', 'package_manager') == "paludis":
-        cat = config.maybe_get('cat')
-        pn  = config.maybe_get('pn')
-
-        if cat and pn:
-            cmd="cave print-id-environment-variable -b --format '%%v\n' --variable-name ROOT %s/%s" % (cat,pn)
-
-            fi, fo, fe = os.popen3(cmd)
-            fi.close()
-            result_lines = fo.readlines()
-            fo.close()
-            fe.close()
-
-            if result_lines[0].strip():
-                return result_lines[0].strip()
-            else:
-                return '/'
-        else:
-            return '/'
-    else:
-        OUT.die("Unknown package manager: " + pm)
+    return backend(config.config.get('USER', 'package_manager')).root(
+        config.maybe_get('cat'), config.maybe_get('pn'))
 
 def package_installed(full_name, pm):
     '''
-    This function identifies installed packages.
-    The Portage part is stolen from gentoolkit.
-    We are not using gentoolkit directly as it doesn't seem to support ${ROOT}
+    This function identifies installed packages. Simple queries are
+    answered from the installed package database without asking the
+    package manager.
     '''
+    from WebappConfig.pkgmgr import backend
 
-    if pm == "portage":
-        try:
-            import portage
-        except ImportError as e:
-            OUT.die("Portage libraries not found, quitting:\n%s" % e)
-
-        try:
-             t = portage.db[portage.root]["vartree"].dbapi.match(full_name)
-        # catch the "ambiguous package" Exception
-        except ValueError as e:
-            if isinstance(e[0], list):
-                t = []
-                for cp in e[0]:
-                    t += portage.db[portage.root]["vartree"].dbapi.match(cp)
-            else:
-                raise ValueError(e)
-        return t
-
-    elif pm == "paludis":
-
-        cmd="cave print-best-version '%s'" % (full_name)
-
-        fi, fo, fe = os.popen3(cmd)
-        fi.close()
-        result_lines = fo.readlines()
-        error_lines  = fe.readlines()
-        fo.close()
-        fe.close()
-
-        if error_lines:
-            for i in error_lines:
-                OUT.warn(i)
-
-        return ' '.join(result_lines)
-
-    else:
-        OUT.die("Unknown package manager: " + pm)
+    return backend(pm).installed(full_name)
 
 if __name__ == '__main__':
     OUT.info('\nPACKAGE MANAGER WRAPPER')